@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks of etc.  Run it offline::
+
+   $ python bench.py
+   $ python bench.py decode mock --json results.json
+
+Each benchmark prints a line and returns its metrics.  The metrics of all
+benchmarks are written as JSON by ``--json`` to track regressions.
+
+"""
+from __future__ import print_function
+
+import argparse
+from collections import deque, OrderedDict
+import json
+import platform
+import sys
+import threading
+import time
+
+from six.moves import xrange
+
+import etc
+from etc.adapters.coalescing import CoalescingAdapter
+from etc.adapters.etcd import EtcdAdapter, json_loads
+from etc.adapters.mock import split_key
+from etc.metrics import Metrics
+from etc.recipes import Lock, Queue
+from etc.server import MockServer
+
+
+#: Benchmark functions by their names in order.
+benches = OrderedDict()
+
+
+def bench(f):
+    """Registers a benchmark function."""
+    benches[f.__name__[len('bench_'):]] = f
+    return f
+
+
+def make_tree(keys, width=100, ttl_ratio=0.1, prefix=u''):
+    """Makes a response of a recursive get which has `keys` values.  Each
+    directory has up to `width` sub nodes.
+    """
+    def node(key, index):
+        data = {'key': key, 'modifiedIndex': index, 'createdIndex': index}
+        if index % int(1 / ttl_ratio) == 0:
+            data.update(ttl=60, expiration='2017-01-01T00:00:00.123456789Z')
+        return data
+    index = [0]
+    def make(key, keys):
+        data = node(key, index[0])
+        data['dir'] = True
+        if keys <= width:
+            nodes = []
+            for x in xrange(keys):
+                index[0] += 1
+                value = node(u'%s/%d' % (key, x), index[0])
+                value['value'] = u'value-%d' % x
+                nodes.append(value)
+        else:
+            sub_keys = keys // width
+            nodes = [make(u'%s/%d' % (key, x), sub_keys)
+                     for x in xrange(width)]
+        data['nodes'] = nodes
+        return data
+    root = make(prefix, keys)
+    del root['key'], root['modifiedIndex'], root['createdIndex']
+    return {'action': 'get', 'node': root}
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * p), len(samples) - 1)]
+
+
+def timeit(f, seconds=1):
+    """Calls the function repeatedly for about the given seconds.  Returns
+    the best elapsed time.
+    """
+    best = None
+    deadline = time.time() + seconds
+    while True:
+        started_at = time.time()
+        f()
+        elapsed = time.time() - started_at
+        best = elapsed if best is None else min(best, elapsed)
+        if time.time() >= deadline:
+            return best
+
+
+def rate(count, f, seconds=1):
+    """Calls the function for each of `count` items and returns the best
+    items per second.
+    """
+    return count / timeit(f, seconds)
+
+
+@bench
+def bench_decode(shapes=((10000, 10000), (200000, 100), (100000, 10))):
+    """Decodes recursive get responses of several sizes and widths.  A
+    narrow tree is deep.
+    """
+    headers = {'X-Etcd-Index': '1', 'X-Raft-Index': '1', 'X-Raft-Term': '1'}
+    metrics = {}
+    for keys, width in shapes:
+        data = make_tree(keys, width)
+        content = json.dumps(data).encode('utf-8')
+        parse = timeit(lambda: json_loads(content))
+        build = timeit(lambda: EtcdAdapter.make_result(data, headers))
+        print('decode %d keys by %d: json %.0f keys/s, make_result %.0f '
+              'keys/s, total %.0f keys/s' % (keys, width, keys / parse,
+                                             keys / build,
+                                             keys / (parse + build)))
+        shape = '%d_by_%d' % (keys, width)
+        metrics['json_%s' % shape] = keys / parse
+        metrics['make_result_%s' % shape] = keys / build
+    data = make_tree(1)['node']['nodes'][0]
+    metrics['make_node'] = rate(10000, lambda: [
+        EtcdAdapter.make_node(data) for x in xrange(10000)])
+    print('decode a value: make_node %.0f nodes/s' % metrics['make_node'])
+    return metrics
+
+
+@bench
+def bench_split_key(depths=(1, 5, 20), count=100000):
+    metrics = {}
+    for depth in depths:
+        key = u'/' + u'/'.join(u'chunk%d' % x for x in xrange(depth))
+        metrics['depth_%d' % depth] = rate(count, lambda: [
+            split_key(key) for x in xrange(count)])
+    print('split_key: ' + ', '.join('depth %d %.0f keys/s' % (
+        depth, metrics['depth_%d' % depth]) for depth in depths))
+    return metrics
+
+
+@bench
+def bench_mock(count=20000):
+    """Requests each operation to a mock :attr:`count` times."""
+    # The events of the sets are kept in the history to be waited.
+    etcd = etc.etcd(mock=True, history_size=count)
+    keys = [u'/bench/%d' % x for x in xrange(count)]
+    metrics = OrderedDict()
+    def measure(name, f):
+        started_at = time.time()
+        f()
+        metrics[name] = count / (time.time() - started_at)
+    measure('set', lambda: [etcd.set(key, u'value') for key in keys])
+    measure('get', lambda: [etcd.get(key) for key in keys])
+    measure('wait', lambda: [etcd.wait(u'/bench', x + 1, recursive=True)
+                             for x in xrange(count)])
+    measure('update', lambda: [etcd.set(key, u'value') for key in keys])
+    measure('delete', lambda: [etcd.delete(key) for key in keys])
+    measure('append', lambda: [etcd.append(u'/queue', u'item')
+                               for key in keys])
+    print('mock ops/s: ' + ', '.join('%s %.0f' % item
+                                     for item in metrics.items()))
+    return metrics
+
+
+@bench
+def bench_observe(count=20000):
+    """Gets from a mock without and with :class:`etc.metrics.Metrics`."""
+    etcd = etc.etcd(mock=True)
+    etcd.set(u'/bench', u'value')
+    def get():
+        return [etcd.get(u'/bench') for x in xrange(count)]
+    bare = rate(count, get)
+    etcd.observe(Metrics())
+    observed = rate(count, get)
+    print('observe: %.0f gets/s bare, %.0f gets/s with metrics' %
+          (bare, observed))
+    return {'bare': bare, 'metrics': observed}
+
+
+@bench
+def bench_client(count=2000, concurrency=10):
+    """Requests to a :class:`etc.server.MockServer` by
+    :class:`etc.Client`.  The latency of each request is measured one by one
+    and the throughput by concurrent batches.
+    """
+    server = MockServer()
+    server.start()
+    etcd = etc.etcd(server.url, pool_maxsize=concurrency)
+    try:
+        keys = [u'/bench/%d' % x for x in xrange(count)]
+        latencies = {'set': [], 'get': [], 'delete': []}
+        for method, args in [('set', (u'value',)), ('get', ()),
+                             ('delete', ())]:
+            for key in keys:
+                started_at = time.time()
+                getattr(etcd, method)(key, *args)
+                latencies[method].append(time.time() - started_at)
+        items = dict((key, u'value') for key in keys)
+        started_at = time.time()
+        for x in xrange(0, count, concurrency):
+            etcd.set_many(dict(items.popitem() for y in xrange(concurrency)))
+        batched = count / (time.time() - started_at)
+    finally:
+        etcd.adapter.clear()
+        server.stop()
+    metrics = OrderedDict()
+    for method in ['set', 'get', 'delete']:
+        metrics['%s_p50_ms' % method] = \
+            percentile(latencies[method], 0.5) * 1000
+        metrics['%s_p99_ms' % method] = \
+            percentile(latencies[method], 0.99) * 1000
+    metrics['set_many_per_s'] = batched
+    summary = ', '.join(
+        '%s p50 %.2fms p99 %.2fms' % (m, metrics['%s_p50_ms' % m],
+                                      metrics['%s_p99_ms' % m])
+        for m in ['set', 'get', 'delete'])
+    print('client over HTTP: %s, set_many by %d %.0f sets/s' %
+          (summary, concurrency, batched))
+    return metrics
+
+
+@bench
+def bench_watch(watchers=(10, 100, 500), rounds=5):
+    """Wakes many long-polling requests to a :class:`etc.server.MockServer`
+    at once.  The latency is from a set to the last delivery.
+    """
+    metrics = {}
+    for count in watchers:
+        server = MockServer()
+        server.start()
+        etcd = etc.etcd(server.url, wait_pool_maxsize=count)
+        latencies = []
+        try:
+            for x in xrange(rounds):
+                index = etcd.set(u'/bench', u'value').index + 1
+                delivered = []
+                def watch():
+                    etcd.wait(u'/bench', index)
+                    delivered.append(time.time())
+                threads = [threading.Thread(target=watch)
+                           for y in xrange(count)]
+                for thread in threads:
+                    thread.start()
+                # Until all watchers are waiting.
+                time.sleep(0.2 + count / 1000.)
+                set_at = time.time()
+                etcd.set(u'/bench', u'value')
+                for thread in threads:
+                    thread.join()
+                latencies.append(max(delivered) - set_at)
+        finally:
+            etcd.adapter.clear()
+            server.stop()
+        metrics['wake_%d_ms' % count] = percentile(latencies, 0.5) * 1000
+    print('watch over HTTP: ' + ', '.join(
+        'wake %d watchers %.1fms' % (c, metrics['wake_%d_ms' % c])
+        for c in watchers))
+    return metrics
+
+
+@bench
+def bench_coalesce(threads=100, rounds=20):
+    """Many threads get the same key from a :class:`etc.server.MockServer`
+    at once with and without :class:`etc.adapters.coalescing.
+    CoalescingAdapter`.  The latency is from the start to the last result.
+    """
+    server = MockServer()
+    server.start()
+    metrics = OrderedDict()
+    try:
+        for name in ['plain', 'coalesced']:
+            adapter = EtcdAdapter(server.url, pool_maxsize=threads)
+            if name == 'coalesced':
+                adapter = CoalescingAdapter(adapter)
+            etcd = etc.Client(adapter)
+            etcd.set(u'/bench', u'value')
+            latencies = []
+            for x in xrange(rounds):
+                started = threading.Event()
+                def get():
+                    started.wait()
+                    etcd.get(u'/bench')
+                workers = [threading.Thread(target=get)
+                           for y in xrange(threads)]
+                for worker in workers:
+                    worker.start()
+                started_at = time.time()
+                started.set()
+                for worker in workers:
+                    worker.join()
+                latencies.append(time.time() - started_at)
+            etcd.adapter.clear()
+            metrics['%s_ms' % name] = percentile(latencies, 0.5) * 1000
+        metrics['requests'] = adapter.requests
+        metrics['saved'] = adapter.saved
+    finally:
+        server.stop()
+    print('coalesce %d gets: plain %.1fms, coalesced %.1fms '
+          '(%d requests, %d saved)' % (threads, metrics['plain_ms'],
+                                       metrics['coalesced_ms'],
+                                       metrics['requests'], metrics['saved']))
+    return metrics
+
+
+@bench
+def bench_append(items=1000000, cycles=100000):
+    """Fills a queue in a mock by appends then pushes and pops at the same
+    time like a busy queue.
+    """
+    etcd = etc.etcd(mock=True)
+    etcd.set('/queue', dir=True)
+    keys = deque()
+    started_at = time.time()
+    for x in xrange(items):
+        keys.append(etcd.append('/queue', u'item').key)
+    fill = time.time() - started_at
+    started_at = time.time()
+    for x in xrange(cycles):
+        keys.append(etcd.append('/queue', u'item').key)
+        etcd.delete(keys.popleft())
+    cycle = time.time() - started_at
+    print('append %d items: %.0f appends/s, then %.0f push-pops/s' %
+          (items, items / fill, cycles / cycle))
+    return {'appends_per_s': items / fill, 'push_pops_per_s': cycles / cycle}
+
+
+@bench
+def bench_lock(contenders=100, rounds=10, etcd=None):
+    """Contends a lock by many threads.  The handoff latency is from a
+    release to the next acquisition.
+    """
+    if etcd is None:
+        etcd = etc.etcd(mock=True)
+    acquires, handoffs = [], []
+    released_at = [None]
+    def contend():
+        lock = Lock(etcd, '/bench/lock')
+        for x in xrange(rounds):
+            started_at = time.time()
+            lock.acquire()
+            acquired_at = time.time()
+            acquires.append(acquired_at - started_at)
+            if released_at[0] is not None:
+                handoffs.append(acquired_at - released_at[0])
+            released_at[0] = time.time()
+            lock.release()
+    threads = [threading.Thread(target=contend) for x in xrange(contenders)]
+    started_at = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started_at
+    print('lock by %d contenders: %.0f acquisitions/s, handoff p50 %.2fms '
+          'p99 %.2fms, acquire p50 %.1fms p99 %.1fms' % (
+              contenders, len(acquires) / elapsed,
+              percentile(handoffs, 0.5) * 1000,
+              percentile(handoffs, 0.99) * 1000,
+              percentile(acquires, 0.5) * 1000,
+              percentile(acquires, 0.99) * 1000))
+    return {'acquisitions_per_s': len(acquires) / elapsed,
+            'handoff_p50_ms': percentile(handoffs, 0.5) * 1000,
+            'handoff_p99_ms': percentile(handoffs, 0.99) * 1000,
+            'acquire_p50_ms': percentile(acquires, 0.5) * 1000,
+            'acquire_p99_ms': percentile(acquires, 0.99) * 1000}
+
+
+@bench
+def bench_queue(sizes=(1000, 10000, 100000), listings=20, dequeues=10000,
+                n=100):
+    """Dequeues from queues of several sizes by listing the directory for
+    each item and by :class:`etc.recipes.Queue`.
+    """
+    metrics = {}
+    for size in sizes:
+        etcd = etc.etcd(mock=True)
+        queue = Queue(etcd, '/queue')
+        queue.put_many([u'item'] * (size + listings + dequeues))
+        started_at = time.time()
+        for x in xrange(listings):
+            head = etcd.get('/queue', sorted=True).nodes[0]
+            etcd.delete(head.key, prev_index=head.modified_index)
+        listing = time.time() - started_at
+        # The first listing is not counted.
+        queue.start()
+        started_at = time.time()
+        count = 0
+        while count < dequeues:
+            count += len(queue.get_batch(n))
+        batched = time.time() - started_at
+        queue.stop()
+        print('dequeue from %d items: listing %.0f items/s, '
+              'get_batch(%d) %.0f items/s' % (size, listings / listing, n,
+                                              count / batched))
+        metrics['listing_%d' % size] = listings / listing
+        metrics['get_batch_%d' % size] = count / batched
+    return metrics
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of etc.')
+    parser.add_argument('names', nargs='*', metavar='name',
+                        help='benchmarks to run: %s (default: all)' %
+                             ', '.join(benches))
+    parser.add_argument('--json', metavar='path',
+                        help='writes the metrics as JSON ("-" for stdout)')
+    args = parser.parse_args(argv)
+    names = args.names or list(benches)
+    for name in names:
+        if name not in benches:
+            parser.error('unknown benchmark: %s' % name)
+    results = OrderedDict()
+    stdout = sys.stdout
+    if args.json == '-':
+        # Keeps stdout for the JSON report.
+        sys.stdout = sys.stderr
+    try:
+        for name in names:
+            results[name] = benches[name]()
+    finally:
+        sys.stdout = stdout
+    if args.json is None:
+        return
+    report = {'etc': etc.__version__,
+              'python': platform.python_version(),
+              'implementation': platform.python_implementation(),
+              'time': time.time(), 'results': results}
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
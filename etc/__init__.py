@@ -16,8 +16,10 @@
 """
 from __future__ import absolute_import
 
+import six
+
 from etc.__about__ import __version__  # noqa
-from etc.client import Client
+from etc.client import AsyncClient, Client
 from etc.errors import (
     ConnectionError, ConnectionRefused, DirNotEmpty, EtcdError, EtcException,
     EventIndexCleared, ExistingPeerAddr, HTTPError, IndexNaN,
@@ -36,7 +38,7 @@ __all__ = [
     # etc
     'etcd',
     # etc.client
-    'Client',
+    'AsyncClient', 'Client',
     # etc.errors
     'ConnectionError', 'ConnectionRefused', 'DirNotEmpty', 'EtcdError',
     'EtcException', 'EventIndexCleared', 'ExistingPeerAddr', 'IndexNaN',
@@ -57,12 +59,28 @@ __all__ = [
 DEFAULT_URL = 'http://127.0.0.1:4001'
 
 
-def etcd(url=DEFAULT_URL, mock=False, **kwargs):
-    """Creates an etcd client."""
+def etcd(url=DEFAULT_URL, mock=False, asyncio=False, **kwargs):
+    """Creates an etcd client.  If `asyncio` is ``True``, it creates an
+    :class:`AsyncClient` of which methods are coroutines.  If `url` is a list
+    or a comma-separated string of URLs, the client distributes requests to
+    them as the members of a cluster.  A cluster and a mock are not supported
+    with `asyncio`.
+    """
+    client_class = Client
+    cluster = not isinstance(url, six.string_types) or u',' in url
+    if asyncio and (mock or cluster):
+        raise ValueError('asyncio is not supported with %s' %
+                         ('mock' if mock else 'a cluster'))
     if mock:
         from etc.adapters.mock import MockAdapter
         adapter_class = MockAdapter
+    elif cluster:
+        from etc.adapters.cluster import ClusterAdapter
+        adapter_class = ClusterAdapter
+    elif asyncio:
+        from etc.adapters.aioetcd import AsyncEtcdAdapter
+        adapter_class, client_class = AsyncEtcdAdapter, AsyncClient
     else:
         from etc.adapters.etcd import EtcdAdapter
         adapter_class = EtcdAdapter
-    return Client(adapter_class(url, **kwargs))
+    return client_class(adapter_class(url, **kwargs))
@@ -10,11 +10,39 @@
 from __future__ import absolute_import
 
 import functools
+from multiprocessing.pool import ThreadPool
+import threading
 
 import six
 
+from etc.errors import EtcdError
+from etc.results import Directory, Value
+from etc.retry import NO_RETRY
 
-__all__ = ['Adapter']
+
+__all__ = ['Adapter', 'collect', 'iter_values', 'PooledAdapter',
+           'ProxyAdapter']
+
+
+def collect(call):
+    """Calls the function.  Returns an :exc:`etc.EtcdError` instead of raising
+    it.
+    """
+    try:
+        return call()
+    except EtcdError as exc:
+        return exc
+
+
+def iter_values(node):
+    """Iterates the values in the node tree in depth-first order."""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Value):
+            yield node
+        elif isinstance(node, Directory):
+            stack.extend(reversed(node.nodes))
 
 
 def with_verifier(verify, func):
@@ -63,6 +91,16 @@ class Adapter(six.with_metaclass(AdapterMeta)):
     def clear(self):
         pass
 
+    def add_observer(self, observer):
+        """Reports the transport of requests to an
+        :class:`etc.metrics.Observer`.  Override it if the adapter knows more
+        than the requests such as HTTP exchanges or retries.
+        """
+        pass
+
+    def remove_observer(self, observer):
+        pass
+
     def get(self, key, recursive=False, sorted=False, quorum=False,
             wait=False, wait_index=None, timeout=None):
         raise NotImplementedError
@@ -77,3 +115,110 @@ class Adapter(six.with_metaclass(AdapterMeta)):
     def delete(self, key, dir=False, recursive=False,
                prev_value=None, prev_index=None, timeout=None):
         raise NotImplementedError
+
+    def walk(self, key, sorted=False, quorum=False, timeout=None):
+        """Iterates the values under the key recursively.  Override it to
+        iterate values while receiving the response.
+        """
+        result = self.get(key, recursive=True, sorted=sorted, quorum=quorum,
+                          timeout=timeout)
+        return iter_values(result.node)
+
+    def batch(self, calls):
+        """Calls the functions which request to this adapter and returns the
+        results in the same order.  An :exc:`etc.EtcdError` is returned
+        instead of raised.  Override it to request concurrently.
+        """
+        return [collect(call) for call in calls]
+
+
+class ProxyAdapter(Adapter):
+    """An adapter which forwards requests to another adapter.  Override some
+    methods to intercept the requests.
+    """
+
+    def __init__(self, adapter):
+        super(ProxyAdapter, self).__init__(adapter.url)
+        self.adapter = adapter
+
+    def clear(self):
+        return self.adapter.clear()
+
+    def add_observer(self, observer):
+        return self.adapter.add_observer(observer)
+
+    def remove_observer(self, observer):
+        return self.adapter.remove_observer(observer)
+
+    def get(self, key, recursive=False, sorted=False, quorum=False,
+            wait=False, wait_index=None, timeout=None):
+        return self.adapter.get(key, recursive=recursive, sorted=sorted,
+                                quorum=quorum, wait=wait,
+                                wait_index=wait_index, timeout=timeout)
+
+    def set(self, key, value=None, dir=False, ttl=None, refresh=False,
+            prev_value=None, prev_index=None, prev_exist=None, timeout=None):
+        return self.adapter.set(key, value, dir=dir, ttl=ttl, refresh=refresh,
+                                prev_value=prev_value, prev_index=prev_index,
+                                prev_exist=prev_exist, timeout=timeout)
+
+    def append(self, key, value=None, dir=False, ttl=None, timeout=None):
+        return self.adapter.append(key, value, dir=dir, ttl=ttl,
+                                   timeout=timeout)
+
+    def delete(self, key, dir=False, recursive=False,
+               prev_value=None, prev_index=None, timeout=None):
+        return self.adapter.delete(key, dir=dir, recursive=recursive,
+                                   prev_value=prev_value,
+                                   prev_index=prev_index, timeout=timeout)
+
+    def walk(self, key, sorted=False, quorum=False, timeout=None):
+        return self.adapter.walk(key, sorted=sorted, quorum=quorum,
+                                 timeout=timeout)
+
+    def batch(self, calls):
+        return self.adapter.batch(calls)
+
+
+class PooledAdapter(Adapter):
+    """An adapter which requests a batch concurrently in a thread pool of
+    `max_workers` threads and retries failed requests by `retry_policy`, an
+    :class:`etc.retry.RetryPolicy`.  Call :meth:`close_pool` in
+    :meth:`clear`.
+    """
+
+    def __init__(self, url, max_workers=10, retry_policy=None):
+        super(PooledAdapter, self).__init__(url)
+        #: The number of threads to request a batch concurrently.
+        self.max_workers = max_workers
+        self.retry_policy = retry_policy or NO_RETRY
+        self.observers = []
+        self.pool = None
+        self.pool_lock = threading.Lock()
+
+    def close_pool(self):
+        with self.pool_lock:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool = None
+
+    def batch(self, calls):
+        """Requests a batch concurrently in a thread pool."""
+        calls = list(calls)
+        if len(calls) < 2:
+            return [collect(call) for call in calls]
+        with self.pool_lock:
+            if self.pool is None:
+                self.pool = ThreadPool(self.max_workers)
+            pool = self.pool
+        return pool.map(collect, calls)
+
+    def retry(self, call, method, key, idempotent=False):
+        """Calls the function by the retry policy.  Retries are reported to
+        the observers.
+        """
+        observers = self.observers
+        def on_retry(error):
+            for observer in observers:
+                observer.on_retry(method, key, error)
+        return self.retry_policy.call(call, idempotent, on_retry)
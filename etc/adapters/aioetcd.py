@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+   etc.adapters.aioetcd
+   ~~~~~~~~~~~~~~~~~~~~
+
+   The asyncio version of :class:`etc.adapters.etcd.EtcdAdapter`.  It
+   requires Python 3.6+ and aiohttp.
+
+"""
+from __future__ import absolute_import
+
+import asyncio
+import codecs
+import sys
+import time
+
+import aiohttp
+import six
+from six.moves.urllib.parse import urlencode
+
+from etc.adapter import Adapter
+from etc.adapters.etcd import EtcdAdapter, json_loads, LeafScanner
+from etc.adapters.observing import ObservingAdapter
+from etc.client import next_index
+from etc.errors import (
+    ConnectionError, EtcdError, EtcException, EventIndexCleared, HTTPError,
+    TimedOut)
+from etc.retry import NO_RETRY
+
+
+__all__ = ['AsyncEtcdAdapter', 'AsyncObservingAdapter', 'watch']
+
+
+def stringify(args):
+    """aiohttp accepts only strings for query parameters and form fields."""
+    return {key: six.text_type(value) for key, value in args.items()}
+
+
+async def watch(client, key, index=None, recursive=False, sorted=False,
+                quorum=False, timeout=None, heartbeat=False):
+    """The asynchronous generator of :meth:`etc.AsyncClient.watch`.  It
+    works like :meth:`etc.Client.watch`.
+    """
+    while True:
+        try:
+            result = await client.wait(key, index, recursive=recursive,
+                                       sorted=sorted, quorum=quorum,
+                                       timeout=timeout)
+        except TimedOut:
+            if heartbeat:
+                yield None
+            continue
+        except EventIndexCleared:
+            result = await client.get(key, recursive=recursive, sorted=sorted,
+                                      quorum=quorum, timeout=timeout)
+        index = next_index(result)
+        yield result
+
+
+class AsyncEtcdAdapter(EtcdAdapter):
+    """An adapter which communicates with an etcd v2 server in an asyncio
+    event loop.  All request methods are coroutines.  Results and errors are
+    decoded by the same code as :class:`etc.adapters.etcd.EtcdAdapter`.
+    """
+
+    def __init__(self, url, default_timeout=60, **kwargs):
+        if kwargs:
+            # The connection pools and the retry policy of EtcdAdapter.
+            raise TypeError('Not supported by %s: %s' % (
+                self.__class__.__name__, ', '.join(sorted(kwargs))))
+        Adapter.__init__(self, url)
+        self.default_timeout = default_timeout
+        self.retry_policy = NO_RETRY
+        self.observers = []
+        self.session = None
+
+    def get_session(self):
+        """Gets the HTTP session.  It is created lazily because aiohttp wants
+        to create a session in a running event loop.
+        """
+        if self.session is None or self.session.closed:
+            # Long-polling requests should not be limited by aiohttp's
+            # default timeout.
+            timeout = aiohttp.ClientTimeout(total=None)
+            self.session = aiohttp.ClientSession(timeout=timeout)
+        return self.session
+
+    async def clear(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def add_observer(self, observer):
+        """Reports the HTTP exchanges to the observer."""
+        self.observers.append(observer)
+
+    def remove_observer(self, observer):
+        self.observers.remove(observer)
+
+    def report_http(self, method, url, status, started_at, data, received):
+        elapsed = time.time() - started_at
+        sent = len(urlencode(data)) if data else 0
+        for observer in self.observers:
+            observer.on_http(method, url, status, elapsed, sent, received)
+
+    async def batch(self, calls):
+        """Requests a batch concurrently in the event loop."""
+        async def collect(call):
+            try:
+                return await call()
+            except EtcdError as exc:
+                return exc
+        return list(await asyncio.gather(*[collect(c) for c in calls]))
+
+    @classmethod
+    def wrap_content(cls, status, content, headers):
+        if status < 400:
+            return cls.make_result(json_loads(content.decode('utf-8')),
+                                   headers)
+
+        try:
+            data = json_loads(content.decode('utf-8'))
+        except ValueError:
+            raise HTTPError(status)
+        else:
+            raise cls.make_error(data, headers)
+
+    @staticmethod
+    def erred():
+        """Wraps errors.  Call it in `except` clause."""
+        exc_type, exc, tb = sys.exc_info()
+        if issubclass(exc_type, asyncio.TimeoutError):
+            raise TimedOut
+        elif issubclass(exc_type, aiohttp.ClientPayloadError):
+            # The same as :exc:`requests.exceptions.ChunkedEncodingError`.
+            # etcd closes a long-polling response without any chunk.
+            raise TimedOut
+        elif issubclass(exc_type, aiohttp.ClientConnectionError):
+            raise ConnectionError(exc)
+        elif issubclass(exc_type, aiohttp.ClientError):
+            raise EtcException(exc)
+        raise exc.with_traceback(tb)
+
+    async def request(self, method, url, timeout=None, **kwargs):
+        if timeout is not None:
+            kwargs['timeout'] = aiohttp.ClientTimeout(total=timeout)
+        session = self.get_session()
+        started_at = time.time()
+        try:
+            async with session.request(method, url, **kwargs) as res:
+                content = await res.read()
+        except:
+            self.erred()
+        if self.observers:
+            self.report_http(method, str(res.url), res.status, started_at,
+                             kwargs.get('data'), len(content))
+        return self.wrap_content(res.status, content, res.headers)
+
+    async def get(self, key, recursive=False, sorted=False, quorum=False,
+                  wait=False, wait_index=None, timeout=None):
+        """Requests to get a node by the given key."""
+        url = self.make_key_url(key)
+        params = stringify(self.build_args({
+            'recursive': (bool, recursive or None),
+            'sorted': (bool, sorted or None),
+            'quorum': (bool, quorum or None),
+            'wait': (bool, wait or None),
+            'waitIndex': (int, wait_index),
+        }))
+        if timeout is not None:
+            return await self.request('GET', url, params=params,
+                                      timeout=timeout)
+        # Try again when :exc:`TimedOut` thrown.  It backs off while failing
+        # quickly like EtcdAdapter.
+        policy = self.retry_policy
+        attempt = 1
+        while True:
+            started_at = time.time()
+            try:
+                return await self.request('GET', url, params=params)
+            except TimedOut:
+                if time.time() - started_at >= policy.max_backoff:
+                    attempt = 1
+                await asyncio.sleep(policy.delay(attempt))
+                attempt += 1
+
+    async def walk(self, key, sorted=False, quorum=False, timeout=None,
+                   chunk_size=65536):
+        """Requests to get a node recursively by the given key and iterates
+        the values while receiving the response.  It is an asynchronous
+        generator::
+
+           async for value in etcd.walk('/huge'):
+               process(value)
+
+        """
+        url = self.make_key_url(key)
+        params = stringify(self.build_args({
+            'recursive': (bool, True),
+            'sorted': (bool, sorted or None),
+            'quorum': (bool, quorum or None),
+        }))
+        kwargs = {}
+        if timeout is not None:
+            kwargs['timeout'] = aiohttp.ClientTimeout(sock_read=timeout)
+        session = self.get_session()
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        scanner = LeafScanner()
+        started_at = time.time()
+        try:
+            async with session.get(url, params=params, **kwargs) as res:
+                if self.observers:
+                    # The received size is from the header like EtcdAdapter.
+                    self.report_http('GET', str(res.url), res.status,
+                                     started_at, None,
+                                     res.content_length or 0)
+                if res.status >= 400:
+                    content = await res.read()
+                    self.wrap_content(res.status, content, res.headers)
+                async for chunk in res.content.iter_chunked(chunk_size):
+                    for text in scanner.feed(decoder.decode(chunk)):
+                        data = json_loads(text)
+                        if 'value' in data:
+                            yield self.make_node(data)
+        except (GeneratorExit, EtcException):
+            raise
+        except:
+            self.erred()
+
+    async def set(self, key, value=None, dir=False, refresh=False, ttl=None,
+                  prev_value=None, prev_index=None, prev_exist=None,
+                  timeout=None):
+        """Requests to set a node by the given key."""
+        url = self.make_key_url(key)
+        data = stringify(self.build_args({
+            'value': (six.text_type, value),
+            'dir': (bool, dir or None),
+            'refresh': (bool, refresh or None),
+            'ttl': (int, ttl),
+            'prevValue': (six.text_type, prev_value),
+            'prevIndex': (int, prev_index),
+            'prevExist': (bool, prev_exist),
+        }))
+        return await self.request('PUT', url, data=data, timeout=timeout)
+
+    async def append(self, key, value=None, dir=False, ttl=None,
+                     timeout=None):
+        """Requests to create an ordered node into a node by the given key."""
+        url = self.make_key_url(key)
+        data = stringify(self.build_args({
+            'value': (six.text_type, value),
+            'dir': (bool, dir or None),
+            'ttl': (int, ttl),
+        }))
+        return await self.request('POST', url, data=data, timeout=timeout)
+
+    async def delete(self, key, dir=False, recursive=False,
+                     prev_value=None, prev_index=None, timeout=None):
+        """Requests to delete a node by the given key."""
+        url = self.make_key_url(key)
+        params = stringify(self.build_args({
+            'dir': (bool, dir or None),
+            'recursive': (bool, recursive or None),
+            'prevValue': (six.text_type, prev_value),
+            'prevIndex': (int, prev_index),
+        }))
+        return await self.request('DELETE', url, params=params,
+                                  timeout=timeout)
+
+
+class AsyncObservingAdapter(ObservingAdapter):
+    """The asyncio version of
+    :class:`etc.adapters.observing.ObservingAdapter` which
+    :meth:`etc.AsyncClient.observe` puts in front of the adapter.
+    """
+
+    async def request(self, method, key, call):
+        started_at = time.time()
+        try:
+            result = await call()
+        except Exception as exc:
+            self.report(method, key, started_at, exc)
+            raise
+        self.report(method, key, started_at)
+        return result
+
+    async def get(self, key, recursive=False, sorted=False, quorum=False,
+                  wait=False, wait_index=None, timeout=None):
+        result = await self.request('wait' if wait else 'get', key, lambda: (
+            self.adapter.get(key, recursive=recursive, sorted=sorted,
+                             quorum=quorum, wait=wait, wait_index=wait_index,
+                             timeout=timeout)))
+        if wait:
+            self.report_watch(key, result)
+        return result
+
+    async def walk(self, key, sorted=False, quorum=False, timeout=None):
+        """Reports when the values are exhausted."""
+        started_at = time.time()
+        try:
+            async for value in self.adapter.walk(key, sorted=sorted,
+                                                 quorum=quorum,
+                                                 timeout=timeout):
+                yield value
+        except GeneratorExit:
+            raise
+        except Exception as exc:
+            self.report('walk', key, started_at, exc)
+            raise
+        self.report('walk', key, started_at)
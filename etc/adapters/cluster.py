@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""
+   etc.adapters.cluster
+   ~~~~~~~~~~~~~~~~~~~~
+"""
+from __future__ import absolute_import
+
+import time
+
+import six
+
+from etc.adapter import PooledAdapter
+from etc.adapters.etcd import EtcdAdapter
+from etc.errors import (
+    ConnectionError, ConnectionRefused, EtcdError, EtcException, HTTPError,
+    TimedOut)
+from etc.helpers import gen_repr
+
+
+__all__ = ['ClusterAdapter', 'Member']
+
+
+class Member(object):
+    """An etcd cluster member with the health and latency statistics."""
+
+    __slots__ = ('url', 'adapter', 'id', 'latency', 'failures', 'down_until')
+
+    def __init__(self, url, adapter, id=None):
+        self.url = url
+        self.adapter = adapter
+        self.id = id
+        #: The moving average of response times in seconds.
+        self.latency = None
+        #: The number of consecutive failures.
+        self.failures = 0
+        #: Until when the member is considered as down.
+        self.down_until = 0
+
+    def __repr__(self):
+        return gen_repr(self.__class__, u'{0}', self.url, options=[
+            ('latency', self.latency), ('failures', self.failures or None),
+        ])
+
+    def is_healthy(self, now=None):
+        return (time.time() if now is None else now) >= self.down_until
+
+    def succeeded(self, seconds=None, smoothing=0.2):
+        self.failures = 0
+        self.down_until = 0
+        if seconds is None:
+            return
+        elif self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += (seconds - self.latency) * smoothing
+
+    def failed(self, down_interval, max_down_interval):
+        self.failures += 1
+        interval = down_interval * 2 ** (self.failures - 1)
+        self.down_until = time.time() + min(interval, max_down_interval)
+
+
+class ClusterAdapter(PooledAdapter):
+    """An adapter which distributes requests to the members of an etcd
+    cluster.  `url` is a list or a comma-separated string of member URLs::
+
+       etcd = etc.etcd('http://10.0.0.1:2379,http://10.0.0.2:2379')
+
+    Reads go to the fastest healthy member.  Writes and quorum reads go to
+    the leader if it is known by :meth:`discover`.  A member which fails to
+    connect is skipped for `down_interval` seconds, doubled on each
+    consecutive failure, and the request fails over to the next member.  A
+    write doesn't fail over when it might have been applied: when it timed
+    out, or when it is not idempotent and failed after connecting, e.g. by
+    an aborted connection.  When all members have failed, the request is
+    retried over the members by `retry_policy`, an
+    :class:`etc.retry.RetryPolicy`.
+
+    Other keyword arguments are passed to :class:`etc.adapters.etcd.
+    EtcdAdapter` of each member.
+    """
+
+    def __init__(self, url, discover=False, request_timeout=5,
+                 down_interval=1, max_down_interval=30, max_workers=10,
+                 retry_policy=None, **kwargs):
+        if isinstance(url, six.string_types):
+            urls = [u.strip() for u in url.split(u',') if u.strip()]
+        else:
+            urls = list(url)
+        if not urls:
+            raise ValueError('No member URL')
+        super(ClusterAdapter, self).__init__(u','.join(urls), max_workers,
+                                             retry_policy)
+        #: The default timeout of requests except long-polling requests.  A
+        #: stalled member fails over by this timeout.
+        self.request_timeout = request_timeout
+        self.down_interval = down_interval
+        self.max_down_interval = max_down_interval
+        self.adapter_kwargs = kwargs
+        self.members = [self.make_member(u) for u in urls]
+        self.leader = None
+        self.auto_discover = discover
+        self.discovered_at = 0
+        if discover:
+            self.discover()
+
+    def make_member(self, url, id=None):
+        adapter = EtcdAdapter(url, **self.adapter_kwargs)
+        for observer in self.observers:
+            adapter.add_observer(observer)
+        return Member(url, adapter, id)
+
+    def add_observer(self, observer):
+        """Reports the HTTP exchanges of the members and the failovers as
+        retries to the observer.
+        """
+        self.observers.append(observer)
+        for member in self.members:
+            member.adapter.add_observer(observer)
+
+    def remove_observer(self, observer):
+        self.observers.remove(observer)
+        for member in self.members:
+            member.adapter.remove_observer(observer)
+
+    def clear(self):
+        for member in self.members:
+            member.adapter.clear()
+        self.close_pool()
+
+    def fetch(self, member, path):
+        """Gets a JSON document from a member."""
+        adapter = member.adapter
+        try:
+            res = adapter.session.get(adapter.make_url(path),
+                                      timeout=self.request_timeout)
+        except:
+            adapter.erred()
+        if not res.ok:
+            raise HTTPError(res.status_code)
+        return res.json()
+
+    def discover(self):
+        """Updates the members by ``/v2/members`` and finds the leader by
+        ``/v2/stats/self`` of a member.
+        """
+        self.discovered_at = time.time()
+        for member in self.read_members():
+            try:
+                members_data = self.fetch(member, u'members')['members']
+                stats_data = self.fetch(member, u'stats/self')
+            except EtcException:
+                member.failed(self.down_interval, self.max_down_interval)
+                continue
+            break
+        else:
+            raise ConnectionError('No available member')
+        known_members = {m.url: m for m in self.members}
+        members = []
+        for member_data in members_data:
+            for url in member_data.get('clientURLs', ()):
+                try:
+                    member = known_members[url]
+                except KeyError:
+                    member = self.make_member(url, member_data['id'])
+                else:
+                    member.id = member_data['id']
+                members.append(member)
+                break
+        if members:
+            for member in set(self.members) - set(members):
+                member.adapter.clear()
+            self.members = members
+        leader_id = stats_data.get('leaderInfo', {}).get('leader')
+        self.leader = None
+        for member in members:
+            if member.id == leader_id:
+                self.leader = member
+                break
+        return self.members
+
+    def read_members(self):
+        """Healthy members from the fastest then the others from the one which
+        will recover first.
+        """
+        now = time.time()
+        healthy, down = [], []
+        for member in self.members:
+            (healthy if member.is_healthy(now) else down).append(member)
+        healthy.sort(key=lambda m: m.latency or 0)
+        down.sort(key=lambda m: m.down_until)
+        return healthy + down
+
+    def write_members(self):
+        """The leader first then the same as :meth:`read_members`."""
+        if self.leader is None and self.auto_discover and \
+           time.time() - self.discovered_at >= self.down_interval:
+            try:
+                self.discover()
+            except EtcException:
+                pass
+        members = self.read_members()
+        leader = self.leader
+        if leader is not None and leader.is_healthy():
+            members.remove(leader)
+            members.insert(0, leader)
+        return members
+
+    def request(self, members, call, wait=False, write=False,
+                idempotent=True, method=None, key=None):
+        """Calls the function with the adapter of each member until one
+        responds.  A non-idempotent write fails over only when it hasn't been
+        sent.  `method` and `key` are reported to the observers when it fails
+        over.
+        """
+        error = None
+        for member in members:
+            if error is not None:
+                for observer in self.observers:
+                    observer.on_retry(method, key, error)
+            started_at = time.time()
+            try:
+                result = call(member.adapter)
+            except TimedOut as exc:
+                if wait:
+                    raise
+                member.failed(self.down_interval, self.max_down_interval)
+                if write:
+                    raise
+                error = exc
+            except (ConnectionError, HTTPError) as exc:
+                member.failed(self.down_interval, self.max_down_interval)
+                if member is self.leader:
+                    self.leader = None
+                if write and not idempotent and \
+                   not isinstance(exc, ConnectionRefused):
+                    # It might have been applied.
+                    raise
+                error = exc
+            except EtcdError:
+                # An etcd error is a valid response.
+                member.succeeded(None if wait else time.time() - started_at)
+                raise
+            else:
+                member.succeeded(None if wait else time.time() - started_at)
+                return result
+        raise error
+
+    def get(self, key, recursive=False, sorted=False, quorum=False,
+            wait=False, wait_index=None, timeout=None):
+        if timeout is None and not wait:
+            timeout = self.request_timeout
+        def call(adapter):
+            return adapter.get(key, recursive=recursive, sorted=sorted,
+                               quorum=quorum, wait=wait,
+                               wait_index=wait_index, timeout=timeout)
+        method = 'wait' if wait else 'get'
+        def request():
+            members = self.write_members() if quorum else \
+                self.read_members()
+            return self.request(members, call, wait=wait, method=method,
+                                key=key)
+        # A timed out wait is not retried.
+        return self.retry(request, method, key, idempotent=not wait)
+
+    def walk(self, key, sorted=False, quorum=False, timeout=None):
+        if timeout is None:
+            timeout = self.request_timeout
+        def call(adapter):
+            return adapter.walk(key, sorted=sorted, quorum=quorum,
+                                timeout=timeout)
+        def request():
+            members = self.write_members() if quorum else \
+                self.read_members()
+            return self.request(members, call, method='walk', key=key)
+        return self.retry(request, 'walk', key, idempotent=True)
+
+    def set(self, key, value=None, dir=False, ttl=None, refresh=False,
+            prev_value=None, prev_index=None, prev_exist=None, timeout=None):
+        if timeout is None:
+            timeout = self.request_timeout
+        def call(adapter):
+            return adapter.set(key, value, dir=dir, ttl=ttl, refresh=refresh,
+                               prev_value=prev_value, prev_index=prev_index,
+                               prev_exist=prev_exist, timeout=timeout)
+        method = 'refresh' if refresh else 'set'
+        idempotent = refresh or prev_exist is False or \
+            prev_value is not None or prev_index is not None
+        def request():
+            return self.request(self.write_members(), call, write=True,
+                                idempotent=idempotent, method=method, key=key)
+        return self.retry(request, method, key, idempotent)
+
+    def append(self, key, value=None, dir=False, ttl=None, timeout=None):
+        if timeout is None:
+            timeout = self.request_timeout
+        def call(adapter):
+            return adapter.append(key, value, dir=dir, ttl=ttl,
+                                  timeout=timeout)
+        def request():
+            return self.request(self.write_members(), call, write=True,
+                                idempotent=False, method='append', key=key)
+        return self.retry(request, 'append', key)
+
+    def delete(self, key, dir=False, recursive=False,
+               prev_value=None, prev_index=None, timeout=None):
+        if timeout is None:
+            timeout = self.request_timeout
+        def call(adapter):
+            return adapter.delete(key, dir=dir, recursive=recursive,
+                                  prev_value=prev_value,
+                                  prev_index=prev_index, timeout=timeout)
+        idempotent = prev_value is not None or prev_index is not None
+        def request():
+            return self.request(self.write_members(), call, write=True,
+                                idempotent=idempotent, method='delete',
+                                key=key)
+        return self.retry(request, 'delete', key, idempotent)
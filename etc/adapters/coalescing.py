@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+   etc.adapters.coalescing
+   ~~~~~~~~~~~~~~~~~~~~~~~
+
+   Shares an in-flight get among concurrent identical gets.
+
+"""
+from __future__ import absolute_import
+
+import threading
+
+from etc.adapter import ProxyAdapter
+from etc.errors import TimedOut
+from etc.helpers import normalize_key
+
+
+__all__ = ['CoalescingAdapter']
+
+
+class Flight(object):
+
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class CoalescingAdapter(ProxyAdapter):
+    """An adapter which requests concurrent identical gets to another adapter
+    only once::
+
+       etcd = etc.Client(CoalescingAdapter(EtcdAdapter(url)))
+
+    A get joins the in-flight get of the same key, `recursive`, `sorted` and
+    `quorum` options and receives the same :class:`etc.EtcdResult` or the
+    same error.  A write through this adapter makes later gets not join the
+    gets started before it.  Waiting gets are never coalesced.
+    """
+
+    def __init__(self, adapter):
+        super(CoalescingAdapter, self).__init__(adapter)
+        #: The number of gets requested to the adapter.
+        self.requests = 0
+        #: The number of gets which joined an in-flight get.
+        self.saved = 0
+        self.flights = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, recursive=False, sorted=False, quorum=False,
+            wait=False, wait_index=None, timeout=None):
+        if wait:
+            return super(CoalescingAdapter, self).get(
+                key, recursive=recursive, sorted=sorted, quorum=quorum,
+                wait=wait, wait_index=wait_index, timeout=timeout)
+        flight_key = (normalize_key(key), recursive, sorted, quorum)
+        with self.lock:
+            flight = self.flights.get(flight_key)
+            if flight is None:
+                flight = self.flights[flight_key] = Flight()
+                self.requests += 1
+                leading = True
+            else:
+                self.saved += 1
+                leading = False
+        if not leading:
+            if not flight.done.wait(timeout):
+                raise TimedOut
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = self.adapter.get(
+                key, recursive=recursive, sorted=sorted, quorum=quorum,
+                timeout=timeout)
+        except Exception as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self.lock:
+                if self.flights.get(flight_key) is flight:
+                    del self.flights[flight_key]
+            flight.done.set()
+        return flight.result
+
+    def forget(self):
+        """Makes later gets not join the in-flight gets."""
+        with self.lock:
+            self.flights.clear()
+
+    def set(self, key, value=None, dir=False, ttl=None, refresh=False,
+            prev_value=None, prev_index=None, prev_exist=None, timeout=None):
+        try:
+            return super(CoalescingAdapter, self).set(
+                key, value, dir=dir, ttl=ttl, refresh=refresh,
+                prev_value=prev_value, prev_index=prev_index,
+                prev_exist=prev_exist, timeout=timeout)
+        finally:
+            self.forget()
+
+    def append(self, key, value=None, dir=False, ttl=None, timeout=None):
+        try:
+            return super(CoalescingAdapter, self).append(
+                key, value, dir=dir, ttl=ttl, timeout=timeout)
+        finally:
+            self.forget()
+
+    def delete(self, key, dir=False, recursive=False,
+               prev_value=None, prev_index=None, timeout=None):
+        try:
+            return super(CoalescingAdapter, self).delete(
+                key, dir=dir, recursive=recursive, prev_value=prev_value,
+                prev_index=prev_index, timeout=timeout)
+        finally:
+            self.forget()
@@ -6,36 +6,182 @@
 from __future__ import absolute_import
 
 import io
+import re
 import socket
 import sys
+import time
 
-import iso8601
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ChunkedEncodingError
-from requests.packages.urllib3.exceptions import ReadTimeoutError
+from requests.packages.urllib3.exceptions import (
+    ConnectTimeoutError, ReadTimeoutError)
 import six
 from six import reraise
 from six.moves.urllib.parse import urljoin
 
-from etc.adapter import Adapter
+from etc.adapter import PooledAdapter
 from etc.errors import (
-    ConnectionError, EtcdError, EtcException, HTTPError, TimedOut)
+    ConnectionError, ConnectionRefused, EtcdError, EtcException, HTTPError,
+    TimedOut)
 from etc.results import Directory, EtcdResult, Node, Value
 
 
-__all__ = ['EtcdAdapter']
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    try:
+        from ujson import loads as json_loads
+    except ImportError:
+        from json import loads as json_loads
 
 
-class EtcdAdapter(Adapter):
-    """An adapter which communicates with an etcd v2 server."""
+__all__ = ['EtcdAdapter', 'LeafScanner']
 
-    def __init__(self, url, default_timeout=60):
-        super(EtcdAdapter, self).__init__(url)
+
+class LeafScanner(object):
+    """Finds JSON objects which don't contain any object from a JSON document
+    fed in pieces.  Only the text of the current object is kept::
+
+       scanner = LeafScanner()
+       for chunk in chunks:
+           for text in scanner.feed(chunk):
+               data = json.loads(text)
+
+    """
+
+    outside_string = re.compile(r'[{}"]')
+    inside_string = re.compile(r'["\\]')
+
+    def __init__(self):
+        self.buf = u''
+        self.pos = 0
+        self.in_string = False
+        # The start positions of the open objects.  It is ``None`` if the
+        # object contains another object.
+        self.starts = []
+
+    def feed(self, text):
+        """Returns texts of the objects closed in the given text."""
+        buf = self.buf + text
+        pos, in_string, starts = self.pos, self.in_string, self.starts
+        texts = []
+        while True:
+            if in_string:
+                match = self.inside_string.search(buf, pos)
+                if match is None:
+                    pos = len(buf)
+                    break
+                elif match.group() == u'\\':
+                    if match.end() == len(buf):
+                        # The escaped character hasn't arrived yet.
+                        pos = match.start()
+                        break
+                    pos = match.end() + 1
+                    continue
+                in_string = False
+                pos = match.end()
+                continue
+            match = self.outside_string.search(buf, pos)
+            if match is None:
+                pos = len(buf)
+                break
+            char, pos = match.group(), match.end()
+            if char == u'"':
+                in_string = True
+            elif char == u'{':
+                if starts:
+                    starts[-1] = None
+                starts.append(match.start())
+            else:
+                start = starts.pop()
+                if start is not None:
+                    texts.append(buf[start:pos])
+        # Forget the text which is not in the current object.
+        if starts and starts[-1] is not None:
+            keep = starts[-1]
+            starts[-1] = 0
+        else:
+            keep = pos
+        self.buf, self.pos, self.in_string = buf[keep:], pos - keep, in_string
+        return texts
+
+
+class EtcdAdapter(PooledAdapter):
+    """An adapter which communicates with an etcd v2 server.  Failed
+    requests are retried by `retry_policy`, an
+    :class:`etc.retry.RetryPolicy`.  They are not retried by default.
+    """
+
+    def __init__(self, url, default_timeout=60, max_workers=None,
+                 pool_connections=10, pool_maxsize=10, pool_block=False,
+                 keep_alive=True, wait_pool_maxsize=None, retry_policy=None):
+        # The threads to request a batch concurrently are as many as the
+        # connections in a pool by default.
+        super(EtcdAdapter, self).__init__(url, max_workers or pool_maxsize,
+                                          retry_policy)
         self.default_timeout = default_timeout
-        self.session = requests.Session()
+        #: The session for short requests.
+        self.session = self.make_session(pool_connections, pool_maxsize,
+                                         pool_block, keep_alive)
+        #: The session for long-polling requests.  It has its own connection
+        #: pool not to starve short requests.
+        if wait_pool_maxsize is None:
+            wait_pool_maxsize = pool_maxsize
+        self.wait_session = self.make_session(pool_connections,
+                                              wait_pool_maxsize, False,
+                                              keep_alive)
+
+    @staticmethod
+    def make_session(pool_connections=10, pool_maxsize=10, pool_block=False,
+                     keep_alive=True):
+        """Makes an HTTP session.  `pool_connections` is the number of
+        connection pools to cache.  `pool_maxsize` is the maximum number of
+        connections to keep in a pool.  If `pool_block` is ``True``, a
+        request waits for a free connection instead of opening a connection
+        not to be kept.  If `keep_alive` is ``False``, every request opens a
+        new connection.
+        """
+        session = requests.Session()
+        http_adapter = HTTPAdapter(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+            pool_block=pool_block)
+        session.mount('http://', http_adapter)
+        session.mount('https://', http_adapter)
+        if not keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
 
     def clear(self):
         self.session.close()
+        self.wait_session.close()
+        self.close_pool()
+
+    def add_observer(self, observer):
+        """Reports the HTTP exchanges to the observer by a response hook of
+        the sessions.  The received size of a streamed response is from its
+        ``Content-Length`` header.
+        """
+        def hook(res, *args, **kwargs):
+            req = res.request
+            if kwargs.get('stream'):
+                received = int(res.headers.get('Content-Length') or 0)
+            else:
+                received = len(res.content)
+            observer.on_http(req.method, res.url, res.status_code,
+                             res.elapsed.total_seconds(), len(req.body or ''),
+                             received)
+        hook.observer = observer
+        for session in [self.session, self.wait_session]:
+            session.hooks['response'].append(hook)
+        self.observers.append(observer)
+
+    def remove_observer(self, observer):
+        self.observers.remove(observer)
+        for session in [self.session, self.wait_session]:
+            session.hooks['response'] = [
+                hook for hook in session.hooks['response']
+                if getattr(hook, 'observer', None) is not observer]
 
     def make_url(self, path, api_root=u'/v2/'):
         """Gets a full URL from just path."""
@@ -54,26 +200,38 @@ class EtcdAdapter(Adapter):
 
     @classmethod
     def make_node(cls, data):
-        try:
-            key = data['key']
-        except KeyError:
-            key, kwargs = u'/', {}
-        else:
-            kwargs = {'modified_index': int(data['modifiedIndex']),
-                      'created_index': int(data['createdIndex'])}
-        ttl = data.get('ttl')
-        if ttl is not None:
-            expiration = iso8601.parse_date(data['expiration'])
-            kwargs.update(ttl=ttl, expiration=expiration)
-        if 'value' in data:
-            node_cls = Value
-            args = (data['value'],)
-        elif data.get('dir', False):
-            node_cls = Directory
-            args = ([cls.make_node(n) for n in data.get('nodes', ())],)
-        else:
-            node_cls, args = Node, ()
-        return node_cls(key, *args, **kwargs)
+        """Makes a node from decoded JSON data.  Directories are made
+        iteratively not to be limited by the recursion limit.  Expirations
+        are parsed on demand.
+        """
+        root_nodes = []
+        stack = [(data, root_nodes)]
+        pop, push = stack.pop, stack.append
+        while stack:
+            data, nodes = pop()
+            try:
+                key = data['key']
+            except KeyError:
+                key, modified_index, created_index = u'/', None, None
+            else:
+                modified_index = int(data['modifiedIndex'])
+                created_index = int(data['createdIndex'])
+            ttl = data.get('ttl')
+            expiration = None if ttl is None else data['expiration']
+            if 'value' in data:
+                node = Value(key, data['value'], modified_index,
+                             created_index, ttl, expiration)
+            elif data.get('dir', False):
+                node = Directory(key, [], modified_index, created_index,
+                                 ttl, expiration)
+                # Pushed reversely to be popped in order.
+                for sub_data in reversed(data.get('nodes', ())):
+                    push((sub_data, node.nodes))
+            else:
+                node = Node(key, modified_index, created_index,
+                            ttl, expiration)
+            nodes.append(node)
+        return root_nodes[0]
 
     @classmethod
     def make_result(cls, data, headers=None):
@@ -108,7 +266,10 @@ class EtcdAdapter(Adapter):
     @classmethod
     def wrap_response(cls, res):
         if res.ok:
-            return cls.make_result(res.json(), res.headers)
+            # Decode as UTF-8 explicitly.  :attr:`requests.Response.text`
+            # guesses the encoding when the charset is not specified.
+            data = json_loads(res.content.decode('utf-8'))
+            return cls.make_result(data, res.headers)
 
         try:
             json = res.json()
@@ -146,8 +307,15 @@ class EtcdAdapter(Adapter):
             internal_exc = exc.args[0]
             if isinstance(internal_exc, ReadTimeoutError):
                 raise TimedOut
+            elif isinstance(getattr(internal_exc, 'reason', None),
+                            ConnectTimeoutError):
+                # Failed to connect.  The request hasn't been sent.
+                raise ConnectionRefused(exc)
             else:
                 raise ConnectionError(exc)
+        elif issubclass(exc_type, requests.Timeout):
+            # A read timeout of requests>=2.4.
+            raise TimedOut
         elif issubclass(exc_type, requests.RequestException):
             raise EtcException(exc)
         reraise(exc_type, exc, tb)
@@ -163,26 +331,83 @@ class EtcdAdapter(Adapter):
             'wait': (bool, wait or None),
             'waitIndex': (int, wait_index),
         })
-        if timeout is None:
-            # Try again when :exc:`TimedOut` thrown.
+        session = self.wait_session if wait else self.session
+        policy = self.retry_policy
+        def call():
+            if timeout is not None:
+                try:
+                    res = session.get(url, params=params, timeout=timeout)
+                except ChunkedEncodingError:
+                    raise TimedOut
+                except:
+                    self.erred()
+                return self.wrap_response(res)
+            # Try again when :exc:`TimedOut` thrown.  It backs off while
+            # failing quickly not to hammer etcd.
+            attempt = 1
             while True:
+                started_at = time.time()
                 try:
                     try:
-                        res = self.session.get(url, params=params)
+                        res = session.get(url, params=params)
                     except:
                         self.erred()
                 except (TimedOut, ChunkedEncodingError):
+                    if time.time() - started_at >= policy.max_backoff:
+                        attempt = 1
+                    time.sleep(policy.delay(attempt))
+                    attempt += 1
                     continue
-                else:
-                    break
-        else:
+                return self.wrap_response(res)
+        # A timed out wait is not retried.
+        return self.retry(call, 'wait' if wait else 'get', key,
+                          idempotent=not wait)
+
+    def walk(self, key, sorted=False, quorum=False, timeout=None,
+             chunk_size=65536):
+        """Requests to get a node recursively by the given key and iterates
+        the values while receiving the response.  The response is parsed
+        incrementally so only a chunk and a value are kept in memory.
+        """
+        url = self.make_key_url(key)
+        params = self.build_args({
+            'recursive': (bool, True),
+            'sorted': (bool, sorted or None),
+            'quorum': (bool, quorum or None),
+        })
+        def call():
+            try:
+                res = self.session.get(url, params=params, timeout=timeout,
+                                       stream=True)
+            except:
+                self.erred()
+            if not res.ok:
+                try:
+                    self.wrap_response(res)
+                finally:
+                    res.close()
+            return res
+        # Only the request is retried.  Not while iterating.
+        res = self.retry(call, 'walk', key, idempotent=True)
+        res.encoding = 'utf-8'
+        return self.iter_values(res, chunk_size)
+
+    @classmethod
+    def iter_values(cls, res, chunk_size=65536):
+        scanner = LeafScanner()
+        try:
             try:
-                res = self.session.get(url, params=params, timeout=timeout)
+                for chunk in res.iter_content(chunk_size, decode_unicode=True):
+                    for text in scanner.feed(chunk):
+                        data = json_loads(text)
+                        if 'value' in data:
+                            yield cls.make_node(data)
             except ChunkedEncodingError:
                 raise TimedOut
             except:
-                self.erred()
-        return self.wrap_response(res)
+                cls.erred()
+        finally:
+            res.close()
 
     def set(self, key, value=None, dir=False, refresh=False, ttl=None,
             prev_value=None, prev_index=None, prev_exist=None, timeout=None):
@@ -197,11 +422,16 @@ class EtcdAdapter(Adapter):
             'prevIndex': (int, prev_index),
             'prevExist': (bool, prev_exist),
         })
-        try:
-            res = self.session.put(url, data=data, timeout=timeout)
-        except:
-            self.erred()
-        return self.wrap_response(res)
+        def call():
+            try:
+                res = self.session.put(url, data=data, timeout=timeout)
+            except:
+                self.erred()
+            return self.wrap_response(res)
+        idempotent = refresh or prev_exist is False or \
+            prev_value is not None or prev_index is not None
+        return self.retry(call, 'refresh' if refresh else 'set', key,
+                          idempotent)
 
     def append(self, key, value=None, dir=False, ttl=None, timeout=None):
         """Requests to create an ordered node into a node by the given key."""
@@ -211,11 +441,13 @@ class EtcdAdapter(Adapter):
             'dir': (bool, dir or None),
             'ttl': (int, ttl),
         })
-        try:
-            res = self.session.post(url, data=data, timeout=timeout)
-        except:
-            self.erred()
-        return self.wrap_response(res)
+        def call():
+            try:
+                res = self.session.post(url, data=data, timeout=timeout)
+            except:
+                self.erred()
+            return self.wrap_response(res)
+        return self.retry(call, 'append', key)
 
     def delete(self, key, dir=False, recursive=False,
                prev_value=None, prev_index=None, timeout=None):
@@ -227,8 +459,12 @@ class EtcdAdapter(Adapter):
             'prevValue': (six.text_type, prev_value),
             'prevIndex': (int, prev_index),
         })
-        try:
-            res = self.session.delete(url, params=params, timeout=timeout)
-        except:
-            self.erred()
-        return self.wrap_response(res)
+        def call():
+            try:
+                res = self.session.delete(url, params=params,
+                                          timeout=timeout)
+            except:
+                self.erred()
+            return self.wrap_response(res)
+        idempotent = prev_value is not None or prev_index is not None
+        return self.retry(call, 'delete', key, idempotent)
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+   etc.adapters.lru
+   ~~~~~~~~~~~~~~~~
+"""
+from __future__ import absolute_import
+
+from collections import OrderedDict
+import threading
+import time
+
+from etc.adapter import ProxyAdapter
+from etc.helpers import ancestor_keys, normalize_key
+
+
+__all__ = ['LRUCacheAdapter']
+
+
+class LRUCacheAdapter(ProxyAdapter):
+    """An adapter which caches results of non-recursive gets in another
+    adapter::
+
+       etcd = etc.Client(LRUCacheAdapter(EtcdAdapter(url), max_entries=1024))
+
+    A cached result expires after `max_age` seconds or when the TTL of the
+    node or of one of the listed children runs out.  Writes through this
+    adapter invalidate the written key and its ancestors.  Recursive, quorum
+    and waiting gets are never cached.
+    """
+
+    def __init__(self, adapter, max_entries=1024, max_age=None):
+        super(LRUCacheAdapter, self).__init__(adapter)
+        self.max_entries = max_entries
+        self.max_age = max_age
+        #: The number of gets served from the cache.
+        self.hits = 0
+        #: The number of gets requested to the adapter.
+        self.misses = 0
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        # Increased by each invalidation not to cache a result which might
+        # have been read before a write.
+        self.generation = 0
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+        return super(LRUCacheAdapter, self).clear()
+
+    def expires_at(self, node, now):
+        ttls = [n.ttl for n in [node] + list(getattr(node, 'nodes', ()))
+                if n.ttl is not None]
+        if self.max_age is not None:
+            ttls.append(self.max_age)
+        return now + min(ttls) if ttls else None
+
+    def get(self, key, recursive=False, sorted=False, quorum=False,
+            wait=False, wait_index=None, timeout=None):
+        if recursive or quorum or wait:
+            return super(LRUCacheAdapter, self).get(
+                key, recursive=recursive, sorted=sorted, quorum=quorum,
+                wait=wait, wait_index=wait_index, timeout=timeout)
+        cache_key = (normalize_key(key), sorted)
+        with self.lock:
+            try:
+                result, expires_at = self.cache.pop(cache_key)
+            except KeyError:
+                pass
+            else:
+                if expires_at is None or time.time() < expires_at:
+                    # Mark as the most recently used.
+                    self.cache[cache_key] = (result, expires_at)
+                    self.hits += 1
+                    return result
+            self.misses += 1
+            generation = self.generation
+        now = time.time()
+        result = self.adapter.get(key, sorted=sorted, timeout=timeout)
+        expires_at = self.expires_at(result.node, now)
+        with self.lock:
+            if generation == self.generation:
+                self.cache[cache_key] = (result, expires_at)
+                while len(self.cache) > self.max_entries:
+                    self.cache.popitem(last=False)
+        return result
+
+    def invalidate(self, key, descendants=False):
+        """Removes cached results of the key and its ancestors.  If
+        `descendants` is ``True``, removes the descendants' also.
+        """
+        key = normalize_key(key)
+        with self.lock:
+            self.generation += 1
+            for ancestor_key in ancestor_keys(key):
+                for sorted in (False, True):
+                    self.cache.pop((ancestor_key, sorted), None)
+            if descendants:
+                prefix = key.rstrip(u'/') + u'/'
+                for cache_key in [k for k in self.cache
+                                  if k[0].startswith(prefix)]:
+                    del self.cache[cache_key]
+
+    def set(self, key, value=None, dir=False, ttl=None, refresh=False,
+            prev_value=None, prev_index=None, prev_exist=None, timeout=None):
+        try:
+            return super(LRUCacheAdapter, self).set(
+                key, value, dir=dir, ttl=ttl, refresh=refresh,
+                prev_value=prev_value, prev_index=prev_index,
+                prev_exist=prev_exist, timeout=timeout)
+        finally:
+            self.invalidate(key)
+
+    def append(self, key, value=None, dir=False, ttl=None, timeout=None):
+        try:
+            return super(LRUCacheAdapter, self).append(
+                key, value, dir=dir, ttl=ttl, timeout=timeout)
+        finally:
+            self.invalidate(key)
+
+    def delete(self, key, dir=False, recursive=False,
+               prev_value=None, prev_index=None, timeout=None):
+        try:
+            return super(LRUCacheAdapter, self).delete(
+                key, dir=dir, recursive=recursive, prev_value=prev_value,
+                prev_index=prev_index, timeout=timeout)
+        finally:
+            self.invalidate(key, descendants=dir or recursive)
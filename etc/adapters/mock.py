@@ -6,21 +6,27 @@
 from __future__ import absolute_import
 
 import bisect
+from collections import deque
 from datetime import datetime, timedelta
+import functools
+import heapq
 import itertools
-import os
+import struct
 import threading
+import time
 
 import six
 from six.moves import reduce, xrange
 
 from etc.adapter import Adapter
+from etc.adapters.etcd import EtcdAdapter
 from etc.errors import (
-    KeyNotFound, NodeExist, NotFile, RefreshTTLRequired, RefreshValue,
-    TestFailed, TimedOut)
+    EventIndexCleared, KeyNotFound, NodeExist, NotDir, NotFile,
+    RefreshTTLRequired, RefreshValue, TestFailed, TimedOut)
+from etc.helpers import RWLock
 from etc.results import (
-    ComparedThenSwapped, Created, Deleted, Directory, Got, Node, Set, Updated,
-    Value)
+    ComparedThenSwapped, Created, Deleted, Directory, Expired, Got, Node, Set,
+    Updated, Value)
 
 
 __all__ = ['MockAdapter']
@@ -29,6 +35,26 @@ __all__ = ['MockAdapter']
 KEY_SEP = '/'
 
 
+# The format of :meth:`MockAdapter.dump`.  The header is followed by the node
+# records in depth-first order.  Each record is followed by the UTF-8 encoded
+# name and value.  The size of a directory is the number of the children.
+# A node record consists of flags, modified index, created index, TTL,
+# expiration in microseconds, name size and size.
+DUMP_HEADER = struct.Struct('<8sQ')  # magic, etcd index
+DUMP_NODE = struct.Struct('<BQQdqII')
+DUMP_MAGIC = b'etcmock\x01'
+DUMP_DIR, DUMP_TTL = 1, 2
+EPOCH = datetime(1970, 1, 1)
+
+
+def utc(dt):
+    """Makes a datetime naive in UTC."""
+    offset = dt.utcoffset()
+    if offset is None:
+        return dt
+    return (dt - offset).replace(tzinfo=None)
+
+
 def split_key(key):
     """Splits a node key."""
     if key == KEY_SEP:
@@ -65,6 +91,21 @@ class MockNode(Node):
         self.expiration = expiration
         self.modified_index = index
 
+    @classmethod
+    def restore(cls, key, modified_index, created_index, value=None,
+                nodes=None, ttl=None, expiration=None):
+        """Makes a node from trusted data without verification."""
+        node = cls.__new__(cls)
+        node.key = key
+        node.modified_index = modified_index
+        node.created_index = created_index
+        node.value = value
+        node.dir = nodes is not None
+        node.nodes = nodes
+        node.ttl = ttl
+        node._expiration = expiration
+        return node
+
     def add_node(self, node):
         if not node.key.startswith(self.key):
             raise ValueError('Out of this key')
@@ -88,10 +129,11 @@ class MockNode(Node):
         """Generates a canonical :class:`etc.Node` object from this mock node.
         """
         node_class = Directory if self.dir else Value
-        kwargs = {attr: getattr(self, attr) for attr in node_class.__slots__}
+        kwargs = {attr.lstrip('_'): getattr(self, attr.lstrip('_'))
+                  for attr in node_class.__slots__}
         if self.dir:
             if include_nodes:
-                nodes = [node.canonicalize() for node in
+                nodes = [node.canonicalize(sorted=sorted) for node in
                          six.viewvalues(kwargs['nodes'])]
                 if sorted:
                     nodes.sort(key=lambda n: n.key)
@@ -100,29 +142,154 @@ class MockNode(Node):
                 kwargs['nodes'] = []
         return node_class(**kwargs)
 
+    def bury(self, index):
+        """Makes a node without value for a delete or expire event like
+        etcd.
+        """
+        return Node(self.key, index, self.created_index)
+
+
+class Waiter(object):
+    """A waiting get which receives exactly the first event after it has been
+    registered.
+    """
+
+    __slots__ = ('event', 'result')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+
+    def deliver(self, result):
+        self.result = result
+        self.event.set()
+
+    def wake(self):
+        """Wakes up without a result to check the expiration schedule again.
+        """
+        self.event.set()
+
+
+def writing(f):
+    """Decorates a method to hold the write lock of the adapter.  Expired
+    nodes are removed before the method.
+    """
+    @functools.wraps(f)
+    def wrapped(self, *args, **kwargs):
+        with self.lock.write():
+            self.expire_nodes()
+            return f(self, *args, **kwargs)
+    return wrapped
+
 
 class MockAdapter(Adapter):
+    """An adapter which emulates etcd in memory.
+
+    Like etcd, it remembers only the last `history_size` events.  Waiting
+    from an older index raises :exc:`etc.EventIndexCleared`.
+
+    It is safe to share among threads.  Gets hold a read lock together and
+    writes hold a write lock exclusively.  Each waiting get receives the
+    first event after it, even if more events follow before it wakes up.
 
-    def __init__(self, url):
+    A node with TTL is removed with an :class:`etc.Expired` event when the
+    `clock` passes its expiration.  `clock` returns the current UTC datetime.
+    Nodes are expired by any request or by waiting gets on time.  A fake clock
+    is never on time so call :meth:`expire` after forwarding it::
+
+       now = [datetime.utcnow()]
+       mock = MockAdapter(url, clock=lambda: now[0])
+       now[0] += timedelta(hours=1)
+       mock.expire()
+
+    """
+
+    def __init__(self, url, history_size=1000, clock=datetime.utcnow):
         super(MockAdapter, self).__init__(url)
         self.index = 0
         self.root = MockNode('', self.index, dir=True)
+        self.history_size = history_size
+        self.clock = clock
+        #: A heap of the expirations, the modified indices and the key chunks
+        #: of nodes with TTL.  An entry is ignored if the node has been
+        #: modified.
+        self.deadlines = []
+        self.lock = RWLock()
+        #: Lists of :class:`Waiter` by pairs of whether recursive and key
+        #: chunks.
+        self.waiters = {}
+        # Readers register waiters concurrently.
+        self.waiters_lock = threading.Lock()
+        self.clear()
+
+    @writing
+    def clear(self):
+        self.clear_history()
+
+    def clear_history(self):
+        """Forgets all events.  The write lock should be held."""
+        #: Results by the indices of the remembered events.
         self.history = {}
+        #: Pairs of the index and the key chunks of the remembered events in
+        #: order.
+        self.log = deque()
+        #: The last index which has been forgotten.
+        self.cleared_index = 0
+        #: Sorted indices of the events of the key and the descendants by key
+        #: chunks.
         self.indices = {}
-        self.events = {}
-
-    def clear(self):
-        self.history.clear()
-        self.indices.clear()
-        self.events.clear()
+        #: Sorted indices of the events of exactly the key by key chunks.
+        self.exact_indices = {}
+        #: Key chunks of the forgotten events of which the indices are still
+        #: in the sorted lists.
+        self.stale_keys = []
 
     def next_index(self):
         """Gets the next etcd index."""
         self.index += 1
         return self.index
 
+    def remember(self, index, result, key_chunks):
+        """Remembers an event and forgets the oldest event if the history is
+        full.
+        """
+        self.history[index] = result
+        self.log.append((index, key_chunks))
+        for x in xrange(len(key_chunks) + 1):
+            self.indices.setdefault(key_chunks[:x], []).append(index)
+        self.exact_indices.setdefault(key_chunks, []).append(index)
+        while len(self.log) > self.history_size:
+            self.forget()
+
+    def forget(self):
+        """Forgets the oldest event.  Its index is left in the sorted lists
+        until :meth:`trim` not to shift the lists on every write.
+        """
+        index, key_chunks = self.log.popleft()
+        del self.history[index]
+        self.cleared_index = index
+        self.stale_keys.append(key_chunks)
+        if len(self.stale_keys) >= self.history_size:
+            self.trim()
+
+    def trim(self):
+        """Removes the forgotten indices from the sorted lists."""
+        keys, exact_keys = set(), set()
+        for key_chunks in self.stale_keys:
+            keys.update(key_chunks[:x] for x in xrange(len(key_chunks) + 1))
+            exact_keys.add(key_chunks)
+        for indices, _keys in [(self.indices, keys),
+                               (self.exact_indices, exact_keys)]:
+            for _key_chunks in _keys:
+                _indices = indices[_key_chunks]
+                del _indices[:bisect.bisect_right(_indices,
+                                                  self.cleared_index)]
+                if not _indices:
+                    del indices[_key_chunks]
+        del self.stale_keys[:]
+
     def make_result(self, result_class, node=None, prev_node=None,
-                    remember=True, key_chunks=None, notify=True, **kwargs):
+                    remember=True, key_chunks=None, **kwargs):
         """Makes an etcd result.
 
         If `remember` is ``True``, it keeps the result in the history and
@@ -133,33 +300,104 @@ class MockAdapter(Adapter):
 
         """
         def canonicalize(node, **kwargs):
-            return None if node is None else node.canonicalize(**kwargs)
+            if isinstance(node, MockNode):
+                return node.canonicalize(**kwargs)
+            return node
         index = self.index
         result = result_class(canonicalize(node, **kwargs),
                               canonicalize(prev_node, **kwargs), index)
         if not remember:
             return result
-        self.history[index] = result_class(
-            canonicalize(node, include_nodes=False),
-            canonicalize(prev_node, include_nodes=False), index)
         key_chunks = key_chunks or split_key(node.key)
-        asymptotic_key_chunks = (key_chunks[:x + 1]
-                                 for x in xrange(len(key_chunks)))
+        self.remember(index, result_class(
+            canonicalize(node, include_nodes=False),
+            canonicalize(prev_node, include_nodes=False), index), key_chunks)
         event_keys = [(False, key_chunks)]
-        for _key_chunks in asymptotic_key_chunks:
-            exact = _key_chunks == key_chunks
-            self.indices.setdefault(_key_chunks, []).append((index, exact))
-            event_keys.append((True, _key_chunks))
-        if notify:
-            for event_key in event_keys:
-                try:
-                    event = self.events.pop(event_key)
-                except KeyError:
-                    pass
-                else:
-                    event.set()
+        event_keys.extend((True, key_chunks[:x])
+                          for x in xrange(len(key_chunks) + 1))
+        self.notify(event_keys, self.history[index])
         return result
 
+    def notify(self, event_keys, result):
+        """Delivers the result to the waiters of the event keys."""
+        with self.waiters_lock:
+            waiters = [self.waiters.pop(k, ()) for k in event_keys]
+        for waiter in itertools.chain.from_iterable(waiters):
+            waiter.deliver(result)
+
+    def schedule(self, node, key_chunks):
+        """Schedules to expire the node.  The write lock should be held."""
+        entry = (node.expiration, node.modified_index, key_chunks)
+        heapq.heappush(self.deadlines, entry)
+        if self.deadlines[0] is entry:
+            # Waiters should wake up earlier than they planned.
+            with self.waiters_lock:
+                waiters = list(itertools.chain.from_iterable(
+                    six.viewvalues(self.waiters)))
+            for waiter in waiters:
+                waiter.wake()
+
+    def seconds_to_expire(self):
+        """Seconds until the earliest expiration.  ``None`` if no node has
+        TTL.
+        """
+        try:
+            expiration = self.deadlines[0][0]
+        except IndexError:
+            return None
+        return max((expiration - self.clock()).total_seconds(), 0)
+
+    def expire(self):
+        """Removes the nodes whose expirations have passed."""
+        seconds = self.seconds_to_expire()
+        if seconds is None or seconds > 0:
+            return
+        with self.lock.write():
+            self.expire_nodes()
+
+    def expire_nodes(self):
+        """Removes the nodes whose expirations have passed.  The write lock
+        should be held.
+        """
+        deadlines = self.deadlines
+        if not deadlines:
+            return
+        now = self.clock()
+        while deadlines and deadlines[0][0] <= now:
+            __, index, key_chunks = heapq.heappop(deadlines)
+            try:
+                parent_node = reduce(MockNode.get_node, key_chunks[:-1],
+                                     self.root)
+                node = parent_node.get_node(key_chunks[-1])
+            except (KeyError, TypeError):
+                # Already deleted.
+                continue
+            if node.modified_index != index:
+                # Modified after scheduled.
+                continue
+            parent_node.pop_node(key_chunks[-1])
+            index = self.next_index()
+            self.make_result(Expired, node.bury(index), node,
+                             key_chunks=key_chunks)
+
+    def make_dirs(self, key_chunks, index):
+        """Gets the directory node of the key chunks.  Missing directories are
+        made like etcd.  The write lock should be held.
+        """
+        node = self.root
+        for chunk in key_chunks:
+            try:
+                node = node.get_node(chunk)
+            except KeyError:
+                sub_node = MockNode(node.key + KEY_SEP + chunk, index,
+                                    dir=True)
+                node.nodes[chunk] = sub_node
+                node = sub_node
+            else:
+                if not node.dir:
+                    raise NotDir(index=self.index)
+        return node
+
     def compare(self, node, prev_value=None, prev_index=None):
         """Raises :exc:`TestFailed` if the node is not matched with
         `prev_value` or `prev_index`.
@@ -171,29 +409,71 @@ class MockAdapter(Adapter):
     def get(self, key, recursive=False, sorted=False, quorum=False,
             wait=False, wait_index=None, timeout=None):
         key_chunks = split_key(key)
-        if not wait:
-            # Get immediately.
-            try:
-                node = reduce(MockNode.get_node, key_chunks, self.root)
-            except KeyError:
-                raise KeyNotFound(index=self.index)
-            return self.make_result(Got, node, remember=False, sorted=sorted)
-        # Wait...
-        if wait_index is not None:
-            indices = self.indices.get(key_chunks, ())
-            x = bisect.bisect_left(indices, (wait_index, False))
-            for index, exact in indices[x:]:
-                if recursive or exact:
-                    # Matched past result found.
-                    return self.history[index]
-        # Register an event and wait...
+        self.expire()
+        with self.lock.read():
+            if not wait:
+                # Get immediately.
+                try:
+                    node = reduce(MockNode.get_node, key_chunks, self.root)
+                except KeyError:
+                    raise KeyNotFound(index=self.index)
+                return self.make_result(Got, node, remember=False,
+                                        sorted=sorted)
+            waiter = self.find_or_wait(key_chunks, recursive, wait_index)
+            if not isinstance(waiter, Waiter):
+                return waiter
+        timeout_at = None if timeout is None else time.time() + timeout
+        while True:
+            # Wake up at the earliest expiration to remove the node.
+            seconds = self.seconds_to_expire()
+            if timeout_at is not None:
+                remaining = max(timeout_at - time.time(), 0)
+                seconds = remaining if seconds is None else \
+                    min(seconds, remaining)
+            if waiter.event.wait(seconds):
+                if waiter.result is not None:
+                    return waiter.result
+                waiter.event.clear()
+                if waiter.result is not None:
+                    return waiter.result
+            elif timeout_at is not None and time.time() >= timeout_at:
+                break
+            self.expire()
         event_key = (recursive, key_chunks)
-        event = self.events.setdefault(event_key, threading.Event())
-        if not event.wait(timeout):
-            raise TimedOut
-        index, __ = self.indices[key_chunks][-1]
-        return self.history[index]
-
+        with self.waiters_lock:
+            try:
+                self.waiters[event_key].remove(waiter)
+            except (KeyError, ValueError):
+                # Delivered just now.
+                return waiter.result
+            if not self.waiters[event_key]:
+                del self.waiters[event_key]
+        raise TimedOut
+
+    def find_or_wait(self, key_chunks, recursive=False, wait_index=None):
+        """Finds the past result from `wait_index` or registers a
+        :class:`Waiter`.  The read lock should be held.
+        """
+        indices = self.indices if recursive else self.exact_indices
+        if wait_index:
+            # etcd ignores waitIndex=0 like omitted.
+            if wait_index <= self.cleared_index:
+                raise EventIndexCleared(
+                    u'The event in requested index is outdated and cleared',
+                    u'the requested history has been cleared [%d/%d]' % (
+                        self.cleared_index + 1, wait_index), self.index)
+            _indices = indices.get(key_chunks, ())
+            x = bisect.bisect_left(_indices, wait_index)
+            if x < len(_indices):
+                # Matched past result found.
+                return self.history[_indices[x]]
+        # Writers cannot make an event until the waiter is registered.
+        waiter = Waiter()
+        with self.waiters_lock:
+            self.waiters.setdefault((recursive, key_chunks), []).append(waiter)
+        return waiter
+
+    @writing
     def set(self, key, value=None, dir=False, ttl=None, refresh=False,
             prev_value=None, prev_index=None, prev_exist=None, timeout=None):
         if refresh:
@@ -202,11 +482,20 @@ class MockAdapter(Adapter):
                 raise RefreshValue(index=self.index)
             elif ttl is None:
                 raise RefreshTTLRequired(index=self.index)
-        expiration = ttl and (datetime.utcnow() + timedelta(ttl))
+        # Zero TTL means permanent like etcd.
+        ttl = ttl or None
+        expiration = ttl and (self.clock() + timedelta(seconds=ttl))
         key_chunks = split_key(key)
         index = self.next_index()
         should_test = prev_value is not None or prev_index is not None
-        parent_node = reduce(MockNode.get_node, key_chunks[:-1], self.root)
+        if prev_exist or should_test:
+            try:
+                parent_node = reduce(MockNode.get_node, key_chunks[:-1],
+                                     self.root)
+            except (KeyError, TypeError):
+                raise KeyNotFound(index=self.index)
+        else:
+            parent_node = self.make_dirs(key_chunks[:-1], index)
         try:
             node = parent_node.get_node(key_chunks[-1])
         except KeyError:
@@ -223,37 +512,205 @@ class MockAdapter(Adapter):
                 value = node.value
             self.compare(node, prev_value, prev_index)
             node.set(index, value, dir, ttl, expiration)
+        if ttl is not None:
+            self.schedule(node, key_chunks)
         if refresh:
             result_class = ComparedThenSwapped if should_test else Set
-            notify = False
         else:
             result_class = Updated if prev_exist or should_test else Set
-            notify = True
-        return self.make_result(result_class, node,
-                                key_chunks=key_chunks, notify=notify)
+        # A refresh is not an event like etcd.
+        return self.make_result(result_class, node, remember=not refresh,
+                                key_chunks=key_chunks)
 
+    @writing
     def append(self, key, value=None, dir=False, ttl=None, timeout=None):
-        expiration = ttl and (datetime.utcnow() + timedelta(ttl))
+        ttl = ttl or None
+        expiration = ttl and (self.clock() + timedelta(seconds=ttl))
         key_chunks = split_key(key)
-        parent_node = reduce(MockNode.get_node, key_chunks, self.root)
-        for x in itertools.count(len(parent_node.nodes)):
-            item_key = '%020d' % x
-            if not parent_node.has_node(item_key):
-                break
-        key = os.path.join(key, item_key)
+        # The key is made of the created index like etcd.  It is unique and
+        # in order without scanning the directory.
         index = self.next_index()
-        node = MockNode(key, index, value, dir, ttl, expiration)
-        parent_node.add_node(node)
-        return self.make_result(Created, node, key_chunks=key_chunks)
-
+        parent_node = self.make_dirs(key_chunks, index)
+        item_key = '%020d' % index
+        item_chunks = key_chunks + (item_key,)
+        node = MockNode(parent_node.key + KEY_SEP + item_key, index, value,
+                        dir, ttl, expiration)
+        parent_node.nodes[item_key] = node
+        if ttl is not None:
+            self.schedule(node, item_chunks)
+        return self.make_result(Created, node, key_chunks=item_chunks)
+
+    @writing
     def delete(self, key, dir=False, recursive=False,
                prev_value=None, prev_index=None, timeout=None):
         key_chunks = split_key(key)
-        parent_node = reduce(MockNode.get_node, key_chunks[:-1], self.root)
         try:
+            parent_node = reduce(MockNode.get_node, key_chunks[:-1],
+                                 self.root)
             node = parent_node.get_node(key_chunks[-1])
-        except KeyError:
+        except (KeyError, TypeError):
             raise KeyNotFound(index=self.index)
         self.compare(node, prev_value, prev_index)
         parent_node.pop_node(key_chunks[-1])
-        return self.make_result(Deleted, prev_node=node, key_chunks=key_chunks)
+        index = self.next_index()
+        return self.make_result(Deleted, node.bury(index), node,
+                                key_chunks=key_chunks)
+
+    def dump(self, path):
+        """Dumps the key tree into a file.  :meth:`load` restores it much
+        faster than setting each key.  The event history is not dumped.
+        """
+        records = []
+        append = records.append
+        with self.lock.read():
+            append(DUMP_HEADER.pack(DUMP_MAGIC, self.index))
+            stack = [(u'', self.root)]
+            pop = stack.pop
+            while stack:
+                name, node = pop()
+                name = name.encode('utf-8')
+                flags = 0
+                if node.ttl is None:
+                    ttl, expiration = 0, 0
+                else:
+                    flags |= DUMP_TTL
+                    ttl = node.ttl
+                    delta = node.expiration - EPOCH
+                    expiration = (delta.days * 86400 + delta.seconds) * \
+                        1000000 + delta.microseconds
+                if node.dir:
+                    flags |= DUMP_DIR
+                    value, size = b'', len(node.nodes)
+                    # Reversed to be popped in the original order.
+                    stack.extend(reversed(list(six.viewitems(node.nodes))))
+                else:
+                    value = node.value.encode('utf-8')
+                    size = len(value)
+                append(DUMP_NODE.pack(flags, node.modified_index,
+                                      node.created_index, ttl, expiration,
+                                      len(name), size))
+                append(name)
+                append(value)
+        with open(path, 'wb') as f:
+            f.write(b''.join(records))
+
+    @writing
+    def load(self, path):
+        """Replaces the key tree with a file made by :meth:`dump`.  Waiting
+        from an index before the dump raises :exc:`etc.EventIndexCleared`.
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+        if not data.startswith(DUMP_MAGIC):
+            raise ValueError('Not dumped by MockAdapter: %s' % path)
+        __, index = DUMP_HEADER.unpack_from(data)
+        offset = DUMP_HEADER.size
+        unpack_from, record_size = DUMP_NODE.unpack_from, DUMP_NODE.size
+        restore = MockNode.restore
+        root, deadlines = None, []
+        # The directory to be filled, its key chunks and the number of the
+        # remaining children.
+        parent, parent_chunks, remaining = None, (), 0
+        stack = []
+        while offset < len(data):
+            flags, modified_index, created_index, ttl, expiration, \
+                name_size, size = unpack_from(data, offset)
+            offset += record_size
+            name = data[offset:offset + name_size].decode('utf-8')
+            offset += name_size
+            key = u'' if parent is None else parent.key + KEY_SEP + name
+            if flags & DUMP_TTL:
+                # TTL is dumped as a double.  Usually it is an integer.
+                if ttl.is_integer():
+                    ttl = int(ttl)
+                expiration = EPOCH + timedelta(microseconds=expiration)
+                deadlines.append((expiration, modified_index,
+                                  parent_chunks + (name,)))
+            else:
+                ttl, expiration = None, None
+            if flags & DUMP_DIR:
+                node = restore(key, modified_index, created_index,
+                               nodes={}, ttl=ttl, expiration=expiration)
+            else:
+                value = data[offset:offset + size].decode('utf-8')
+                offset += size
+                node = restore(key, modified_index, created_index, value,
+                               ttl=ttl, expiration=expiration)
+            if parent is None:
+                root = node
+            else:
+                parent.nodes[name] = node
+                remaining -= 1
+            if flags & DUMP_DIR and size:
+                stack.append((parent, parent_chunks, remaining))
+                parent, remaining = node, size
+                parent_chunks = () if key == u'' else parent_chunks + (name,)
+            while remaining == 0 and stack:
+                parent, parent_chunks, remaining = stack.pop()
+        heapq.heapify(deadlines)
+        self.root, self.index, self.deadlines = root, index, deadlines
+        self.clear_history()
+        self.cleared_index = index
+
+    @writing
+    def load_tree(self, tree):
+        """Replaces a subtree with a recursive :class:`etc.Got` result from
+        another adapter or the decoded JSON response of etcd::
+
+           got = etc.etcd(url).get('/', recursive=True)
+           mock.load_tree(got)
+
+        Missing ancestor directories are made.  The etcd index is raised to
+        the result's.
+        """
+        if isinstance(tree, dict):
+            tree = EtcdAdapter.make_result(tree)
+        index = max(self.index, tree.etcd_index or 0)
+        restore = MockNode.restore
+        deadlines = self.deadlines
+        root = None
+        # Pairs of a canonical node and the parent mock node.
+        stack = [(tree.node, None)]
+        while stack:
+            node, parent = stack.pop()
+            # The root key of MockAdapter is empty.
+            key_chunks = split_key(node.key or KEY_SEP)
+            modified_index = node.modified_index or 0
+            created_index = node.created_index or 0
+            index = max(index, modified_index)
+            ttl, expiration = node.ttl, None
+            if ttl is not None:
+                expiration = utc(node.expiration)
+                deadlines.append((expiration, modified_index, key_chunks))
+            key = KEY_SEP.join(('',) + key_chunks) if key_chunks else ''
+            if isinstance(node, Value):
+                mock_node = restore(key, modified_index, created_index,
+                                    node.value, ttl=ttl,
+                                    expiration=expiration)
+            else:
+                mock_node = restore(key, modified_index, created_index,
+                                    nodes={}, ttl=ttl, expiration=expiration)
+                # Reversed to be popped in the original order.
+                stack.extend((sub_node, mock_node) for sub_node in
+                             reversed(getattr(node, 'nodes', ())))
+            if parent is None:
+                root = mock_node
+                root_chunks = key_chunks
+            else:
+                parent.nodes[key_chunks[-1]] = mock_node
+        heapq.heapify(deadlines)
+        self.index = index
+        # Graft the root.
+        if not root_chunks:
+            self.root = root
+            return
+        parent = self.root
+        for x, chunk in enumerate(root_chunks[:-1]):
+            try:
+                parent = parent.get_node(chunk)
+            except KeyError:
+                key = KEY_SEP.join(('',) + root_chunks[:x + 1])
+                directory = MockNode(key, index, dir=True)
+                parent.add_node(directory)
+                parent = directory
+        parent.nodes[root_chunks[-1]] = root
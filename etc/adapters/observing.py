@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+   etc.adapters.observing
+   ~~~~~~~~~~~~~~~~~~~~~~
+
+   Reports requests to observers.
+
+"""
+from __future__ import absolute_import
+
+import time
+
+from etc.adapter import ProxyAdapter
+
+
+__all__ = ['ObservingAdapter']
+
+
+class ObservingAdapter(ProxyAdapter):
+    """An adapter which reports the requests to another adapter to
+    :class:`etc.metrics.Observer` objects.  :meth:`etc.Client.observe` puts
+    it in front of the adapter only while some observers are registered.
+    """
+
+    def __init__(self, adapter, observers=()):
+        super(ObservingAdapter, self).__init__(adapter)
+        self.observers = list(observers)
+
+    def report(self, method, key, started_at, error=None):
+        elapsed = time.time() - started_at
+        for observer in self.observers:
+            observer.on_request(method, key, elapsed, error)
+
+    def request(self, method, key, call):
+        started_at = time.time()
+        try:
+            result = call()
+        except Exception as exc:
+            self.report(method, key, started_at, exc)
+            raise
+        self.report(method, key, started_at)
+        return result
+
+    def report_watch(self, key, result):
+        if result.etcd_index is not None and result.node is not None and \
+           result.modified_index is not None:
+            lag = max(result.etcd_index - result.modified_index, 0)
+            for observer in self.observers:
+                observer.on_watch(key, lag)
+
+    def get(self, key, recursive=False, sorted=False, quorum=False,
+            wait=False, wait_index=None, timeout=None):
+        result = self.request('wait' if wait else 'get', key, lambda: (
+            super(ObservingAdapter, self).get(
+                key, recursive=recursive, sorted=sorted, quorum=quorum,
+                wait=wait, wait_index=wait_index, timeout=timeout)))
+        if wait:
+            self.report_watch(key, result)
+        return result
+
+    def set(self, key, value=None, dir=False, ttl=None, refresh=False,
+            prev_value=None, prev_index=None, prev_exist=None, timeout=None):
+        return self.request('refresh' if refresh else 'set', key, lambda: (
+            super(ObservingAdapter, self).set(
+                key, value, dir=dir, ttl=ttl, refresh=refresh,
+                prev_value=prev_value, prev_index=prev_index,
+                prev_exist=prev_exist, timeout=timeout)))
+
+    def append(self, key, value=None, dir=False, ttl=None, timeout=None):
+        return self.request('append', key, lambda: (
+            super(ObservingAdapter, self).append(
+                key, value, dir=dir, ttl=ttl, timeout=timeout)))
+
+    def delete(self, key, dir=False, recursive=False,
+               prev_value=None, prev_index=None, timeout=None):
+        return self.request('delete', key, lambda: (
+            super(ObservingAdapter, self).delete(
+                key, dir=dir, recursive=recursive, prev_value=prev_value,
+                prev_index=prev_index, timeout=timeout)))
+
+    def walk(self, key, sorted=False, quorum=False, timeout=None):
+        """Reports when the values are exhausted."""
+        started_at = time.time()
+        try:
+            values = self.adapter.walk(key, sorted=sorted, quorum=quorum,
+                                       timeout=timeout)
+        except Exception as exc:
+            self.report('walk', key, started_at, exc)
+            raise
+        def iter_values():
+            try:
+                for value in values:
+                    yield value
+            except Exception as exc:
+                self.report('walk', key, started_at, exc)
+                raise
+            self.report('walk', key, started_at)
+        return iter_values()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+   etc.adapters.recording
+   ~~~~~~~~~~~~~~~~~~~~~~
+
+   Records requests to replay them against another adapter.
+
+"""
+from __future__ import absolute_import
+
+import threading
+import time
+
+from etc.adapter import ProxyAdapter
+from etc.errors import EtcException
+
+
+__all__ = ['RecordingAdapter', 'replay']
+
+
+class RecordingAdapter(ProxyAdapter):
+    """An adapter which records the requests to another adapter::
+
+       recorder = RecordingAdapter(EtcdAdapter(url))
+       run_service(etc.Client(recorder))
+       with open('calls.json', 'w') as f:
+           json.dump(recorder.calls, f)
+
+    Each call is recorded as a JSON serializable list of the offset seconds
+    from the first call, the elapsed seconds, the method name, the
+    positional arguments and the keyword arguments.
+    """
+
+    def __init__(self, adapter):
+        super(RecordingAdapter, self).__init__(adapter)
+        self.calls = []
+        self.started_at = None
+        self.lock = threading.Lock()
+
+    def record(self, started_at, method, args, kwargs):
+        elapsed = time.time() - started_at
+        with self.lock:
+            if self.started_at is None:
+                self.started_at = started_at
+            offset = started_at - self.started_at
+            self.calls.append([offset, elapsed, method, args, kwargs])
+
+    def request(self, method, args, kwargs):
+        started_at = time.time()
+        try:
+            return getattr(self.adapter, method)(*args, **kwargs)
+        finally:
+            self.record(started_at, method, args, kwargs)
+
+    def get(self, key, recursive=False, sorted=False, quorum=False,
+            wait=False, wait_index=None, timeout=None):
+        return self.request('get', [key], dict(
+            recursive=recursive, sorted=sorted, quorum=quorum, wait=wait,
+            wait_index=wait_index, timeout=timeout))
+
+    def set(self, key, value=None, dir=False, ttl=None, refresh=False,
+            prev_value=None, prev_index=None, prev_exist=None, timeout=None):
+        return self.request('set', [key, value], dict(
+            dir=dir, ttl=ttl, refresh=refresh, prev_value=prev_value,
+            prev_index=prev_index, prev_exist=prev_exist, timeout=timeout))
+
+    def append(self, key, value=None, dir=False, ttl=None, timeout=None):
+        return self.request('append', [key, value], dict(
+            dir=dir, ttl=ttl, timeout=timeout))
+
+    def delete(self, key, dir=False, recursive=False,
+               prev_value=None, prev_index=None, timeout=None):
+        return self.request('delete', [key], dict(
+            dir=dir, recursive=recursive, prev_value=prev_value,
+            prev_index=prev_index, timeout=timeout))
+
+    def walk(self, key, sorted=False, quorum=False, timeout=None):
+        """Records until the values are exhausted."""
+        kwargs = dict(sorted=sorted, quorum=quorum, timeout=timeout)
+        started_at = time.time()
+        try:
+            values = self.adapter.walk(key, **kwargs)
+        except:
+            self.record(started_at, 'walk', [key], kwargs)
+            raise
+        def iter_values():
+            try:
+                for value in values:
+                    yield value
+            finally:
+                self.record(started_at, 'walk', [key], kwargs)
+        return iter_values()
+
+
+def replay(calls, adapter, timing=False, waits=False):
+    """Replays calls recorded by :class:`RecordingAdapter` to the adapter in
+    order.  Returns the elapsed seconds of each call.  A failed call is timed
+    as well as a succeeded call.
+
+    If `timing` is ``True``, each call is delayed until its offset from the
+    start as recorded.  Waiting gets are skipped with ``None`` elapsed unless
+    `waits` is ``True`` because they depend on other clients.
+    """
+    results = []
+    started_at = time.time()
+    for offset, __, method, args, kwargs in calls:
+        if method == 'get' and kwargs.get('wait') and not waits:
+            results.append(None)
+            continue
+        if timing:
+            delay = started_at + offset - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        call_started_at = time.time()
+        try:
+            result = getattr(adapter, method)(*args, **kwargs)
+            if method == 'walk':
+                for __ in result:
+                    pass
+        except EtcException:
+            pass
+        results.append(time.time() - call_started_at)
+    return results
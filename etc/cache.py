@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+   etc.cache
+   ~~~~~~~~~
+
+   A client which serves reads from an in-memory mirror of a key tree.
+
+"""
+from __future__ import absolute_import
+
+import threading
+import time
+
+from etc.client import Client
+from etc.errors import (
+    ConnectionError, EventIndexCleared, KeyNotFound, TimedOut)
+from etc.helpers import ancestor_keys, normalize_key, Worker
+from etc.results import Deleted, Directory, Got, Set
+
+
+__all__ = ['CachedClient']
+
+
+class CachedClient(Client, Worker):
+    """A client which mirrors a prefix in memory and serves :meth:`get` from
+    the mirror.  The mirror is made by a recursive get of the prefix and it
+    is kept up to date by a recursive watch from the next etcd index::
+
+       etcd = CachedClient(EtcdAdapter(url), '/config')
+       etcd.get('/config/db')  # served from the memory.
+
+    The mirror is confirmed whenever the watch catches up or times out
+    without any change.  If it hasn't been confirmed for `max_staleness`
+    seconds, :meth:`get` falls back to a quorum read.  Keys out of the prefix
+    and quorum reads are always requested to the adapter as they are.
+
+    :meth:`get` starts the watch thread automatically.  After
+    :meth:`stop`, :meth:`get` falls back to quorum reads after
+    `max_staleness` seconds.
+
+    A TTL refresh doesn't notify watchers so the mirrored `ttl` and
+    `expiration` may be outdated until the next change of the key.
+    """
+
+    def __init__(self, adapter, prefix=u'/', max_staleness=1,
+                 retry_interval=1):
+        Client.__init__(self, adapter)
+        self.lock = threading.RLock()
+        Worker.__init__(self, self.lock, retry_interval)
+        self.prefix = normalize_key(prefix)
+        self.max_staleness = max_staleness
+        #: The number of reads served from the mirror.
+        self.hits = 0
+        #: The number of reads requested to the adapter.
+        self.misses = 0
+        #: The etcd index which the mirror reflects.
+        self.index = None
+        #: When the mirror has been confirmed last time.
+        self.synced_at = None
+        self.nodes = {}
+        self.children = {}
+
+    def prepare(self):
+        """Makes the mirror before watching."""
+        self.snapshot()
+
+    def clear(self):
+        self.stop()
+        return super(CachedClient, self).clear()
+
+    def is_fresh(self):
+        synced_at = self.synced_at
+        if synced_at is None:
+            return False
+        return time.time() - synced_at <= self.max_staleness
+
+    def covers(self, key):
+        return key == self.prefix or self.prefix == u'/' or \
+            key.startswith(self.prefix + u'/')
+
+    def get(self, key, recursive=False, sorted=False, quorum=False,
+            timeout=None):
+        """Gets a value of key from the mirror if possible."""
+        if self.thread is None and not self.stopped:
+            self.start()
+        normal_key = normalize_key(key)
+        if quorum or not self.covers(normal_key):
+            with self.lock:
+                self.misses += 1
+            return super(CachedClient, self).get(
+                key, recursive=recursive, sorted=sorted, quorum=quorum,
+                timeout=timeout)
+        with self.lock:
+            if self.is_fresh():
+                self.hits += 1
+                try:
+                    node = self.nodes[normal_key]
+                except KeyError:
+                    raise KeyNotFound(index=self.index)
+                node = self.build(node, recursive, sorted, 0)
+                return Got(node, etcd_index=self.index)
+            self.misses += 1
+        # The mirror might be outdated.
+        return super(CachedClient, self).get(
+            key, recursive=recursive, sorted=sorted, quorum=True,
+            timeout=timeout)
+
+    def build(self, node, recursive, sorted, depth):
+        """Builds a node to be returned.  A directory includes its children
+        then recursively the descendants if `recursive` is ``True``.
+        """
+        if not isinstance(node, Directory):
+            return node
+        if depth and not recursive:
+            nodes = []
+        else:
+            keys = self.children.get(node.key, ())
+            nodes = [self.build(self.nodes[k], recursive, sorted, depth + 1)
+                     for k in keys]
+            if sorted:
+                nodes.sort(key=lambda n: n.key)
+        return Directory(node.key, nodes, node.modified_index,
+                         node.created_index, node.ttl, node.expiration)
+
+    def snapshot(self):
+        """Makes the mirror by a recursive get of the prefix."""
+        started_at = time.time()
+        try:
+            result = self.adapter.get(self.prefix, recursive=True)
+        except KeyNotFound as exc:
+            result, index = None, exc.index
+        else:
+            index = result.etcd_index
+        with self.lock:
+            self.nodes.clear()
+            self.children.clear()
+            if result is not None:
+                self.put(result.node)
+            self.index = index
+            self.synced_at = started_at
+
+    def put(self, node):
+        """Puts a node and the descendants into the mirror."""
+        key = normalize_key(node.key)
+        if isinstance(node, Directory):
+            self.children.setdefault(key, set())
+            for sub_node in node.nodes:
+                self.put(sub_node)
+            node = Directory(key, (), node.modified_index, node.created_index,
+                             node.ttl, node.expiration)
+        self.nodes[key] = node
+        parent_key = key.rsplit(u'/', 1)[0] or u'/'
+        if key != u'/' and self.covers(parent_key):
+            self.children.setdefault(parent_key, set()).add(key)
+
+    def pop(self, key):
+        """Removes a node and the descendants from the mirror."""
+        self.nodes.pop(key, None)
+        for sub_key in self.children.pop(key, ()):
+            self.pop(sub_key)
+        parent_key = key.rsplit(u'/', 1)[0] or u'/'
+        self.children.get(parent_key, set()).discard(key)
+
+    def apply(self, result):
+        node = result.node or result.prev_node
+        key = normalize_key(node.key)
+        if isinstance(result, Deleted):
+            self.pop(key)
+        elif isinstance(result, Set):
+            # Directories are created implicitly by a deep key.
+            for ancestor_key in ancestor_keys(key):
+                if ancestor_key == key:
+                    break
+                elif not self.covers(ancestor_key):
+                    continue
+                elif ancestor_key not in self.nodes:
+                    self.put(Directory(ancestor_key, (), node.modified_index,
+                                       node.modified_index))
+            self.put(node)
+
+    def run(self):
+        while not self.stopped:
+            try:
+                self.poll()
+            except ConnectionError:
+                time.sleep(self.retry_interval)
+            except Exception as exc:
+                self.handle_watch_error(exc)
+                time.sleep(self.retry_interval)
+
+    def poll(self):
+        """Waits for a change and applies it to the mirror."""
+        started_at = time.time()
+        try:
+            # The mirror is confirmed as of the start of a poll.  Two polls
+            # with their round trips should fit in the staleness.
+            result = self.adapter.get(self.prefix, recursive=True,
+                                      wait=True, wait_index=self.index + 1,
+                                      timeout=self.max_staleness / 3.)
+        except TimedOut:
+            self.synced_at = started_at
+            return
+        except EventIndexCleared:
+            self.snapshot()
+            return
+        if self.stopped:
+            return
+        node = result.node
+        index = result.etcd_index if node is None else node.modified_index
+        with self.lock:
+            self.apply(result)
+            self.index = index
+            if result.etcd_index is None or result.etcd_index <= index:
+                # Caught up.
+                self.synced_at = started_at
@@ -5,10 +5,24 @@
 """
 from __future__ import absolute_import
 
+import functools
+
+import six
+
+from etc.errors import EventIndexCleared, TimedOut
 from etc.helpers import gen_repr
+from etc.results import Got
+
 
+__all__ = ['AsyncClient', 'Batch', 'Client']
 
-__all__ = ['Client']
+
+def next_index(result):
+    """The index to wait from after a result of :meth:`Client.watch`."""
+    if isinstance(result, Got) or result.node is None:
+        # Caught up on the cleared event history.
+        return result.etcd_index + 1
+    return result.node.modified_index + 1
 
 
 class Client(object):
@@ -23,6 +37,31 @@ class Client(object):
     def clear(self):
         return self.adapter.clear()
 
+    def observe(self, observer):
+        """Registers an :class:`etc.metrics.Observer` to receive reports of
+        requests.  Requests are not intercepted until the first observer is
+        registered.
+        """
+        from etc.adapters.observing import ObservingAdapter
+        if not isinstance(self.adapter, ObservingAdapter):
+            self.adapter = self.make_observing_adapter(self.adapter)
+        self.adapter.observers.append(observer)
+        self.adapter.add_observer(observer)
+
+    @staticmethod
+    def make_observing_adapter(adapter):
+        from etc.adapters.observing import ObservingAdapter
+        return ObservingAdapter(adapter)
+
+    def unobserve(self, observer):
+        """Unregisters an observer.  The adapter is restored when no observer
+        remains.
+        """
+        self.adapter.observers.remove(observer)
+        self.adapter.remove_observer(observer)
+        if not self.adapter.observers:
+            self.adapter = self.adapter.adapter
+
     def __repr__(self):
         return gen_repr(self.__class__, u"'{0}'", self.url, short=True)
 
@@ -32,6 +71,14 @@ class Client(object):
         return self.adapter.get(key, recursive=recursive, sorted=sorted,
                                 quorum=quorum, timeout=timeout)
 
+    def walk(self, key, sorted=False, quorum=False, timeout=None):
+        """Iterates the values under the key recursively.  The values are
+        yielded while receiving the response so a huge directory can be
+        processed in constant memory.
+        """
+        return self.adapter.walk(key, sorted=sorted, quorum=quorum,
+                                 timeout=timeout)
+
     def wait(self, key, index=0, recursive=False, sorted=False, quorum=False,
              timeout=None):
         """Waits until a node changes."""
@@ -39,6 +86,34 @@ class Client(object):
                                 quorum=quorum, wait=True, wait_index=index,
                                 timeout=timeout)
 
+    def watch(self, key, index=None, recursive=False, sorted=False,
+              quorum=False, timeout=None, heartbeat=False):
+        """Iterates changes of a node.  Unlike calling :meth:`wait` in a loop,
+        it doesn't miss changes between iterations because it always waits
+        from the next index of the last change.
+
+        `timeout` is for each long-polling request.  A timed out request is
+        issued again.  If `heartbeat` is ``True``, it yields ``None`` for each
+        timed out request to let you stop between requests.  When the index
+        has been cleared from the etcd event history, it reads the node again
+        and yields the :class:`etc.Got` result to let you catch up, then
+        continues from there.
+        """
+        while True:
+            try:
+                result = self.wait(key, index, recursive=recursive,
+                                   sorted=sorted, quorum=quorum,
+                                   timeout=timeout)
+            except TimedOut:
+                if heartbeat:
+                    yield None
+                continue
+            except EventIndexCleared:
+                result = self.get(key, recursive=recursive, sorted=sorted,
+                                  quorum=quorum, timeout=timeout)
+            index = next_index(result)
+            yield result
+
     def set(self, key, value=None, dir=False, ttl=None, refresh=False,
             prev_value=None, prev_index=None, timeout=None):
         """Sets a value to a key."""
@@ -80,3 +155,105 @@ class Client(object):
         return self.adapter.delete(key, dir=dir, recursive=recursive,
                                    prev_value=prev_value,
                                    prev_index=prev_index, timeout=timeout)
+
+    def batch(self):
+        """Makes a :class:`Batch` to request many operations at once."""
+        return Batch(self)
+
+    def get_many(self, keys, recursive=False, sorted=False, quorum=False,
+                 timeout=None):
+        """Gets values of many keys at once.  The results are in the same
+        order as the keys.  A failure is returned as an :exc:`etc.EtcdError`
+        instead of raised.
+        """
+        batch = self.batch()
+        for key in keys:
+            batch.get(key, recursive=recursive, sorted=sorted, quorum=quorum,
+                      timeout=timeout)
+        return batch.run()
+
+    def set_many(self, items, ttl=None, timeout=None):
+        """Sets values to many keys at once.  `items` is a mapping or pairs
+        of key and value.  The results are in the same order as the items.  A
+        failure is returned as an :exc:`etc.EtcdError` instead of raised.
+        """
+        if hasattr(items, 'items'):
+            items = six.iteritems(items)
+        batch = self.batch()
+        for key, value in items:
+            batch.set(key, value, ttl=ttl, timeout=timeout)
+        return batch.run()
+
+
+def batched(attr):
+    def method(self, *args, **kwargs):
+        func = getattr(self.client, attr)
+        self.calls.append(functools.partial(func, *args, **kwargs))
+    method.__name__ = attr
+    method.__doc__ = 'Adds :meth:`Client.%s` to the batch.' % attr
+    return method
+
+
+class Batch(object):
+    """Operations to be requested at once.  The adapter may request them
+    concurrently::
+
+       batch = etcd.batch()
+       batch.get('/etc/foo')
+       batch.set('/etc/bar', u'bar')
+       foo, bar = batch.run()
+
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __len__(self):
+        return len(self.calls)
+
+    get = batched('get')
+    wait = batched('wait')
+    set = batched('set')
+    refresh = batched('refresh')
+    create = batched('create')
+    update = batched('update')
+    append = batched('append')
+    delete = batched('delete')
+
+    def run(self):
+        """Requests the operations.  The results are in the same order as the
+        operations.  A failure is returned as an :exc:`etc.EtcdError` instead
+        of raised.
+        """
+        calls, self.calls = self.calls, []
+        return self.client.adapter.batch(calls)
+
+
+class AsyncClient(Client):
+    """A client for an asyncio adapter such as
+    :class:`etc.adapters.aioetcd.AsyncEtcdAdapter`.  It has the same methods
+    as :class:`Client` but they return awaitables::
+
+       etcd = etc.etcd(url, asyncio=True)
+       result = await etcd.get('/etc')
+
+    """
+
+    def watch(self, key, index=None, recursive=False, sorted=False,
+              quorum=False, timeout=None, heartbeat=False):
+        """Iterates changes of a node like :meth:`Client.watch` but it is an
+        asynchronous generator::
+
+           async for result in etcd.watch('/etc'):
+               print(result.value)
+
+        """
+        from etc.adapters.aioetcd import watch
+        return watch(self, key, index, recursive=recursive, sorted=sorted,
+                     quorum=quorum, timeout=timeout, heartbeat=heartbeat)
+
+    @staticmethod
+    def make_observing_adapter(adapter):
+        from etc.adapters.aioetcd import AsyncObservingAdapter
+        return AsyncObservingAdapter(adapter)
@@ -34,8 +34,7 @@ class EtcException(Exception):
 class EtcdError(six.with_metaclass(registry('errno'), EtcException)):
     """A failed etcd result."""
 
-    __slots__ = ('message', 'cause', 'index',
-                 'etcd_index', 'raft_index', 'raft_term')
+    __slots__ = ('message', 'cause', 'index', 'raft_index', 'raft_term')
 
     errno = NotImplemented
 
@@ -43,8 +42,8 @@ class EtcdError(six.with_metaclass(registry('errno'), EtcException)):
                  etcd_index=None, raft_index=None, raft_term=None):
         self.message = message
         self.cause = cause
-        self.index = index
-        self.etcd_index = etcd_index
+        # The index of an etcd error is the etcd index.
+        self.index = etcd_index if index is None else index
         self.raft_index = raft_index
         self.raft_term = raft_term
 
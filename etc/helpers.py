@@ -5,10 +5,15 @@
 """
 from __future__ import absolute_import
 
+from contextlib import contextmanager
 import io
+import sys
+import threading
+import traceback
 
 
-__all__ = ['gen_repr', 'Missing', 'registry']
+__all__ = ['ancestor_keys', 'gen_repr', 'Missing', 'normalize_key',
+           'registry', 'RWLock', 'Worker']
 
 
 #: The placeholder for missing parameters.
@@ -34,6 +39,24 @@ def registry(attr, base=type):
     return Registry
 
 
+def normalize_key(key):
+    """Makes a key to start with a slash and not to end with a slash."""
+    return u'/' + key.strip(u'/')
+
+
+def ancestor_keys(key):
+    """Generates keys from the root to the given normalized key."""
+    yield u'/'
+    end = 0
+    while True:
+        end = key.find(u'/', end + 1)
+        if end == -1:
+            break
+        yield key[:end]
+    if key != u'/':
+        yield key
+
+
 def gen_repr(cls, template, *args, **kwargs):
     """Generates a string for :func:`repr`."""
     buf = io.StringIO()
@@ -50,3 +73,111 @@ def gen_repr(cls, template, *args, **kwargs):
             buf.write(u' %s=%s' % (attr, value))
     buf.write(u'>')
     return buf.getvalue()
+
+
+class RWLock(object):
+    """A readers-writer lock.  Many readers can hold it at once but a writer
+    holds it exclusively.  Waiting writers block new readers not to starve.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writing = False
+        self.waiting_writers = 0
+
+    def acquire_read(self):
+        with self.cond:
+            while self.writing or self.waiting_writers:
+                self.cond.wait()
+            self.readers += 1
+
+    def release_read(self):
+        with self.cond:
+            self.readers -= 1
+            if not self.readers:
+                self.cond.notify_all()
+
+    def acquire_write(self):
+        with self.cond:
+            self.waiting_writers += 1
+            while self.writing or self.readers:
+                self.cond.wait()
+            self.waiting_writers -= 1
+            self.writing = True
+
+    def release_write(self):
+        with self.cond:
+            self.writing = False
+            self.cond.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+class Worker(object):
+    """A base of the objects which run :meth:`run` in a daemon thread.
+    :meth:`run` should return soon after :attr:`stopped` is set.  The thread
+    is started and stopped under `lock` which the subclass shares.
+    """
+
+    def __init__(self, lock, retry_interval=1):
+        #: Seconds to sleep before trying again when the connection is lost
+        #: or something fails.
+        self.retry_interval = retry_interval
+        self.start_lock = lock
+        self.thread = None
+        self.stopped = False
+
+    def start(self):
+        """Starts the thread unless it is running."""
+        with self.start_lock:
+            thread = self.thread
+            if thread is not None and thread.is_alive():
+                if not self.stopped:
+                    return
+                name = self.__class__.__name__
+                raise RuntimeError('The thread of %s is still stopping' % name)
+            self.stopped = False
+            self.prepare()
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        """Stops the thread and waits for it to finish.  It doesn't wait when
+        called in the thread.
+        """
+        self.stopped = True
+        self.wake()
+        thread = self.thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def prepare(self):
+        """Called under the lock before the thread starts."""
+
+    def wake(self):
+        """Called after :attr:`stopped` is set to wake the thread up."""
+
+    def run(self):
+        raise NotImplementedError
+
+    def handle_watch_error(self, error):
+        """Called when watching fails except for a lost connection.  The
+        thread watches again.  It prints the traceback to stderr by default.
+        """
+        traceback.print_exc(file=sys.stderr)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+   etc.hub
+   ~~~~~~~
+
+   Shares a long-polling request among many watchers in a process.
+
+"""
+from __future__ import absolute_import
+
+import sys
+import threading
+import time
+import traceback
+
+from etc.client import next_index
+from etc.errors import ConnectionError, KeyNotFound
+from etc.helpers import ancestor_keys, gen_repr, normalize_key, Worker
+from etc.results import Got
+
+
+__all__ = ['Subscription', 'WatchHub']
+
+
+class Subscription(object):
+
+    __slots__ = ('key', 'callback', 'recursive')
+
+    def __init__(self, key, callback, recursive=False):
+        self.key = key
+        self.callback = callback
+        self.recursive = recursive
+
+    def __repr__(self):
+        return gen_repr(self.__class__, u'{0}', self.key,
+                        options=[('recursive', self.recursive or None)])
+
+
+class WatchHub(Worker):
+    """Watches a prefix by a single recursive long-polling request and
+    dispatches each result to the subscribers of the changed key::
+
+       hub = WatchHub(etcd, '/services')
+       hub.subscribe('/services/db', on_db_changed)
+       hub.subscribe('/services/web', on_web_changed, recursive=True)
+       hub.start()
+
+    Callbacks are called in the hub thread.  They should not block.  Subscribe
+    before :meth:`start` not to miss the results dispatched before
+    subscribing.
+    """
+
+    def __init__(self, client, prefix=u'/', index=None, timeout=1,
+                 retry_interval=1):
+        self.lock = threading.Lock()
+        super(WatchHub, self).__init__(self.lock, retry_interval)
+        self.client = client
+        self.prefix = normalize_key(prefix)
+        #: The index to wait from.
+        self.index = index
+        #: The timeout of each long-polling request.  The hub checks whether
+        #: it has been stopped once per timeout.
+        self.timeout = timeout
+        self.subscriptions = {}
+
+    def __repr__(self):
+        return gen_repr(self.__class__, u'{0}', self.prefix, short=True)
+
+    def subscribe(self, key, callback, recursive=False):
+        """Registers a callback to receive results of changes of the key.  If
+        `recursive` is ``True``, changes of the descendants also are
+        dispatched.
+        """
+        key = normalize_key(key)
+        if key != self.prefix and \
+           not key.startswith(self.prefix.rstrip(u'/') + u'/'):
+            raise ValueError('Out of the prefix: %s' % key)
+        subscription = Subscription(key, callback, recursive)
+        with self.lock:
+            self.subscriptions.setdefault(key, []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions[subscription.key]
+            subscriptions.remove(subscription)
+            if not subscriptions:
+                del self.subscriptions[subscription.key]
+
+    def run(self):
+        while not self.stopped:
+            try:
+                for result in self.client.watch(self.prefix, self.index,
+                                                recursive=True,
+                                                timeout=self.timeout,
+                                                heartbeat=True):
+                    if self.stopped:
+                        break
+                    elif result is None:
+                        continue
+                    self.index = next_index(result)
+                    self.dispatch(result)
+            except ConnectionError:
+                time.sleep(self.retry_interval)
+            except KeyNotFound as exc:
+                # The prefix has gone while catching up on the cleared event
+                # history.  Nothing to dispatch until it is made again.
+                self.handle_watch_error(exc)
+                if exc.index is not None:
+                    self.index = exc.index + 1
+            except Exception as exc:
+                self.handle_watch_error(exc)
+                time.sleep(self.retry_interval)
+
+    def dispatch(self, result):
+        """Calls the callbacks of the subscriptions matched with the result.
+        A :class:`etc.Got` result for catching up on the cleared event
+        history is dispatched to all subscribers.
+        """
+        with self.lock:
+            if isinstance(result, Got):
+                subscriptions = [s for subscriptions in
+                                 self.subscriptions.values()
+                                 for s in subscriptions]
+            else:
+                node = result.node or result.prev_node
+                key = normalize_key(node.key)
+                subscriptions = []
+                for ancestor_key in ancestor_keys(key):
+                    exact = ancestor_key == key
+                    for s in self.subscriptions.get(ancestor_key, ()):
+                        if exact or s.recursive:
+                            subscriptions.append(s)
+        for subscription in subscriptions:
+            try:
+                subscription.callback(result)
+            except Exception:
+                self.handle_error(subscription, result)
+
+    def handle_error(self, subscription, result):
+        """Called when a callback raises an exception.  It prints the
+        traceback to stderr by default.
+        """
+        traceback.print_exc(file=sys.stderr)
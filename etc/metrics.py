@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+   etc.metrics
+   ~~~~~~~~~~~
+
+   Hooks to observe requests and an in-memory collector of them.
+
+"""
+from __future__ import absolute_import
+
+import bisect
+import threading
+
+from six.moves import xrange
+
+from etc.errors import EtcdError, TimedOut
+
+
+__all__ = ['Histogram', 'Metrics', 'Observer']
+
+
+class Observer(object):
+    """Receives reports of requests.  Override some of the methods and
+    register it by :meth:`etc.Client.observe`.  They are called in the
+    requesting threads so they should be fast and thread-safe.
+    """
+
+    def on_request(self, method, key, elapsed, error=None):
+        """Called when a request of :class:`etc.Client` has finished.
+        `method` is one of ``get``, ``wait``, ``walk``, ``set``, ``refresh``,
+        ``append`` and ``delete``.  `error` is the raised exception.
+        """
+
+    def on_watch(self, key, lag):
+        """Called when a waiting request has received an event.  `lag` is the
+        number of the events after it when it was received.
+        """
+
+    def on_http(self, method, url, status, elapsed, sent, received):
+        """Called when an HTTP response has arrived.  `sent` and `received`
+        are the sizes of the bodies.
+        """
+
+    def on_retry(self, method, key, error):
+        """Called when an adapter requests again because of the error."""
+
+
+class Histogram(object):
+    """Counts samples in buckets of the upper bounds.  Percentiles are the
+    upper bounds of the buckets.
+    """
+
+    __slots__ = ('bounds', 'counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    @classmethod
+    def exponential(cls, start, factor, size):
+        return cls([start * factor ** x for x in xrange(size)])
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """The upper bound of the bucket of the `p` (0-1) percentile.  The
+        maximum if it is over the bounds.  ``None`` if empty.
+        """
+        if not self.count:
+            return None
+        rank = p * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank and seen:
+                return min(bound, self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / float(self.count) if self.count else None
+
+    def to_dict(self):
+        return {'count': self.count, 'mean': self.mean,
+                'min': self.min, 'max': self.max,
+                'p50': self.percentile(0.5), 'p90': self.percentile(0.9),
+                'p99': self.percentile(0.99)}
+
+
+def latency_histogram():
+    # 0.1ms to about 100s.
+    return Histogram.exponential(0.0001, 2 ** 0.5, 40)
+
+
+class Metrics(Observer):
+    """Collects the reports in memory::
+
+       metrics = Metrics()
+       etcd.observe(metrics)
+       ...
+       print(metrics.latencies['get'].percentile(0.99))
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            #: Latency histograms by methods.
+            self.latencies = {}
+            #: The numbers of the etcd errors by errnos.
+            self.errors = {}
+            #: The numbers of the timed out requests by methods.
+            self.timeouts = {}
+            #: The numbers of the retries by methods.
+            self.retries = {}
+            #: The histogram of the watch lags in events.
+            self.watch_lags = Histogram.exponential(1, 2, 21)
+            #: The latency histogram of the HTTP responses.
+            self.http_latencies = latency_histogram()
+            self.bytes_sent = 0
+            self.bytes_received = 0
+
+    def on_request(self, method, key, elapsed, error=None):
+        with self.lock:
+            try:
+                histogram = self.latencies[method]
+            except KeyError:
+                histogram = self.latencies[method] = latency_histogram()
+            histogram.add(elapsed)
+            if isinstance(error, EtcdError):
+                self.errors[error.errno] = self.errors.get(error.errno, 0) + 1
+            elif isinstance(error, TimedOut):
+                self.timeouts[method] = self.timeouts.get(method, 0) + 1
+
+    def on_watch(self, key, lag):
+        with self.lock:
+            self.watch_lags.add(lag)
+
+    def on_http(self, method, url, status, elapsed, sent, received):
+        with self.lock:
+            self.http_latencies.add(elapsed)
+            self.bytes_sent += sent
+            self.bytes_received += received
+
+    def on_retry(self, method, key, error):
+        with self.lock:
+            self.retries[method] = self.retries.get(method, 0) + 1
+
+    def to_dict(self):
+        """Makes a JSON serializable snapshot."""
+        with self.lock:
+            return {
+                'latencies': dict((m, h.to_dict()) for m, h in
+                                  self.latencies.items()),
+                'errors': dict(self.errors),
+                'timeouts': dict(self.timeouts),
+                'retries': dict(self.retries),
+                'watch_lags': self.watch_lags.to_dict(),
+                'http_latencies': self.http_latencies.to_dict(),
+                'bytes_sent': self.bytes_sent,
+                'bytes_received': self.bytes_received,
+            }
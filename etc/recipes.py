@@ -0,0 +1,639 @@
+# -*- coding: utf-8 -*-
+"""
+   etc.recipes
+   ~~~~~~~~~~~
+
+   Distributed coordination on etcd.
+
+"""
+from __future__ import absolute_import
+
+from collections import OrderedDict
+import heapq
+import itertools
+import threading
+import time
+
+from etc.errors import (
+    ConnectionError, EtcdError, EtcException, EventIndexCleared, KeyNotFound,
+    NodeExist, TestFailed, TimedOut)
+from etc.helpers import gen_repr, normalize_key, Worker
+from etc.results import Deleted, Set
+
+
+__all__ = ['Election', 'KeepAlive', 'Lock', 'Queue']
+
+
+def keep(client, key, ttl, keepalive=None, prev_value=None):
+    """Keeps the key alive by the :class:`KeepAlive` or a :class:`Keeper`
+    thread.
+    """
+    if keepalive is None:
+        return Keeper(client, key, ttl, ttl / 3., prev_value)
+    return keepalive.add(key, ttl, prev_value)
+
+
+class Registration(object):
+    """A key registered to a :class:`KeepAlive`."""
+
+    __slots__ = ('keepalive', 'key', 'ttl', 'prev_value', 'deadline',
+                 'expires_at', 'stopped', 'lost', 'error')
+
+    def __init__(self, keepalive, key, ttl, prev_value=None):
+        self.keepalive = keepalive
+        self.key = key
+        self.ttl = ttl
+        self.prev_value = prev_value
+        #: When to refresh next time.
+        self.deadline = None
+        #: When the key will expire unless refreshed.
+        self.expires_at = None
+        self.stopped = False
+        #: Whether the key has been failed to be refreshed.
+        self.lost = False
+        self.error = None
+
+    def __repr__(self):
+        return gen_repr(self.__class__, u'{0}', self.key, options=[
+            ('ttl', self.ttl), ('lost', self.lost or None),
+        ])
+
+    def stop(self):
+        """Stops refreshing the key."""
+        self.keepalive.remove(self)
+
+
+class KeepAlive(Worker):
+    """Refreshes the TTLs of many keys by a thread::
+
+       keepalive = KeepAlive(etcd)
+       etcd.set('/services/web/10.0.0.1', u'up', ttl=10)
+       keepalive.add('/services/web/10.0.0.1', 10)
+
+    A key is refreshed after `ratio` of its TTL.  The keys to be refreshed
+    within `coalesce` seconds are refreshed together by a batch so the
+    adapter may request them concurrently.  A failed refresh is retried
+    every `retry_interval` seconds until the key expires.  A key which has
+    expired or been replaced is reported to :meth:`handle_failure` and
+    collected in :attr:`failed`.  :meth:`stop` stops refreshing all keys
+    after the current batch.
+    """
+
+    def __init__(self, client, ratio=2 / 3., coalesce=0.5, retry_interval=1):
+        self.cond = threading.Condition()
+        super(KeepAlive, self).__init__(self.cond, retry_interval)
+        self.client = client
+        self.ratio = ratio
+        self.coalesce = coalesce
+        #: Registrations by keys.
+        self.registrations = {}
+        #: Errors by the keys failed to be refreshed.
+        self.failed = {}
+        #: The number of batches requested.
+        self.batches = 0
+        # A heap of the deadlines, sequential numbers and registrations.
+        # An entry is ignored if the registration has been rescheduled.
+        self.heap = []
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.registrations)
+
+    def add(self, key, ttl, prev_value=None):
+        """Registers a key which has been set with the TTL just now.  Returns
+        a :class:`Registration` which can be stopped.
+        """
+        registration = Registration(self, key, ttl, prev_value)
+        now = time.time()
+        with self.cond:
+            previous = self.registrations.get(key)
+            if previous is not None:
+                previous.stopped = True
+            self.registrations[key] = registration
+            self.failed.pop(key, None)
+            registration.expires_at = now + ttl
+            self.schedule(registration, now + ttl * self.ratio)
+        self.start()
+        return registration
+
+    def remove(self, registration):
+        """Stops refreshing a key by the registration or the key."""
+        with self.cond:
+            if not isinstance(registration, Registration):
+                registration = self.registrations[registration]
+            registration.stopped = True
+            if self.registrations.get(registration.key) is registration:
+                del self.registrations[registration.key]
+
+    def schedule(self, registration, deadline):
+        registration.deadline = deadline
+        heapq.heappush(self.heap,
+                       (deadline, next(self.counter), registration))
+        if self.heap[0][2] is registration:
+            self.cond.notify()
+
+    def wake(self):
+        with self.cond:
+            self.cond.notify()
+
+    def pop_due(self):
+        """Waits until some keys should be refreshed then pops them."""
+        heap = self.heap
+        with self.cond:
+            while not self.stopped:
+                if heap:
+                    timeout = heap[0][0] - time.time()
+                    if timeout <= 0:
+                        break
+                else:
+                    timeout = None
+                self.cond.wait(timeout)
+            if self.stopped:
+                return None
+            limit = time.time() + self.coalesce
+            due = []
+            while heap and heap[0][0] <= limit:
+                deadline, __, registration = heapq.heappop(heap)
+                if registration.stopped or registration.deadline != deadline:
+                    continue
+                due.append(registration)
+            return due
+
+    def run(self):
+        while True:
+            due = self.pop_due()
+            if due is None:
+                break
+            elif due:
+                self.refresh(due)
+
+    def refresh(self, registrations):
+        """Refreshes keys by a batch and reschedules them."""
+        batch = self.client.batch()
+        for registration in registrations:
+            batch.refresh(registration.key, registration.ttl,
+                          prev_value=registration.prev_value)
+        now = time.time()
+        try:
+            results = batch.run()
+        except EtcException as exc:
+            results = [exc] * len(registrations)
+        self.batches += 1
+        failures = []
+        with self.cond:
+            for registration, result in zip(registrations, results):
+                if registration.stopped:
+                    continue
+                elif isinstance(result, (KeyNotFound, TestFailed)):
+                    failures.append((registration, result))
+                elif isinstance(result, EtcException):
+                    retry_at = now + self.retry_interval
+                    if retry_at < registration.expires_at:
+                        self.schedule(registration, retry_at)
+                    else:
+                        failures.append((registration, result))
+                else:
+                    registration.expires_at = now + registration.ttl
+                    self.schedule(registration,
+                                  now + registration.ttl * self.ratio)
+            for registration, error in failures:
+                registration.lost = True
+                registration.error = error
+                self.failed[registration.key] = error
+                self.remove(registration)
+        for registration, error in failures:
+            self.handle_failure(registration, error)
+
+    def handle_failure(self, registration, error):
+        """Called when a key is failed to be refreshed.  Override it to be
+        notified.
+        """
+
+
+class Keeper(object):
+    """Refreshes the TTL of a key periodically in a thread until stopped or
+    the key is lost.  If `prev_value` is given, the key is lost also when it
+    has been replaced with another value.
+    """
+
+    def __init__(self, client, key, ttl, interval, prev_value=None):
+        self.client = client
+        self.key = key
+        self.ttl = ttl
+        self.interval = interval
+        self.prev_value = prev_value
+        #: Whether the key has been lost before stopped.
+        self.lost = False
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            try:
+                self.client.refresh(self.key, self.ttl,
+                                    prev_value=self.prev_value)
+            except (KeyNotFound, TestFailed):
+                self.lost = True
+                break
+            except EtcException:
+                # Try again at the next interval within the TTL.
+                continue
+
+
+class Lock(object):
+    """A distributed mutex under a directory key::
+
+       lock = Lock(etcd, '/locks/db')
+       with lock:
+           ...
+
+    Each contender appends an in-order key to the directory and waits only
+    for its predecessor to be deleted so a release wakes up one contender.
+    The key expires after `ttl` seconds if the holder dies.  A keeper thread
+    refreshes it every `ttl` / 3 seconds while contending or holding.  Pass
+    a shared :class:`KeepAlive` as `keepalive` not to make a thread for each
+    lock.
+    """
+
+    def __init__(self, client, key, ttl=30, value=u'', keepalive=None):
+        self.client = client
+        self.key = key
+        self.ttl = ttl
+        self.value = value
+        #: A :class:`KeepAlive` to refresh the key instead of a thread.
+        self.keepalive = keepalive
+        #: The appended key while contending or holding.
+        self.node_key = None
+        self.keeper = None
+        self.acquired = False
+
+    def __repr__(self):
+        return gen_repr(self.__class__, u'{0}', self.key, options=[
+            ('acquired', self.acquired or None),
+        ])
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    @property
+    def lost(self):
+        """Whether the key has expired while holding the lock."""
+        return self.keeper is not None and self.keeper.lost
+
+    def acquire(self, blocking=True, timeout=None):
+        """Acquires the lock.  Returns ``False`` if it is not acquired without
+        blocking or within the timeout.
+        """
+        if self.acquired:
+            raise RuntimeError('Already acquired')
+        deadline = None if timeout is None else time.time() + timeout
+        result = self.client.append(self.key, self.value, ttl=self.ttl)
+        self.node_key = result.key
+        self.keeper = keep(self.client, self.node_key, self.ttl,
+                           self.keepalive)
+        try:
+            acquired = self.contend(blocking, deadline)
+        except:
+            self.abandon()
+            raise
+        if not acquired:
+            self.abandon()
+        return acquired
+
+    def contend(self, blocking, deadline):
+        while True:
+            nodes = self.client.get(self.key, sorted=True).nodes
+            keys = [node.key for node in nodes]
+            try:
+                position = keys.index(self.node_key)
+            except ValueError:
+                raise KeyNotFound(u'Lock key has expired', self.node_key)
+            if position == 0:
+                self.acquired = True
+                return True
+            elif not blocking:
+                return False
+            predecessor = nodes[position - 1]
+            if deadline is None:
+                timeout = None
+            else:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    return False
+            try:
+                result = self.client.wait(predecessor.key,
+                                          predecessor.modified_index + 1,
+                                          timeout=timeout)
+            except TimedOut:
+                return False
+            except EventIndexCleared:
+                continue
+            if position == 1 and isinstance(result, Deleted):
+                # The holder released.  In-order keys are never inserted
+                # before ours so it is ours.
+                self.acquired = True
+                return True
+
+    def release(self):
+        """Releases the lock."""
+        if not self.acquired:
+            raise RuntimeError('Not acquired')
+        self.abandon()
+
+    def abandon(self):
+        self.acquired = False
+        self.keeper.stop()
+        try:
+            self.client.delete(self.node_key)
+        except KeyNotFound:
+            pass
+        self.node_key = None
+
+
+class Election(object):
+    """Elects a leader among candidates by a key::
+
+       election = Election(etcd, '/election/db', u'10.0.0.1')
+       election.campaign()
+       while election.is_leader:
+           ...
+
+    A candidate wins by creating the key with `ttl`.  The leader's keeper
+    thread or the given :class:`KeepAlive` refreshes it.  Followers wait for
+    the key to be deleted or expired from the index they have seen, so they
+    campaign again as soon as etcd notifies the loss.  The value should be
+    unique among the candidates.
+    """
+
+    def __init__(self, client, key, value, ttl=10, keepalive=None):
+        self.client = client
+        self.key = key
+        self.value = value
+        self.ttl = ttl
+        #: A :class:`KeepAlive` to refresh the key instead of a thread.
+        self.keepalive = keepalive
+        self.keeper = None
+        #: The number of times this candidate has won after the previous
+        #: leader was lost.
+        self.failovers = 0
+        #: Seconds from when each loss of the previous leader was noticed to
+        #: when this candidate won.
+        self.failover_times = []
+
+    def __repr__(self):
+        return gen_repr(self.__class__, u'{0}', self.key, options=[
+            ('value', self.value), ('leader', self.is_leader or None),
+        ])
+
+    def __enter__(self):
+        self.campaign()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.resign()
+
+    @property
+    def is_leader(self):
+        keeper = self.keeper
+        return keeper is not None and not keeper.lost
+
+    def leader(self):
+        """The value of the current leader.  ``None`` if no leader."""
+        try:
+            return self.client.get(self.key).value
+        except KeyNotFound:
+            return None
+
+    def campaign(self, blocking=True, timeout=None):
+        """Campaigns until this candidate becomes the leader.  Returns
+        ``False`` if it doesn't win without blocking or within the timeout.
+        """
+        if self.is_leader:
+            raise RuntimeError('Already the leader')
+        deadline = None if timeout is None else time.time() + timeout
+        lost_at = None
+        while True:
+            try:
+                self.client.create(self.key, self.value, ttl=self.ttl)
+            except NodeExist:
+                pass
+            else:
+                self.keeper = keep(self.client, self.key, self.ttl,
+                                   self.keepalive, prev_value=self.value)
+                if lost_at is not None:
+                    self.failovers += 1
+                    self.failover_times.append(time.time() - lost_at)
+                return True
+            if not blocking:
+                return False
+            try:
+                result = self.client.get(self.key)
+            except KeyNotFound:
+                continue
+            if deadline is None:
+                timeout = None
+            else:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    return False
+            try:
+                result = self.client.wait(self.key, result.modified_index + 1,
+                                          timeout=timeout)
+            except TimedOut:
+                return False
+            except EventIndexCleared:
+                continue
+            if isinstance(result, Deleted):
+                lost_at = time.time()
+
+    def resign(self):
+        """Gives up the leadership."""
+        keeper, self.keeper = self.keeper, None
+        if keeper is None:
+            return
+        keeper.stop()
+        if keeper.lost:
+            return
+        try:
+            self.client.delete(self.key, prev_value=self.value)
+        except (KeyNotFound, TestFailed):
+            pass
+
+
+class Queue(Worker):
+    """A work queue of in-order keys under a directory key::
+
+       queue = Queue(etcd, '/jobs')
+       queue.put(u'job')
+       for value in queue.get_batch(100):
+           ...
+
+    Consumers keep the listing of the queue in memory.  It is made by a
+    sorted get at first then kept up to date by a recursive watch thread, so
+    a dequeue doesn't list the whole queue.  Items are claimed by
+    compare-and-deletes at once so an item is taken by only one consumer.
+
+    If the watch falls behind the event history, it skips to the current
+    index and the queue is listed again when the listing runs out.
+    :meth:`get_batch` starts the watch thread automatically.
+    """
+
+    def __init__(self, client, key, timeout=1, retry_interval=1):
+        self.cond = threading.Condition()
+        super(Queue, self).__init__(self.cond, retry_interval)
+        self.client = client
+        self.key = normalize_key(key)
+        #: The timeout of each long-polling request of the watch thread.
+        self.timeout = timeout
+        #: Modified indices and values by keys in order.
+        self.items = OrderedDict()
+        #: The etcd index which the listing reflects.
+        self.index = None
+        #: Whether some events have been missed.
+        self.stale = False
+
+    def __repr__(self):
+        return gen_repr(self.__class__, u'{0}', self.key)
+
+    def __len__(self):
+        """The number of the items in the listing."""
+        return len(self.items)
+
+    def put(self, value, ttl=None):
+        """Enqueues a value."""
+        return self.client.append(self.key, value, ttl=ttl)
+
+    def put_many(self, values, ttl=None):
+        """Enqueues values at once.  The adapter may request them
+        concurrently so the order among them is not guaranteed.  A failure is
+        returned as an :exc:`etc.EtcdError` instead of raised.
+        """
+        batch = self.client.batch()
+        for value in values:
+            batch.append(self.key, value, ttl=ttl)
+        return batch.run()
+
+    def get_batch(self, n, block=True, timeout=None):
+        """Dequeues up to `n` values.  It blocks until at least a value is
+        dequeued unless `block` is ``False``.  Returns an empty list if no
+        value is dequeued within the timeout.
+        """
+        self.start()
+        deadline = None if timeout is None else time.time() + timeout
+        values = []
+        while not values:
+            with self.cond:
+                while not self.items:
+                    if self.stale:
+                        self.snapshot()
+                        continue
+                    elif not block:
+                        return values
+                    elif deadline is None:
+                        self.cond.wait()
+                        continue
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return values
+                    self.cond.wait(remaining)
+                count = min(n, len(self.items))
+                claims = [self.items.popitem(last=False)
+                          for x in range(count)]
+            batch = self.client.batch()
+            for key, (modified_index, __) in claims:
+                batch.delete(key, prev_index=modified_index)
+            try:
+                results = batch.run()
+            except Exception:
+                self.unclaim(claims)
+                raise
+            for (key, (__, value)), result in zip(claims, results):
+                # A failed item has been claimed by another consumer or
+                # modified.  The watch puts a modified item back.
+                if not isinstance(result, EtcdError):
+                    values.append(value)
+        return values
+
+    def unclaim(self, claims):
+        """Puts the claimed items back in front of the listing when the
+        claims failed to be requested.  An item which has been changed in
+        the meantime keeps the newer value.
+        """
+        with self.cond:
+            items = list(self.items.items())
+            self.items.clear()
+            for key, item in claims + items:
+                self.items[key] = item
+            self.cond.notify_all()
+
+    def prepare(self):
+        """Lists the queue before watching."""
+        self.snapshot()
+
+    def snapshot(self):
+        try:
+            result = self.client.get(self.key, sorted=True)
+        except KeyNotFound as exc:
+            nodes, index = (), exc.index
+        else:
+            nodes, index = result.nodes, result.etcd_index
+        with self.cond:
+            self.items.clear()
+            for node in nodes:
+                self.items[node.key] = (node.modified_index,
+                                        getattr(node, 'value', None))
+            self.index = index
+            self.stale = False
+            self.cond.notify_all()
+
+    def apply(self, result):
+        node = result.node or result.prev_node
+        key = normalize_key(node.key)
+        if key == self.key:
+            if isinstance(result, Deleted):
+                self.items.clear()
+            return
+        elif key.rsplit(u'/', 1)[0] != self.key:
+            # Not an item.
+            return
+        if isinstance(result, Deleted):
+            self.items.pop(key, None)
+        elif isinstance(result, Set):
+            # Appended keys come in order.
+            self.items[key] = (node.modified_index,
+                               getattr(node, 'value', None))
+            self.cond.notify_all()
+
+    def run(self):
+        while not self.stopped:
+            try:
+                result = self.client.wait(self.key, self.index + 1,
+                                          recursive=True,
+                                          timeout=self.timeout)
+            except TimedOut:
+                continue
+            except EventIndexCleared as exc:
+                with self.cond:
+                    self.index = exc.index
+                    self.stale = True
+                    self.cond.notify_all()
+                continue
+            except ConnectionError:
+                time.sleep(self.retry_interval)
+                continue
+            if self.stopped:
+                break
+            node = result.node
+            with self.cond:
+                self.apply(result)
+                self.index = (result.etcd_index if node is None
+                              else node.modified_index)
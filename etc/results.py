@@ -5,6 +5,7 @@
 """
 from __future__ import absolute_import
 
+import iso8601
 import six
 
 from etc.helpers import gen_repr, registry
@@ -19,13 +20,15 @@ def __eq__(self, other):
     """Common `__eq__` implementation for classes which has `__slots__`."""
     if self.__class__ is not other.__class__:
         return False
-    return all(getattr(self, attr) == getattr(other, attr)
-               for attr in self.__slots__)
+    # A private slot such as `_expiration` is compared by its property.
+    attrs = (attr.lstrip('_') for attr in self.__slots__)
+    return all(getattr(self, a) == getattr(other, a) for a in attrs)
 
 
 class Node(object):
 
-    __slots__ = ('key', 'modified_index', 'created_index', 'ttl', 'expiration')
+    __slots__ = ('key', 'modified_index', 'created_index', 'ttl',
+                 '_expiration')
 
     def __init__(self, key, modified_index=None, created_index=None,
                  ttl=None, expiration=None):
@@ -33,7 +36,21 @@ class Node(object):
         self.modified_index = modified_index
         self.created_index = created_index
         self.ttl = ttl
-        self.expiration = expiration
+        self._expiration = expiration
+
+    @property
+    def expiration(self):
+        """The expiration datetime.  It may be given as an RFC 3339 string
+        then it is parsed at the first access.
+        """
+        expiration = self._expiration
+        if isinstance(expiration, six.string_types):
+            expiration = self._expiration = iso8601.parse_date(expiration)
+        return expiration
+
+    @expiration.setter
+    def expiration(self, expiration):
+        self._expiration = expiration
 
     @property
     def index(self):
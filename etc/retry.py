@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+   etc.retry
+   ~~~~~~~~~
+
+   Policies to retry failed requests.
+
+"""
+from __future__ import absolute_import
+
+import random
+import threading
+import time
+
+from etc.errors import (
+    ConnectionError, ConnectionRefused, HTTPError, LeaderElect, RaftInternal)
+
+
+__all__ = ['RetryBudget', 'RetryPolicy']
+
+
+class RetryBudget(object):
+    """Limits retries to a ratio of requests not to overload etcd when it is
+    failing.  Each request deposits `ratio` tokens and each retry withdraws
+    a token.  Up to `reserve` tokens are kept for bursts.
+    """
+
+    def __init__(self, ratio=0.1, reserve=10):
+        self.ratio = ratio
+        self.reserve = reserve
+        self.tokens = float(reserve)
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.tokens + self.ratio, self.reserve)
+
+    def withdraw(self):
+        """Takes a token for a retry.  Returns ``False`` if exhausted."""
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class RetryPolicy(object):
+    """Decides whether and when to request again::
+
+       policy = RetryPolicy(max_attempts=5, budget=RetryBudget())
+       etcd = etc.etcd(url, retry_policy=policy)
+
+    A request is retried up to `max_attempts` in total with exponential
+    backoff from `backoff` seconds to `max_backoff` seconds.  The delay is
+    randomized by `jitter` (0-1) of itself not to retry all at once.  A
+    shared `budget` limits the retries of all requests with the policy.
+
+    A failure to connect and a leader election are always retried because
+    etcd hasn't received or applied the request.  Other connection failures
+    such as a timeout or an aborted connection, and a server error are
+    retried only for idempotent requests because the request might have been
+    sent and applied: reads, refreshes and writes guarded by `prev_value`,
+    `prev_index` or ``prev_exist=False``.  A guarded write which had been
+    applied before the failure fails by the guard on the retry.
+    """
+
+    def __init__(self, max_attempts=3, backoff=0.05, max_backoff=5,
+                 multiplier=2, jitter=1, budget=None):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.budget = budget
+
+    def delay(self, attempt):
+        """Seconds to sleep before the `attempt`-th retry from 1."""
+        delay = min(self.backoff * self.multiplier ** (attempt - 1),
+                    self.max_backoff)
+        return delay * (1 - self.jitter * random.random())
+
+    def is_retryable(self, error, idempotent=False):
+        if isinstance(error, (ConnectionRefused, LeaderElect, RaftInternal)):
+            return True
+        elif isinstance(error, HTTPError):
+            # It might have been applied.
+            return idempotent and error.status_code >= 500
+        return idempotent and isinstance(error, ConnectionError)
+
+    def call(self, f, idempotent=False, on_retry=None):
+        """Calls the function until it succeeds or the error is not to be
+        retried.  `on_retry` is called with the error before each retry.
+        """
+        if self.budget is not None:
+            self.budget.deposit()
+        attempt = 1
+        while True:
+            try:
+                return f()
+            except Exception as exc:
+                if attempt >= self.max_attempts or \
+                   not self.is_retryable(exc, idempotent) or \
+                   self.budget is not None and not self.budget.withdraw():
+                    raise
+                if on_retry is not None:
+                    on_retry(exc)
+            time.sleep(self.delay(attempt))
+            attempt += 1
+
+
+#: Doesn't retry.  Its backoff paces the reconnection of waiting gets
+#: without timeout.
+NO_RETRY = RetryPolicy(max_attempts=1)
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+   etc.server
+   ~~~~~~~~~~
+
+   A local HTTP server which speaks the etcd v2 keys API by a mock to test
+   and benchmark the HTTP path without etcd.
+
+"""
+from __future__ import absolute_import
+
+import json
+import select
+import socket
+import threading
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import parse_qsl, unquote, urlsplit
+
+from etc.adapters.mock import MockAdapter, utc
+from etc.errors import (
+    DirNotEmpty, EtcdError, IndexNaN, InvalidField, KeyNotFound, LeaderElect,
+    NodeExist, NotFile, RaftInternal, TestFailed, TimedOut, TTLNaN,
+    Unauthorized)
+from etc.results import Directory, Value
+
+
+__all__ = ['MockServer']
+
+
+#: HTTP statuses of etcd errors like etcd.  Others are 400.
+ERROR_STATUSES = {
+    KeyNotFound: 404, NotFile: 403, DirNotEmpty: 403, Unauthorized: 401,
+    TestFailed: 412, NodeExist: 412, RaftInternal: 500, LeaderElect: 500,
+}
+
+#: Messages of etcd errors which the mock raises without a message.
+ERROR_MESSAGES = {
+    100: u'Key not found', 101: u'Compare failed', 102: u'Not a file',
+    104: u'Not a directory', 105: u'Key already exists',
+    202: u'The given TTL in POST form is not a number',
+    203: u'The given index in POST form is not a number',
+    209: u'Invalid field', 211: u'Value provided on refresh',
+    212: u'A TTL must be provided on refresh',
+}
+
+
+def dump_node(node):
+    """Encodes a node as the JSON data of etcd."""
+    data = {}
+    if node.modified_index is not None and node.key not in (u'', u'/'):
+        data.update(key=node.key, modifiedIndex=node.modified_index,
+                    createdIndex=node.created_index)
+    if node.ttl is not None:
+        data.update(ttl=node.ttl, expiration=utc(node.expiration).strftime(
+            '%Y-%m-%dT%H:%M:%S.%fZ'))
+    if isinstance(node, Value):
+        data['value'] = node.value
+    elif isinstance(node, Directory):
+        data['dir'] = True
+        if node.nodes:
+            data['nodes'] = [dump_node(n) for n in node.nodes]
+    return data
+
+
+def text(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def parse_bool(params, name):
+    try:
+        value = params[name]
+    except KeyError:
+        return None
+    if value not in (u'true', u'false'):
+        raise InvalidField(u'Invalid field', u'invalid value for %s' % name)
+    return value == u'true'
+
+
+def parse_number(params, name, error_class=IndexNaN, number_class=int):
+    try:
+        value = params[name]
+    except KeyError:
+        return None
+    try:
+        return number_class(value)
+    except ValueError:
+        raise error_class(cause=name)
+
+
+def parse_ttl(params):
+    """Parses the TTL.  Fractional seconds are allowed unlike etcd because
+    the mock supports them.
+    """
+    ttl = parse_number(params, 'ttl', TTLNaN, float)
+    if ttl is not None and ttl == int(ttl):
+        ttl = int(ttl)
+    return ttl
+
+
+class MockRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # Buffered not to send the headers and the body in separate packets.
+    wbufsize = -1
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections.add(self.connection)
+
+    def finish(self):
+        with self.server.lock:
+            self.server.connections.discard(self.connection)
+        BaseHTTPServer.BaseHTTPRequestHandler.finish(self)
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/v2/members':
+            self.send_json(200, self.server.dump_members())
+        elif path == '/v2/stats/self':
+            self.send_json(200, self.server.dump_stats())
+        else:
+            self.serve(self.get)
+
+    def do_PUT(self):
+        self.serve(self.set)
+
+    def do_POST(self):
+        self.serve(self.append)
+
+    def do_DELETE(self):
+        self.serve(self.delete)
+
+    def get(self, adapter, key, params):
+        recursive = bool(parse_bool(params, 'recursive'))
+        sorted = bool(parse_bool(params, 'sorted'))
+        quorum = bool(parse_bool(params, 'quorum'))
+        if not parse_bool(params, 'wait'):
+            return adapter.get(key, recursive=recursive, sorted=sorted,
+                               quorum=quorum)
+        wait_index = parse_number(params, 'waitIndex')
+        if not wait_index:
+            # Not to miss an event between the polls.
+            wait_index = adapter.index + 1
+        # Polls in slices to give up when the client has gone.
+        while True:
+            try:
+                return adapter.get(key, recursive=recursive, wait=True,
+                                   wait_index=wait_index,
+                                   timeout=self.server.poll_interval)
+            except TimedOut:
+                if self.disconnected():
+                    return None
+
+    def set(self, adapter, key, params):
+        dir = bool(parse_bool(params, 'dir'))
+        refresh = bool(parse_bool(params, 'refresh'))
+        value = params.get('value')
+        if value is None and not dir and not refresh:
+            value = u''
+        return adapter.set(key, value, dir=dir, ttl=parse_ttl(params),
+                           refresh=refresh,
+                           prev_value=params.get('prevValue'),
+                           prev_index=parse_number(params, 'prevIndex'),
+                           prev_exist=parse_bool(params, 'prevExist'))
+
+    def append(self, adapter, key, params):
+        dir = bool(parse_bool(params, 'dir'))
+        value = params.get('value')
+        if value is None and not dir:
+            value = u''
+        return adapter.append(key, value, dir=dir, ttl=parse_ttl(params))
+
+    def delete(self, adapter, key, params):
+        return adapter.delete(key, dir=bool(parse_bool(params, 'dir')),
+                              recursive=bool(parse_bool(params, 'recursive')),
+                              prev_value=params.get('prevValue'),
+                              prev_index=parse_number(params, 'prevIndex'))
+
+    def disconnected(self):
+        """Whether the client has closed the connection."""
+        readable, __, __ = select.select([self.connection], [], [], 0)
+        if not readable:
+            return False
+        try:
+            return not self.connection.recv(1, socket.MSG_PEEK)
+        except socket.error:
+            return True
+
+    def serve(self, request):
+        url = urlsplit(self.path)
+        if not url.path.startswith('/v2/keys'):
+            self.send_error(404)
+            return
+        key = text(unquote(url.path[len('/v2/keys'):])) or u'/'
+        params = dict((text(k), text(v)) for k, v in parse_qsl(url.query))
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            body = self.rfile.read(length).decode('utf-8')
+            params.update((text(k), text(v)) for k, v in parse_qsl(body))
+        adapter = self.server.adapter
+        try:
+            result = request(adapter, key, params)
+        except EtcdError as exc:
+            status = ERROR_STATUSES.get(exc.__class__, 400)
+            message = exc.message or ERROR_MESSAGES.get(exc.errno, u'')
+            index = adapter.index if exc.index is None else exc.index
+            self.send_json(status, {'errorCode': exc.errno,
+                                    'message': message,
+                                    'cause': exc.cause or key,
+                                    'index': index})
+            return
+        if result is None:
+            self.close_connection = True
+            return
+        data = {'action': result.action, 'node': dump_node(result.node)}
+        if result.prev_node is not None:
+            data['prevNode'] = dump_node(result.prev_node)
+        status = 201 if result.action == 'create' else 200
+        self.send_json(status, data)
+
+    def send_json(self, status, data):
+        content = json.dumps(data).encode('utf-8')
+        index = str(self.server.adapter.index)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('X-Etcd-Index', index)
+        self.send_header('X-Raft-Index', index)
+        self.send_header('X-Raft-Term', '1')
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class MockServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """A local HTTP server which serves ``/v2/keys`` by a
+    :class:`etc.adapters.mock.MockAdapter`::
+
+       server = MockServer()
+       server.start()
+       etcd = etc.etcd(server.url)
+
+    Each connection is served by a thread so many long-polling requests can
+    wait at once.  A waiting request polls the adapter every `poll_interval`
+    seconds to give up when the client has gone.
+
+    Servers sharing an adapter behave as the members of a cluster.  See
+    :meth:`cluster`.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, address=('127.0.0.1', 0), adapter=None,
+                 poll_interval=1):
+        BaseHTTPServer.HTTPServer.__init__(self, address, MockRequestHandler)
+        if adapter is None:
+            adapter = MockAdapter(None)
+        self.adapter = adapter
+        self.poll_interval = poll_interval
+        self.url = u'http://%s:%d' % self.server_address[:2]
+        self.id = u'%x' % self.server_address[1]
+        #: The servers in the same cluster including this server.  The first
+        #: running one is the leader.
+        self.members = [self]
+        #: The open connections to be dropped by :meth:`stop`.
+        self.connections = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @classmethod
+    def cluster(cls, size=3, adapter=None, **kwargs):
+        """Makes servers sharing an adapter as a cluster.  Stop some of them
+        to test failover.
+        """
+        if adapter is None:
+            adapter = MockAdapter(None)
+        servers = [cls(adapter=adapter, **kwargs) for x in range(size)]
+        for server in servers:
+            server.members = servers
+        return servers
+
+    def start(self):
+        """Starts to serve in a thread."""
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stops serving and drops the open connections like a dead etcd."""
+        if self.thread is not None:
+            self.shutdown()
+            self.thread = None
+        self.server_close()
+        with self.lock:
+            connections = list(self.connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def leader(self):
+        for server in self.members:
+            if server.running:
+                return server
+
+    def dump_members(self):
+        return {'members': [{'id': s.id, 'name': s.id,
+                             'clientURLs': [s.url], 'peerURLs': []}
+                            for s in self.members]}
+
+    def dump_stats(self):
+        leader = self.leader()
+        return {'id': self.id, 'name': self.id,
+                'state': 'StateLeader' if leader is self else
+                         'StateFollower',
+                'leaderInfo': {'leader': leader and leader.id}}
@@ -51,6 +51,7 @@ setup(
                  'Programming Language :: Python :: Implementation :: PyPy',
                  'Topic :: Software Development'],
     install_requires=['iso8601', 'requests>=2.8.0'],
+    extras_require={'asyncio': ['aiohttp>=3.0']},
     tests_require=['pytest'],
     test_suite='...',
 )
@@ -1,14 +1,27 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
+import io
+import json
 import os
 import socket
 import threading
 import time
 
 import pytest
+import requests
 from six import b, u
 
 import etc
+from etc.adapter import ProxyAdapter
+from etc.adapters.coalescing import CoalescingAdapter
+from etc.adapters.lru import LRUCacheAdapter
+from etc.adapters.recording import RecordingAdapter, replay
+from etc.cache import CachedClient
+from etc.hub import WatchHub
+from etc.metrics import Histogram, Metrics
+from etc.recipes import Election, KeepAlive, Lock, Queue
+from etc.retry import RetryBudget, RetryPolicy
+from etc.server import MockServer
 
 
 ETC_TEST_ETCD_URL = os.getenv('ETC_TEST_ETCD_URL', 'http://127.0.0.1:2379')
@@ -22,7 +35,7 @@ def node_values(nodes):
     return [n.value for n in nodes]
 
 
-@pytest.fixture(params=['etcd', 'mock'])
+@pytest.fixture(params=['etcd', 'mock', 'server'])
 def etcd(request):
     mode = request.param
     mark = request.node.get_marker('etcd')
@@ -32,6 +45,11 @@ def etcd(request):
         etcd = etc.etcd(ETC_TEST_ETCD_URL)
     elif mode == 'mock':
         etcd = etc.etcd(mock=True)
+    elif mode == 'server':
+        server = MockServer(poll_interval=0.1)
+        server.start()
+        request.addfinalizer(server.stop)
+        etcd = etc.etcd(server.url)
     else:
         raise AssertionError
     result = etcd.get('/', recursive=True)
@@ -149,6 +167,304 @@ def test_append(etcd, spawn_later):
     assert r.value == u('four')
     r = etcd.get('/etc', sorted=True)
     assert r.values == [u('one'), u('two'), u('three'), u('four')]
+    # Keys are made of the created indices even after the head is deleted.
+    etcd.delete(r.nodes[0].key)
+    r = etcd.append('/etc', u('five'))
+    assert r.key == u('/etc/%020d') % r.created_index
+    r = etcd.get('/etc', sorted=True)
+    assert r.values == [u('two'), u('three'), u('four'), u('five')]
+
+
+def test_watch(etcd, spawn_later):
+    r = etcd.set('/etc', dir=True)
+    for x in range(5):
+        etcd.set('/etc/%d' % x, u(str(x)))
+    spawn_later(0.1, etcd.set, '/etc/5', u('5'))
+    watching = etcd.watch('/etc', r.index + 1, recursive=True, timeout=0.01)
+    results = [next(watching) for x in range(6)]
+    assert node_keys(results) == ['/etc/%d' % x for x in range(6)]
+    assert node_values(results) == [u(str(x)) for x in range(6)]
+    spawn_later(0.1, etcd.delete, '/etc/0')
+    r = next(watching)
+    assert isinstance(r, etc.Deleted)
+    assert r.prev_node.key == '/etc/0'
+
+
+def test_watch_hub(etcd):
+    r = etcd.set('/etc', dir=True)
+    etcd.set('/etc/a', dir=True)
+    etcd.set('/etc/x', u('1'))
+    etcd.set('/etc/a/1', u('2'))
+    etcd.set('/etc/y', u('3'))
+    etcd.set('/etc/a/2', u('4'))
+    etcd.delete('/etc/x')
+    hub = WatchHub(etcd, '/etc', r.index + 1, timeout=0.1)
+    x_results, a_results, done = [], [], threading.Event()
+    def on_result(results, result):
+        results.append(result)
+        # The deletion of /etc/x is the last event.
+        if len(x_results) == 2 and len(a_results) == 3:
+            done.set()
+    hub.subscribe('/etc/x', lambda r: on_result(x_results, r))
+    hub.subscribe('/etc/a', lambda r: on_result(a_results, r),
+                  recursive=True)
+    with pytest.raises(ValueError):
+        hub.subscribe('/xxx', x_results.append)
+    hub.start()
+    assert done.wait(1)
+    hub.stop()
+    assert x_results[0].value == u('1')
+    assert isinstance(x_results[1], etc.Deleted)
+    assert node_keys(a_results) == ['/etc/a', '/etc/a/1', '/etc/a/2']
+
+
+def test_watch_hub_recovery():
+    etcd = etc.etcd(mock=True, history_size=2)
+    r = etcd.set('/etc/a', u('1'))
+    etcd.delete('/etc', recursive=True)
+    etcd.set('/xxx', u('1'))
+    etcd.set('/xxx', u('2'))
+    errors, results = [], []
+    hub = WatchHub(etcd, '/etc', r.index + 1, timeout=0.1,
+                   retry_interval=0.01)
+    hub.handle_watch_error = errors.append
+    hub.subscribe('/etc/a', results.append)
+    hub.start()
+    # The prefix has gone while catching up on the cleared history.
+    for x in range(100):
+        if errors:
+            break
+        time.sleep(0.01)
+    assert isinstance(errors[0], etc.KeyNotFound)
+    etcd.set('/etc/a', u('3'))
+    for x in range(100):
+        if results:
+            break
+        time.sleep(0.01)
+    assert results[0].value == u('3')
+    thread = hub.thread
+    hub.stop()
+    assert not thread.is_alive()
+    # Restarts from the last index.
+    etcd.set('/etc/a', u('4'))
+    hub.start()
+    assert hub.thread is not thread
+    for x in range(100):
+        if len(results) == 2:
+            break
+        time.sleep(0.01)
+    hub.stop()
+    assert [r.value for r in results] == [u('3'), u('4')]
+
+
+def test_cached_client(etcd):
+    etcd.set('/etc', dir=True)
+    etcd.set('/etc/a', u('1'))
+    etcd.set('/etc/d', dir=True)
+    etcd.set('/etc/d/b', u('2'))
+    etcd.set('/xxx', u('3'))
+    quorums = []
+    class QuorumRecordingAdapter(ProxyAdapter):
+        def get(self, key, recursive=False, sorted=False, quorum=False,
+                wait=False, wait_index=None, timeout=None):
+            if not wait:
+                quorums.append((key, quorum))
+            return super(QuorumRecordingAdapter, self).get(
+                key, recursive=recursive, sorted=sorted, quorum=quorum,
+                wait=wait, wait_index=wait_index, timeout=timeout)
+    cached = CachedClient(QuorumRecordingAdapter(etcd.adapter), '/etc',
+                          max_staleness=0.2)
+    def wait_for(index):
+        for x in range(100):
+            if cached.index >= index:
+                break
+            time.sleep(0.01)
+    try:
+        assert cached.get('/etc/a').value == u('1')
+        r = cached.get('/etc', recursive=True, sorted=True)
+        assert node_keys(r.nodes) == ['/etc/a', '/etc/d']
+        assert node_values(r.nodes[1].nodes) == [u('2')]
+        r = cached.get('/etc', sorted=True)
+        assert r.nodes[1].nodes == []
+        assert (cached.hits, cached.misses) == (3, 0)
+        wait_for(etcd.set('/etc/a', u('4')).index)
+        assert cached.get('/etc/a').value == u('4')
+        wait_for(etcd.delete('/etc/d/b').etcd_index)
+        with pytest.raises(etc.KeyNotFound):
+            cached.get('/etc/d/b')
+        assert cached.get('/etc/d').nodes == []
+        assert (cached.hits, cached.misses) == (6, 0)
+        assert cached.get('/xxx').value == u('3')
+        assert cached.misses == 1
+        assert quorums[-1] == ('/xxx', False)
+        time.sleep(0.3)
+        assert cached.is_fresh()
+        cached.stop()
+        time.sleep(0.3)
+        assert not cached.is_fresh()
+        cached.get('/etc/a')
+        assert cached.misses == 2
+        assert quorums[-1] == ('/etc/a', True)
+    finally:
+        cached.stop()
+
+
+def test_cached_client_recovery():
+    etcd = etc.etcd(mock=True, history_size=2)
+    etcd.set('/etc/a', u('0'))
+    watching, errors = threading.Event(), []
+    watching.set()
+    class FlakyAdapter(ProxyAdapter):
+        def get(self, key, recursive=False, sorted=False, quorum=False,
+                wait=False, wait_index=None, timeout=None):
+            if wait:
+                watching.wait()
+            elif not quorum and errors:
+                # Fails to make the mirror.
+                raise errors.pop(0)
+            return super(FlakyAdapter, self).get(
+                key, recursive=recursive, sorted=sorted, quorum=quorum,
+                wait=wait, wait_index=wait_index, timeout=timeout)
+    runs = []
+    class CountingClient(CachedClient):
+        def run(self):
+            runs.append(self)
+            return super(CountingClient, self).run()
+    cached = CountingClient(FlakyAdapter(etcd.adapter), '/etc',
+                            max_staleness=0.3, retry_interval=0.01)
+    reported = []
+    cached.handle_watch_error = reported.append
+    try:
+        # Started once by concurrent gets.
+        threads = [threading.Thread(target=cached.get, args=('/etc/a',))
+                   for x in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(runs) == 1
+        # The watch falls behind the event history.
+        watching.clear()
+        for x in range(1, 6):
+            r = etcd.set('/etc/a', u(str(x)))
+        errors.extend([etc.ConnectionError(), ValueError()])
+        watching.set()
+        for x in range(100):
+            if cached.index >= r.index:
+                break
+            time.sleep(0.01)
+        assert cached.get('/etc/a').value == u('5')
+        assert errors == []
+        assert len(reported) == 1 and isinstance(reported[0], ValueError)
+    finally:
+        thread = cached.thread
+        cached.stop()
+    assert not thread.is_alive()
+
+
+def test_lru_cache_adapter(etcd):
+    adapter = LRUCacheAdapter(etcd.adapter, max_entries=2)
+    cached = etc.Client(adapter)
+    etcd.set('/etc', dir=True)
+    etcd.set('/etc/a', u('1'))
+    etcd.set('/etc/b', u('2'))
+    assert cached.get('/etc/a').value == u('1')
+    assert cached.get('/etc/a').value == u('1')
+    assert (adapter.hits, adapter.misses) == (1, 1)
+    # Invalidated by a write through the same adapter.
+    assert node_values(cached.get('/etc', sorted=True).nodes) == \
+        [u('1'), u('2')]
+    cached.set('/etc/a', u('3'))
+    assert cached.get('/etc/a').value == u('3')
+    assert node_values(cached.get('/etc', sorted=True).nodes) == \
+        [u('3'), u('2')]
+    assert (adapter.hits, adapter.misses) == (1, 4)
+    # Least recently used one is evicted.
+    cached.get('/etc/b')
+    assert list(adapter.cache) == [('/etc', True), ('/etc/b', False)]
+    cached.delete('/etc/a')
+    assert list(adapter.cache) == [('/etc/b', False)]
+    with pytest.raises(etc.KeyNotFound):
+        cached.get('/etc/a')
+    # Not cached.
+    cached.get('/etc', recursive=True)
+    assert list(adapter.cache) == [('/etc/b', False)]
+    # Expired.
+    adapter.max_age = 0.1
+    adapter.clear()
+    cached.get('/etc/b')
+    cached.get('/etc/b')
+    time.sleep(0.1)
+    cached.get('/etc/b')
+    assert (adapter.hits, adapter.misses) == (2, 8)
+
+
+def test_coalescing_adapter(etcd):
+    released = threading.Event()
+    class SlowAdapter(ProxyAdapter):
+        def get(self, *args, **kwargs):
+            released.wait()
+            return super(SlowAdapter, self).get(*args, **kwargs)
+    adapter = CoalescingAdapter(SlowAdapter(etcd.adapter))
+    coalesced = etc.Client(adapter)
+    etcd.set('/etc', u('1'))
+    results = []
+    def get(key='/etc', quorum=False):
+        try:
+            result = coalesced.get(key, quorum=quorum)
+        except etc.KeyNotFound as exc:
+            result = exc
+        results.append((key, quorum, result))
+    threads = [threading.Thread(target=get) for x in range(10)]
+    threads.append(threading.Thread(target=get, kwargs={'quorum': True}))
+    threads.append(threading.Thread(target=get, args=('/missing',)))
+    threads.append(threading.Thread(target=get, args=('/missing',)))
+    for t in threads:
+        t.start()
+    while adapter.requests + adapter.saved < len(threads):
+        time.sleep(0.01)
+    released.set()
+    for t in threads:
+        t.join()
+    assert (adapter.requests, adapter.saved) == (3, 10)
+    assert not adapter.flights
+    shared = set(id(r) for k, q, r in results if k == '/etc' and not q)
+    assert len(shared) == 1
+    errors = [r for k, q, r in results if k == '/missing']
+    assert isinstance(errors[0], etc.KeyNotFound) and errors[0] is errors[1]
+    # Not joined after a write.
+    released.clear()
+    thread = threading.Thread(target=get)
+    thread.start()
+    while not adapter.flights:
+        time.sleep(0.01)
+    coalesced.set('/etc', u('2'))
+    assert not adapter.flights
+    released.set()
+    assert coalesced.get('/etc').value == u('2')
+    thread.join()
+    assert (adapter.requests, adapter.saved) == (5, 10)
+
+
+def test_batch(etcd):
+    etcd.set('/etc', dir=True)
+    results = etcd.set_many([('/etc/%d' % x, u(str(x))) for x in range(20)])
+    assert all(isinstance(r, etc.Set) for r in results)
+    keys = ['/etc/%d' % x for x in range(20)] + ['/etc/xxx']
+    results = etcd.get_many(keys)
+    assert node_values(results[:-1]) == [u(str(x)) for x in range(20)]
+    assert isinstance(results[-1], etc.KeyNotFound)
+    batch = etcd.batch()
+    batch.create('/etc/0', u('0'))
+    batch.update('/etc/1', u('one'))
+    batch.delete('/etc/2')
+    assert len(batch) == 3
+    r1, r2, r3 = batch.run()
+    assert isinstance(r1, etc.NodeExist)
+    assert isinstance(r2, etc.Updated)
+    assert isinstance(r3, etc.Deleted)
+    assert len(batch) == 0
+    assert etcd.set_many({}) == []
 
 
 def test_timeout(etcd):
@@ -195,6 +511,79 @@ def test_recursive_wait_with_old_history(etcd):
     assert r1.node == r4.node
 
 
+def test_bounded_history():
+    etcd = etc.etcd(mock=True, history_size=5)
+    adapter = etcd.adapter
+    r = etcd.set('/etc', dir=True)
+    for x in range(100):
+        etcd.set('/etc/%d' % (x % 3), u(str(x)))
+    assert len(adapter.history) == len(adapter.log) == 5
+    # Forgotten indices are trimmed in batches.
+    assert 0 < len(adapter.stale_keys) < 5
+    with pytest.raises(etc.EventIndexCleared):
+        etcd.wait('/etc', r.index + 1, recursive=True)
+    r = etcd.wait('/etc', adapter.index - 4, recursive=True)
+    assert r.value == u('95')
+    r = etcd.wait('/', adapter.index - 4, recursive=True)
+    assert r.value == u('95')
+    r = etcd.wait('/etc/1', adapter.index - 4)
+    assert r.value == u('97')
+    adapter.trim()
+    assert sum(len(i) for i in adapter.indices.values()) == 5 * 3
+    assert sum(len(i) for i in adapter.exact_indices.values()) == 5
+    # Client.watch() catches up.
+    watching = etcd.watch('/etc', 1, recursive=True)
+    r = next(watching)
+    assert isinstance(r, etc.Got)
+    assert sorted(node_values(r.nodes)) == [u('97'), u('98'), u('99')]
+
+
+def test_mock_concurrency():
+    etcd = etc.etcd(mock=True, history_size=10000)
+    adapter = etcd.adapter
+    r = etcd.set('/etc', dir=True)
+    writers, writes = 4, 200
+    total = writers * writes
+    watched = []
+    def watch(index):
+        indices = []
+        while len(indices) < total:
+            r = etcd.wait('/etc', index, recursive=True, timeout=10)
+            indices.append(r.index)
+            index = r.index + 1
+        watched.append(indices)
+    listened = []
+    def listen():
+        listened.append(etcd.wait('/etc', recursive=True, timeout=10).index)
+    def write(x):
+        for y in range(writes):
+            etcd.set('/etc/%d' % x, u(str(y)))
+    def read():
+        while len(watched) < 8:
+            etcd.get('/etc', recursive=True)
+    threads = [threading.Thread(target=listen) for x in range(8)]
+    for thread in threads:
+        thread.start()
+    # Wait for the listeners to be registered.
+    while sum(len(w) for w in adapter.waiters.values()) < 8:
+        time.sleep(0.001)
+    threads.extend(threading.Thread(target=watch, args=(r.index + 1,))
+                   for x in range(8))
+    threads.extend(threading.Thread(target=read) for x in range(4))
+    threads.extend(threading.Thread(target=write, args=(x,))
+                   for x in range(writers))
+    for thread in threads[8:]:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    expected = list(range(r.index + 1, r.index + 1 + total))
+    assert watched == [expected] * 8
+    # All listeners received exactly the first write.
+    assert listened == [r.index + 1] * 8
+    assert adapter.index == r.index + total
+    assert not adapter.waiters
+
+
 def test_compare(etcd):
     # prev_exist
     etcd.create('/etc', u'1')
@@ -228,6 +617,629 @@ def test_expiration(etcd):
     assert isinstance(r.expiration, datetime)
 
 
+def test_mock_expiration(spawn):
+    from datetime import timedelta
+    now = [datetime(2017, 1, 1)]
+    etcd = etc.etcd(mock=True, history_size=100000, clock=lambda: now[0])
+    adapter = etcd.adapter
+    etcd.set('/etc', dir=True)
+    for x in range(10000):
+        etcd.set('/etc/%d' % x, u(str(x)), ttl=x % 100 + 1)
+    etcd.set('/etc/0', ttl=1000, refresh=True)
+    etcd.set('/etc/1', u('persistent'))
+    r = etcd.append('/etc', u('appended'), ttl=50)
+    assert r.expiration == datetime(2017, 1, 1, 0, 0, 50)
+    r = etcd.get('/etc')
+    assert len(r.nodes) == 10001
+    # Fast-forward.
+    now[0] += timedelta(seconds=50)
+    adapter.expire()
+    # 4998 nodes with TTL and the appended node expired.
+    assert len(etcd.get('/etc').nodes) == 10001 - 4999
+    r = etcd.wait('/etc', r.etcd_index + 1, recursive=True)
+    assert isinstance(r, etc.Expired)
+    assert r.index > r.prev_node.index
+    assert r.prev_node.ttl == 1
+    now[0] += timedelta(seconds=100)
+    assert sorted(etcd.get('/etc').values) == [u('0'), u('persistent')]
+    # A waiter receives the expiration.
+    results = []
+    spawn(lambda: results.append(etcd.wait('/etc/0', timeout=1)))
+    time.sleep(0.1)
+    now[0] += timedelta(seconds=1000)
+    adapter.expire()
+    assert not adapter.deadlines
+    assert etcd.get('/etc').values == [u('persistent')]
+    time.sleep(0.1)
+    assert isinstance(results[0], etc.Expired)
+    assert results[0].key == u('/etc/0')
+
+
+def test_mock_expiration_on_time():
+    etcd = etc.etcd(mock=True)
+    r = etcd.set('/etc', u('etc'))
+    # The waiter sleeps before any TTL so it should be woken up to expire.
+    t = time.time()
+    def refresh():
+        time.sleep(0.1)
+        etcd.set('/etc', ttl=0.2, refresh=True)
+    threading.Thread(target=refresh).start()
+    r = etcd.wait('/etc', r.index + 1, timeout=2)
+    assert isinstance(r, etc.Expired)
+    assert 0.3 <= time.time() - t < 1
+    with pytest.raises(etc.KeyNotFound):
+        etcd.get('/etc')
+
+
+def test_mock_dump(tmpdir):
+    path = str(tmpdir.join('etcd.dump'))
+    etcd = etc.etcd(mock=True)
+    etcd.set('/etc', dir=True)
+    for x in range(10):
+        etcd.set('/etc/%d' % x, dir=True, ttl=10 if x == 1 else None)
+    for x in range(100):
+        etcd.set('/etc/%d/%d' % (x // 10, x), u(str(x)))
+    etcd.set(u('/etc/\xe3\x81\x82'), u('\xe3\x81\x84'), ttl=1.5)
+    etcd.set('/empty', dir=True)
+    etcd.adapter.dump(path)
+    loaded = etc.etcd(mock=True)
+    loaded.adapter.load(path)
+    assert loaded.adapter.index == etcd.adapter.index
+    r1 = etcd.get('/', recursive=True, sorted=True)
+    r2 = loaded.get('/', recursive=True, sorted=True)
+    assert r1.node == r2.node
+    r = loaded.get(u('/etc/\xe3\x81\x82'))
+    assert r.value == u('\xe3\x81\x84')
+    assert r.ttl == 1.5
+    assert r.expiration == etcd.get(u('/etc/\xe3\x81\x82')).expiration
+    r = loaded.get('/etc/1')
+    assert r.ttl == 10
+    assert type(r.ttl) is int
+    assert len(loaded.adapter.deadlines) == 2
+    with pytest.raises(etc.EventIndexCleared):
+        loaded.wait('/etc', 1, recursive=True)
+    # Works as usual.
+    r = loaded.set('/etc/1/10', u('changed'))
+    assert r.index == etcd.adapter.index + 1
+    assert loaded.wait('/etc', r.index, recursive=True) == r
+    with pytest.raises(ValueError):
+        tmpdir.join('garbage').write('garbage' * 10)
+        loaded.adapter.load(str(tmpdir.join('garbage')))
+
+
+def test_mock_load_tree():
+    etcd = etc.etcd(mock=True)
+    etcd.set('/etc', dir=True)
+    etcd.set('/etc/a', u('a'))
+    etcd.set('/etc/b', dir=True, ttl=10)
+    etcd.set('/etc/b/c', u('c'))
+    got = etcd.get('/', recursive=True, sorted=True)
+    now = [datetime(2016, 12, 31)]
+    mock = etc.etcd(mock=True, clock=lambda: now[0])
+    mock.adapter.load_tree(got)
+    assert mock.adapter.index == etcd.adapter.index
+    assert mock.get('/', recursive=True, sorted=True).node == got.node
+    assert len(mock.adapter.deadlines) == 1
+    # From JSON and into a subtree.
+    mock.adapter.load_tree({'action': 'get', 'node': {
+        'key': '/x/y', 'dir': True, 'modifiedIndex': 100,
+        'createdIndex': 50, 'nodes': [
+            {'key': '/x/y/z', 'value': 'z', 'modifiedIndex': 60,
+             'createdIndex': 60, 'ttl': 5,
+             'expiration': '2017-01-01T00:00:00.5+09:00'},
+        ]}})
+    assert mock.adapter.index == 100
+    r = mock.get('/x/y/z')
+    assert r.value == u('z')
+    assert r.expiration == datetime(2016, 12, 31, 15, 0, 0, 500000)
+    assert mock.get('/etc/b/c').value == u('c')
+    now[0] = datetime(2017, 1, 1)
+    r = mock.wait('/x/y/z', 101)
+    assert isinstance(r, etc.Expired)
+
+
+def test_record_and_replay():
+    recorder = RecordingAdapter(etc.etcd(mock=True).adapter)
+    etcd = etc.Client(recorder)
+    etcd.set('/etc', dir=True)
+    etcd.set('/etc/a', u('a'))
+    etcd.append('/etc', u('b'))
+    with pytest.raises(etc.KeyNotFound):
+        etcd.get('/etc/c')
+    assert len(list(etcd.walk('/etc'))) == 2
+    with pytest.raises(etc.TimedOut):
+        etcd.wait('/etc/a', timeout=0.01)
+    etcd.delete('/etc/a')
+    calls = json.loads(json.dumps(recorder.calls))
+    assert [c[2] for c in calls] == \
+        ['set', 'set', 'append', 'get', 'walk', 'get', 'delete']
+    assert calls[0][0] == 0
+    assert calls[5][1] >= 0.01
+    mock = etc.etcd(mock=True)
+    elapsed = replay(calls, mock.adapter)
+    assert len(elapsed) == 7
+    assert elapsed[5] is None
+    assert mock.get('/etc').values == [u('b')]
+    # Replay at the recorded pace.
+    t = time.time()
+    replay(calls, etc.etcd(mock=True).adapter, timing=True, waits=True)
+    assert time.time() - t >= calls[-1][0]
+
+
+def test_lock(etcd):
+    holders = []
+    overlapped = []
+    def contend():
+        with Lock(etcd, '/locks/etc', ttl=10):
+            holders.append(None)
+            if len(holders) > 1:
+                overlapped.append(None)
+            time.sleep(0.01)
+            holders.pop()
+    threads = [threading.Thread(target=contend) for x in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert not overlapped
+    assert etcd.get('/locks/etc').nodes == []
+    lock = Lock(etcd, '/locks/etc', ttl=10)
+    assert lock.acquire()
+    other = Lock(etcd, '/locks/etc', ttl=10)
+    assert not other.acquire(blocking=False)
+    t = time.time()
+    assert not other.acquire(timeout=0.1)
+    assert time.time() - t >= 0.1
+    assert len(etcd.get('/locks/etc').nodes) == 1
+    lock.release()
+    assert other.acquire(blocking=False)
+    with pytest.raises(RuntimeError):
+        other.acquire()
+    other.release()
+    with pytest.raises(RuntimeError):
+        other.release()
+
+
+def test_lock_expiration():
+    etcd = etc.etcd(mock=True)
+    dead = Lock(etcd, '/locks/etc', ttl=0.2)
+    dead.acquire()
+    # The holder dies.
+    dead.keeper.stop()
+    lock = Lock(etcd, '/locks/etc', ttl=0.2)
+    t = time.time()
+    assert lock.acquire(timeout=2)
+    assert 0.1 <= time.time() - t < 1
+    # The keeper keeps the key alive.
+    time.sleep(0.5)
+    assert etcd.get('/locks/etc').nodes[0].key == lock.node_key
+    assert not lock.lost
+    lock.release()
+
+
+def test_election(etcd):
+    a = Election(etcd, '/election/etc', u('a'), ttl=10)
+    b = Election(etcd, '/election/etc', u('b'), ttl=10)
+    assert a.campaign()
+    assert a.is_leader
+    assert not b.campaign(blocking=False)
+    assert not b.campaign(timeout=0.1)
+    assert b.leader() == u('a')
+    with pytest.raises(RuntimeError):
+        a.campaign()
+    won = threading.Event()
+    def campaign():
+        b.campaign()
+        won.set()
+    threading.Thread(target=campaign).start()
+    time.sleep(0.1)
+    a.resign()
+    assert not a.is_leader
+    assert won.wait(1)
+    assert b.is_leader
+    assert b.failovers == 1
+    assert b.failover_times[0] < 0.5
+    # Resigning after the key has been replaced doesn't delete it.
+    etcd.set('/election/etc', u('c'))
+    b.resign()
+    assert b.leader() == u('c')
+
+
+def test_election_expiration():
+    etcd = etc.etcd(mock=True)
+    a = Election(etcd, '/election/etc', u('a'), ttl=0.2)
+    b = Election(etcd, '/election/etc', u('b'), ttl=0.2)
+    a.campaign()
+    # The keeper keeps the leadership.
+    time.sleep(0.5)
+    assert a.is_leader
+    assert not b.campaign(blocking=False)
+    # The leader dies.
+    a.keeper.stop()
+    t = time.time()
+    assert b.campaign(timeout=2)
+    assert time.time() - t < 0.5
+    assert b.failovers == 1
+    assert b.leader() == u('b')
+    # The dead leader doesn't remove the new leader.
+    a.resign()
+    assert b.leader() == u('b')
+    b.resign()
+    assert b.leader() is None
+
+
+def test_keepalive():
+    etcd = etc.etcd(mock=True)
+    failures = []
+    class TestKeepAlive(KeepAlive):
+        def handle_failure(self, registration, error):
+            failures.append(registration.key)
+    keepalive = TestKeepAlive(etcd, coalesce=0.1)
+    registrations = []
+    for x in range(100):
+        key = '/services/%d' % x
+        etcd.set(key, u('up'), ttl=0.3)
+        registrations.append(keepalive.add(key, 0.3, prev_value=u('up')))
+    time.sleep(0.6)
+    assert len(etcd.get('/services').nodes) == 100
+    # Coalesced.
+    assert 2 <= keepalive.batches <= 6
+    # Replaced and deleted keys are reported.
+    etcd.set('/services/0', u('down'))
+    etcd.delete('/services/1')
+    registrations[2].stop()
+    time.sleep(0.6)
+    assert sorted(failures) == ['/services/0', '/services/1']
+    assert isinstance(keepalive.failed['/services/0'], etc.TestFailed)
+    assert isinstance(keepalive.failed['/services/1'], etc.KeyNotFound)
+    assert registrations[0].lost
+    assert len(keepalive) == 97
+    with pytest.raises(etc.KeyNotFound):
+        etcd.get('/services/2')
+    assert len(etcd.get('/services').nodes) == 98
+    # Locks share the keepalive.
+    lock = Lock(etcd, '/locks/etc', ttl=0.3, keepalive=keepalive)
+    lock.acquire()
+    other = Lock(etcd, '/locks/etc', ttl=0.3, keepalive=keepalive)
+    assert not other.acquire(timeout=0.6)
+    lock.release()
+    assert len(keepalive) == 97
+    thread = keepalive.thread
+    keepalive.stop()
+    assert not thread.is_alive()
+    # Restarted by a new registration.
+    keepalive.add('/services/0', 10)
+    assert keepalive.thread is not thread
+    keepalive.stop()
+
+
+def test_queue(etcd):
+    queue = Queue(etcd, '/queue/etc', timeout=0.1)
+    assert queue.get_batch(10, block=False) == []
+    t = time.time()
+    assert queue.get_batch(10, timeout=0.1) == []
+    assert time.time() - t >= 0.1
+    queue.put(u('a'))
+    queue.put(u('b'))
+    queue.put(u('c'))
+    # Until the watch thread lists them.
+    for x in range(100):
+        if len(queue) == 3:
+            break
+        time.sleep(0.01)
+    assert queue.get_batch(2) == [u('a'), u('b')]
+    assert queue.get_batch(2) == [u('c')]
+    # Consumers in different processes.
+    consumers = [Queue(etcd, '/queue/etc', timeout=0.1) for x in range(4)]
+    values = [u(str(x)) for x in range(200)]
+    results = queue.put_many(values)
+    assert all(isinstance(r, etc.Created) for r in results)
+    consumed = []
+    def consume(queue):
+        while True:
+            batch = queue.get_batch(7, timeout=0.5)
+            if not batch:
+                break
+            consumed.extend(batch)
+    threads = [threading.Thread(target=consume, args=(c,))
+               for c in consumers]
+    for thread in threads:
+        thread.start()
+    queue.put(u('late'))
+    for thread in threads:
+        thread.join(10)
+    assert sorted(consumed) == sorted(values + [u('late')])
+    assert etcd.get('/queue/etc').nodes == []
+    for q in [queue] + consumers:
+        q.stop()
+        assert not q.thread.is_alive()
+
+
+def test_queue_failed_claims():
+    etcd = etc.etcd(mock=True)
+    errors = [etc.ConnectionError()]
+    class FlakyAdapter(ProxyAdapter):
+        def delete(self, *args, **kwargs):
+            if errors:
+                raise errors.pop(0)
+            return super(FlakyAdapter, self).delete(*args, **kwargs)
+    client = etc.Client(FlakyAdapter(etcd.adapter))
+    queue = Queue(client, '/queue/etc', timeout=0.1)
+    for value in [u('a'), u('b'), u('c')]:
+        queue.put(value)
+    with pytest.raises(etc.ConnectionError):
+        queue.get_batch(2)
+    # Not dropped.
+    assert len(queue) == 3
+    assert queue.get_batch(3) == [u('a'), u('b'), u('c')]
+    queue.stop()
+
+
+def test_queue_behind_history():
+    etcd = etc.etcd(mock=True, history_size=5)
+    queue = Queue(etcd, '/queue/etc', timeout=0.1)
+    queue.start()
+    thread = queue.thread
+    queue.stop()
+    thread.join()
+    queue.put_many([u(str(x)) for x in range(20)])
+    # The watch has fallen behind the history.
+    queue.stopped = False
+    thread = threading.Thread(target=queue.run)
+    thread.daemon = True
+    thread.start()
+    for x in range(100):
+        if queue.stale:
+            break
+        time.sleep(0.01)
+    assert queue.stale
+    assert queue.index == etcd.adapter.index
+    assert len(queue) == 0
+    # Listed again.
+    assert queue.get_batch(100) == [u(str(x)) for x in range(20)]
+    assert etcd.get('/queue/etc').nodes == []
+    queue.stopped = True
+    thread.join()
+
+
+def test_mock_server(spawn):
+    with MockServer() as server:
+        url = server.url + '/v2/keys/etc'
+        res = requests.get(url)
+        assert res.status_code == 404
+        assert res.json()['errorCode'] == 100
+        assert res.headers['X-Etcd-Index'] == '0'
+        res = requests.put(url, data={'value': 'a', 'ttl': 'x'})
+        assert (res.status_code, res.json()['errorCode']) == (400, 202)
+        res = requests.post(url, data={'value': 'a'})
+        assert res.status_code == 201
+        assert res.json()['node']['key'] == '/etc/%020d' % 1
+        # Many long-polling requests.
+        etcd = etc.etcd(server.url, wait_pool_maxsize=50)
+        results = []
+        for x in range(50):
+            spawn(lambda: results.append(etcd.wait('/etc', recursive=True)))
+        time.sleep(0.5)
+        etcd.set('/etc/b', u('b'))
+        time.sleep(0.5)
+        assert len(results) == 50
+        assert all(r.value == u('b') for r in results)
+        etcd.clear()
+    # Servers sharing a mock as a cluster.
+    servers = MockServer.cluster(2)
+    for server in servers:
+        server.start()
+    etcd = etc.etcd(','.join(s.url for s in servers), discover=True)
+    adapter = etcd.adapter
+    assert adapter.leader.url == servers[0].url
+    leader = adapter.leader
+    servers[0].stop()
+    # Writes go to the leader first then fail over.
+    etcd.set('/etc', u('1'))
+    assert leader.failures == 1
+    assert etcd.get('/etc').value == u('1')
+    etcd.clear()
+    servers[1].stop()
+
+
+def test_histogram():
+    histogram = Histogram([1, 2, 4, 8])
+    assert histogram.percentile(0.5) is None
+    for x in [0.5, 1.5, 1.5, 3, 100]:
+        histogram.add(x)
+    assert histogram.count == 5
+    assert histogram.percentile(0.2) == 1
+    assert histogram.percentile(0.5) == 2
+    assert histogram.percentile(0.8) == 4
+    assert histogram.percentile(1) == 100
+    assert histogram.to_dict()['max'] == 100
+
+
+def test_metrics(spawn_later):
+    servers = MockServer.cluster(2)
+    for server in servers:
+        server.start()
+    etcd = etc.etcd(','.join(s.url for s in servers), discover=True)
+    adapter = etcd.adapter
+    metrics = Metrics()
+    etcd.observe(metrics)
+    etcd.set('/etc', u('1'))
+    etcd.refresh('/etc', 10)
+    with pytest.raises(etc.KeyNotFound):
+        etcd.get('/xxx')
+    with pytest.raises(etc.TimedOut):
+        etcd.wait('/etc', timeout=0.1)
+    # Lagged by a change after the waited one.
+    r = etcd.set('/etc', u('2'))
+    etcd.set('/etc', u('3'))
+    etcd.wait('/etc', r.index)
+    assert list(etcd.walk('/')) != []
+    assert sorted(metrics.latencies) == \
+        ['get', 'refresh', 'set', 'wait', 'walk']
+    assert metrics.latencies['set'].count == 3
+    assert metrics.errors == {100: 1}
+    assert metrics.timeouts == {'wait': 1}
+    assert metrics.watch_lags.max == 1
+    assert metrics.http_latencies.count >= 7
+    assert metrics.bytes_sent > 0
+    assert metrics.bytes_received > 0
+    # Failed over.
+    servers[0].stop()
+    etcd.set('/etc', u('4'))
+    assert metrics.retries == {'set': 1}
+    assert json.loads(json.dumps(metrics.to_dict()))['retries'] == \
+        {'set': 1}
+    # Not intercepted without observers.
+    etcd.unobserve(metrics)
+    assert etcd.adapter is adapter
+    assert adapter.observers == []
+    etcd.get('/etc')
+    assert metrics.latencies['get'].count == 1
+    etcd.clear()
+    servers[1].stop()
+
+
+def test_retry_policy():
+    policy = RetryPolicy(backoff=0.1, max_backoff=0.3, jitter=0)
+    assert [policy.delay(x) for x in [1, 2, 3]] == [0.1, 0.2, 0.3]
+    assert 0.05 <= RetryPolicy(backoff=0.1, jitter=0.5).delay(1) <= 0.1
+    for error in [etc.ConnectionRefused(), etc.LeaderElect()]:
+        assert policy.is_retryable(error)
+    for error in [etc.ConnectionError(), etc.TimedOut(), etc.HTTPError(503)]:
+        assert not policy.is_retryable(error)
+        assert policy.is_retryable(error, idempotent=True)
+    assert not policy.is_retryable(etc.HTTPError(404), idempotent=True)
+    assert not policy.is_retryable(etc.KeyNotFound(), idempotent=True)
+    # Nobody listens.
+    dead = socket.socket()
+    dead.bind(('127.0.0.1', 0))
+    __, dead_port = dead.getsockname()
+    dead.close()
+    # Nobody responds.
+    silent = socket.socket()
+    silent.bind(('127.0.0.1', 0))
+    silent.listen(50)
+    __, silent_port = silent.getsockname()
+    metrics = Metrics()
+    def etcd(port, **kwargs):
+        policy = RetryPolicy(backoff=0.01, **kwargs)
+        client = etc.etcd('http://127.0.0.1:%d' % port, retry_policy=policy)
+        client.observe(metrics)
+        return client
+    with pytest.raises(etc.ConnectionRefused):
+        etcd(dead_port).append('/etc', u('1'))
+    assert metrics.retries == {'append': 2}
+    metrics.reset()
+    e = etcd(silent_port)
+    with pytest.raises(etc.TimedOut):
+        e.get('/etc', timeout=0.05)
+    with pytest.raises(etc.TimedOut):
+        e.create('/etc', u('1'), timeout=0.05)
+    with pytest.raises(etc.TimedOut):
+        e.set('/etc', u('1'), timeout=0.05)
+    with pytest.raises(etc.TimedOut):
+        e.wait('/etc', timeout=0.05)
+    assert metrics.retries == {'get': 2, 'set': 2}
+    metrics.reset()
+    e = etcd(dead_port, max_attempts=10,
+             budget=RetryBudget(ratio=0.5, reserve=2))
+    with pytest.raises(etc.ConnectionError):
+        e.get('/etc')
+    assert metrics.retries == {'get': 2}
+    with pytest.raises(etc.ConnectionError):
+        e.get('/etc')
+    assert metrics.retries == {'get': 2}
+    metrics.reset()
+    # Drops the connection after reading a request.
+    dropping = socket.socket()
+    dropping.bind(('127.0.0.1', 0))
+    dropping.listen(50)
+    __, dropping_port = dropping.getsockname()
+    received = []
+    def drop():
+        while True:
+            conn, __ = dropping.accept()
+            received.append(conn.recv(65536))
+            conn.close()
+    thread = threading.Thread(target=drop)
+    thread.daemon = True
+    thread.start()
+    e = etcd(dropping_port)
+    with pytest.raises(etc.ConnectionError) as excinfo:
+        e.append('/queue', u('job'))
+    assert not isinstance(excinfo.value, etc.ConnectionRefused)
+    assert len(received) == 1
+    assert metrics.retries == {}
+    with pytest.raises(etc.ConnectionError):
+        e.get('/queue')
+    assert len(received) == 4
+    assert metrics.retries == {'get': 2}
+    silent.close()
+    dropping.close()
+
+
+def test_make_node():
+    from etc.adapters.etcd import EtcdAdapter
+    data = {'key': '/etc', 'value': 'etc', 'modifiedIndex': 1,
+            'createdIndex': 1, 'ttl': 10,
+            'expiration': '2017-01-01T00:00:00.123456789Z'}
+    node = EtcdAdapter.make_node(data)
+    assert isinstance(node.expiration, datetime)
+    assert node.expiration.year == 2017
+    assert node == EtcdAdapter.make_node(data)
+    # Deeper than the recursion limit.
+    root = data = {'dir': True}
+    for x in range(5000):
+        sub_data = {'key': '/%d' % x, 'dir': True,
+                    'modifiedIndex': x, 'createdIndex': x}
+        data['nodes'] = [sub_data, {'key': '/v', 'value': 'v',
+                                    'modifiedIndex': x, 'createdIndex': x}]
+        data = sub_data
+    node = EtcdAdapter.make_node(root)
+    for x in range(5000):
+        assert node_keys(node.nodes) == ['/%d' % x, '/v']
+        node = node.nodes[0]
+
+
+def test_walk(etcd):
+    etcd.set('/etc', dir=True)
+    etcd.set('/etc/a', u('1'))
+    etcd.set('/etc/d', dir=True)
+    etcd.set('/etc/d/b', u('2'))
+    etcd.set('/etc/d/e', dir=True)
+    values = sorted(etcd.walk('/etc'), key=lambda n: n.key)
+    assert node_keys(values) == ['/etc/a', '/etc/d/b']
+    assert node_values(values) == [u('1'), u('2')]
+    assert node_keys(etcd.walk('/etc/a')) == ['/etc/a']
+    with pytest.raises(etc.KeyNotFound):
+        list(etcd.walk('/xxx'))
+
+
+def test_leaf_scanner():
+    from etc.adapters.etcd import EtcdAdapter, LeafScanner
+    data = {'action': 'get', 'node': {'dir': True, 'nodes': [
+        {'key': '/a', 'value': u'{"}\\\\', 'modifiedIndex': 1,
+         'createdIndex': 1},
+        {'key': '/b', 'dir': True, 'modifiedIndex': 2, 'createdIndex': 2,
+         'nodes': [{'key': '/b/c', 'value': u'\uc0ac{', 'modifiedIndex': 3,
+                    'createdIndex': 3}]},
+        {'key': '/d', 'dir': True, 'modifiedIndex': 4, 'createdIndex': 4},
+    ]}}
+    text = json.dumps(data, ensure_ascii=False)
+    for size in [1, 2, 7, len(text)]:
+        scanner = LeafScanner()
+        texts = []
+        for x in range(0, len(text), size):
+            texts.extend(scanner.feed(text[x:x + size]))
+        assert [json.loads(t)['key'] for t in texts] == ['/a', '/b/c', '/d']
+        assert len(scanner.buf) < 2
+    res = requests.Response()
+    res.raw = io.BytesIO(json.dumps(data).encode())
+    res.encoding = 'utf-8'
+    values = list(EtcdAdapter.iter_values(res, chunk_size=3))
+    assert node_values(values) == [u'{"}\\\\', u'\uc0ac{']
+
+
 def test_chunked_encoding_error(spawn):
     server = socket.socket()
     server.bind(('', 0))
@@ -274,7 +1286,6 @@ def test_session(monkeypatch):
         etcd.get('/')
 
 
-@pytest.mark.etcd(skip=['mock'])
 def test_refresh(etcd, spawn):
     with pytest.raises(etc.KeyNotFound):
         # Key not set yet.
@@ -305,6 +1316,22 @@ def test_refresh(etcd, spawn):
     assert time.time() - t >= 1
 
 
+def test_connection_pool():
+    etcd = etc.etcd(pool_maxsize=3, pool_block=True, wait_pool_maxsize=20,
+                    keep_alive=False)
+    adapter = etcd.adapter
+    assert adapter.max_workers == 3
+    def pool_kw(session):
+        return session.get_adapter('http://').poolmanager.connection_pool_kw
+    kw = pool_kw(adapter.session)
+    assert (kw['maxsize'], kw['block']) == (3, True)
+    kw = pool_kw(adapter.wait_session)
+    assert (kw['maxsize'], kw['block']) == (20, False)
+    assert adapter.session.headers['Connection'] == 'close'
+    etcd = etc.etcd()
+    assert etcd.adapter.session.headers.get('Connection') != 'close'
+
+
 def test_503_service_unavailable(spawn):
     server = socket.socket()
     server.bind(('', 0))
@@ -339,3 +1366,128 @@ def test_bad_status_line(spawn):
         etcd.get('/etc')
     assert 'BadStatusLine' in str(excinfo.value)
     server.close()
+
+
+@pytest.mark.etcd(skip=['mock'])
+def test_asyncio(etcd):
+    asyncio = pytest.importorskip('asyncio')
+    pytest.importorskip('aiohttp')
+    with pytest.raises(ValueError):
+        etc.etcd(mock=True, asyncio=True)
+    with pytest.raises(ValueError):
+        etc.etcd([etcd.url, etcd.url], asyncio=True)
+    with pytest.raises(TypeError):
+        etc.etcd(etcd.url, asyncio=True, pool_maxsize=100)
+    aioetcd = etc.etcd(etcd.url, asyncio=True)
+    assert isinstance(aioetcd, etc.AsyncClient)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    run = loop.run_until_complete
+    try:
+        r = run(aioetcd.set('/etc', u'1'))
+        assert r.__class__ is etc.Set
+        rs = run(asyncio.gather(*[aioetcd.get('/etc') for x in range(100)]))
+        assert all(r.value == u'1' for r in rs)
+        waiting = asyncio.ensure_future(aioetcd.wait('/etc', r.index + 1))
+        r = run(aioetcd.set('/etc', u'2'))
+        assert run(waiting).value == u'2'
+        with pytest.raises(etc.TimedOut):
+            run(aioetcd.wait('/etc', r.index + 1, timeout=0.1))
+        with pytest.raises(etc.KeyNotFound):
+            run(aioetcd.get('/xxx'))
+        # An asynchronous generator.
+        watching = aioetcd.watch('/etc', r.index, timeout=0.1,
+                                 heartbeat=True)
+        assert run(watching.__anext__()).value == u'2'
+        assert run(watching.__anext__()) is None
+        run(aioetcd.set('/etc', u'3'))
+        assert run(watching.__anext__()).value == u'3'
+        run(watching.aclose())
+        # Observed.
+        metrics = Metrics()
+        adapter = aioetcd.adapter
+        aioetcd.observe(metrics)
+        run(aioetcd.set('/etc', u'4'))
+        with pytest.raises(etc.KeyNotFound):
+            run(aioetcd.get('/xxx'))
+        assert run(aioetcd.wait('/etc', r.index + 1)).value == u'3'
+        walking = aioetcd.walk('/')
+        assert run(walking.__anext__()).value == u'4'
+        with pytest.raises(StopAsyncIteration):
+            run(walking.__anext__())
+        assert set(metrics.latencies) == set(['set', 'get', 'wait', 'walk'])
+        assert metrics.errors == {100: 1}
+        assert metrics.http_latencies.count == 4
+        assert metrics.bytes_sent == len('value=4')
+        aioetcd.unobserve(metrics)
+        assert aioetcd.adapter is adapter
+    finally:
+        run(aioetcd.clear())
+        loop.close()
+
+
+def test_cluster_failover(spawn):
+    dead_server = socket.socket()
+    dead_server.bind(('', 0))
+    __, dead_port = dead_server.getsockname()
+    dead_server.close()
+    server = socket.socket()
+    server.bind(('', 0))
+    server.listen(10)
+    __, port = server.getsockname()
+    def web_server():
+        data = ('{"action":"get","node":{"key":"/etc","value":'
+                '"ok","modifiedIndex":42,"createdIndex":42}}')
+        response = '\r\n'.join([
+            'HTTP/1.1 200 OK',
+            'Content-Type: application/json',
+            'Content-Length: %d' % len(data),
+            'X-Etcd-Index: 42',
+            'X-Raft-Index: 42',
+            'X-Raft-Term: 42',
+            'Connection: close',
+        ]) + '\r\n\r\n' + data
+        for x in range(3):
+            conn, __ = server.accept()
+            conn.recv(999999)
+            conn.send(response.encode())
+            conn.close()
+    spawn(web_server)
+    etcd = etc.etcd('http://127.0.0.1:%d,http://127.0.0.1:%d' %
+                    (dead_port, port))
+    adapter = etcd.adapter
+    dead, alive = adapter.members
+    assert etcd.get('/etc').value == u'ok'
+    assert dead.failures == 1
+    assert not dead.is_healthy()
+    assert alive.latency is not None
+    assert adapter.read_members() == [alive, dead]
+    assert etcd.get('/etc').value == u'ok'
+    assert dead.failures == 1
+    # An unguarded write fails over when it hasn't been sent.
+    dead.down_until = 0
+    assert adapter.write_members() == [dead, alive]
+    assert etcd.append('/etc', u('1')).value == u'ok'
+    assert dead.failures == 2
+    etcd.clear()
+    server.close()
+    # But not when it might have been sent.
+    dropping_server = socket.socket()
+    dropping_server.bind(('', 0))
+    dropping_server.listen(10)
+    __, dropping_port = dropping_server.getsockname()
+    def dropping_web_server():
+        conn, __ = dropping_server.accept()
+        conn.recv(999999)
+        conn.close()
+    spawn(dropping_web_server)
+    etcd = etc.etcd('http://127.0.0.1:%d,http://127.0.0.1:%d'
+                    % (dropping_port, dead_port))
+    dropping, dead = etcd.adapter.members
+    with pytest.raises(etc.ConnectionError) as excinfo:
+        etcd.append('/etc', u('1'))
+    assert not isinstance(excinfo.value, etc.ConnectionRefused)
+    assert dropping.failures == 1
+    assert dead.failures == 0
+    etcd.clear()
+    dropping_server.close()